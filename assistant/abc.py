@@ -1,5 +1,4 @@
 from abc import ABC, ABCMeta, abstractmethod
-from multiprocessing.pool import Pool
 from typing import Callable, Dict, List, Optional, Union
 
 import discord
@@ -8,7 +7,13 @@ from openai.types.chat.chat_completion_message import ChatCompletionMessage
 from redbot.core import commands
 from redbot.core.bot import Red
 
+from .common.conversations import ConversationStore
+from .common.embeddings import EmbeddingBatcher, EmbeddingCache
 from .common.models import DB, GuildSettings
+from .common.regex import RegexPool
+from .common.streaming import StreamEditor
+from .common.telemetry import Telemetry
+from .common.vectors import VectorStore
 
 
 class CompositeMetaClass(CogMeta, ABCMeta):
@@ -21,8 +26,13 @@ class MixinMeta(ABC):
     def __init__(self, *_args):
         self.bot: Red
         self.db: DB
-        self.mp_pool: Pool
+        self.regex_pool: RegexPool
+        self.telemetry: Telemetry
         self.registry: Dict[str, Dict[str, dict]]
+        self.embedding_cache: EmbeddingCache
+        self.embedding_batcher: EmbeddingBatcher
+        self.vector_store: VectorStore
+        self.conversation_store: ConversationStore
 
     @abstractmethod
     async def openai_status(self) -> str:
@@ -38,6 +48,7 @@ class MixinMeta(ABC):
         response_token_override: int = None,
         model_override: Optional[str] = None,
         temperature_override: Optional[float] = None,
+        stream: Optional[StreamEditor] = None,
     ) -> Union[ChatCompletionMessage, str]:
         raise NotImplementedError
 
@@ -45,6 +56,10 @@ class MixinMeta(ABC):
     async def request_embedding(self, text: str, conf: GuildSettings) -> List[float]:
         raise NotImplementedError
 
+    @abstractmethod
+    async def request_embeddings(self, texts: List[str], conf: GuildSettings) -> List[List[float]]:
+        raise NotImplementedError
+
     @abstractmethod
     async def can_call_llm(self, conf: GuildSettings, ctx: Optional[commands.Context] = None) -> bool:
         raise NotImplementedError
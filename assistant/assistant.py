@@ -1,6 +1,6 @@
 import asyncio
 import logging
-from multiprocessing.pool import Pool
+from datetime import datetime
 from time import perf_counter
 from typing import Callable, Dict, List, Literal, Optional, Union
 
@@ -9,6 +9,7 @@ from discord.ext import tasks
 from pydantic import ValidationError
 from redbot.core import Config, commands
 from redbot.core.bot import Red
+from redbot.core.data_manager import cog_data_path
 
 from .abc import CompositeMetaClass
 from .commands import AssistantCommands
@@ -24,9 +25,14 @@ from .common.constants import (
     SEARCH_INTERNET,
     SEARCH_MEMORIES,
 )
+from .common.conversations import IDLE_UNLOAD, SWEEP_INTERVAL, ConversationStore
+from .common.embeddings import EmbeddingBatcher, EmbeddingCache
 from .common.functions import AssistantFunctions
-from .common.models import DB, Embedding, EmbeddingEntryExists, NoAPIKey
+from .common.models import DB, Conversation, Embedding, EmbeddingEntryExists, NoAPIKey
+from .common.regex import RegexPool
+from .common.telemetry import Telemetry
 from .common.utils import json_schema_invalid
+from .common.vectors import VectorStore
 from .listener import AssistantListener
 
 log = logging.getLogger("red.vrt.assistant")
@@ -56,7 +62,7 @@ class Assistant(
     """
 
     __author__ = "[vertyco](https://github.com/vertyco/vrt-cogs)"
-    __version__ = "6.18.8"
+    __version__ = "6.27.0"
 
     def format_help_for_context(self, ctx):
         helpcmd = super().format_help_for_context(ctx)
@@ -64,9 +70,10 @@ class Assistant(
 
     async def red_delete_data_for_user(self, *, requester, user_id: int):
         """No data to delete"""
-        for key in self.db.conversations.copy():
+        for key in await asyncio.to_thread(self.db.conversation_keys):
             if key.split("-")[0] == str(user_id):
-                del self.db.conversations[key]
+                self.db.delete_conversation(key)
+        await self.save_conf()
 
     def __init__(self, bot: Red, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -74,20 +81,33 @@ class Assistant(
         self.config = Config.get_conf(self, 117117117, force_registration=True)
         self.config.register_global(db={})
         self.db: DB = DB()
-        self.mp_pool = Pool()
+        self.regex_pool = RegexPool()
+        self.telemetry = Telemetry()
 
         # {cog_name: {function_name: {"permission_level": "user", "schema": function_json_schema}}}
         self.registry: Dict[str, Dict[str, dict]] = {}
 
+        self.embedding_cache = EmbeddingCache(cog_data_path(self) / "embedding_cache.msgpack")
+        self.embedding_batcher = EmbeddingBatcher()
+        self.vector_store = VectorStore(cog_data_path(self) / "vectors")
+        self.conversation_store = ConversationStore(cog_data_path(self) / "conversations")
+        self.db.attach_store(self.conversation_store)
+
         self.saving = False
         self.first_run = True
+        self.last_sweep = 0.0
 
     async def cog_load(self) -> None:
         asyncio.create_task(self.init_cog())
 
     async def cog_unload(self):
         self.save_loop.cancel()
-        self.mp_pool.close()
+        await asyncio.to_thread(self.regex_pool.close)
+        if snapshot := self.embedding_cache.snapshot():
+            await asyncio.to_thread(self.embedding_cache.write, snapshot)
+        if self.db.persistent_conversations:
+            changed = self.conversation_store.snapshot(self.db.conversations)
+            await asyncio.to_thread(self.conversation_store.write, changed)
         self.bot.dispatch("assistant_cog_remove")
 
     async def init_cog(self):
@@ -101,19 +121,39 @@ class Assistant(
             if "conversations" in data:
                 del data["conversations"]
             self.db = await asyncio.to_thread(DB.model_validate, data)
+        self.db.attach_store(self.conversation_store)
 
         log.info(f"Config loaded in {round((perf_counter() - start) * 1000, 2)}ms")
+        self.embedding_cache.max_size = self.db.embed_cache_size
+        self.embedding_batcher.configure(self.db.embed_batch_size, self.db.embed_concurrency)
+        cached = await asyncio.to_thread(self.embedding_cache.load)
+        log.info(f"Loaded {cached} cached embeddings")
+        vectors = await asyncio.to_thread(self.vector_store.load, self.db.configs)
+        log.info(f"Loaded {vectors} embedding vectors")
+        await asyncio.to_thread(self.regex_pool.start)
         await asyncio.to_thread(self._cleanup_db)
+        inline = any(
+            "embedding" in em for conf in data.get("configs", {}).values() for em in conf.get("embeddings", {}).values()
+        )
+        if inline:
+            # Vectors from before they moved out of the config, write them out and drop them from it
+            log.info("Moving embedding vectors out of the config")
+            await self.save_conf()
+        elif data.get("conversations"):
+            # Conversations from before they moved out of the config
+            log.info("Moving conversations out of the config")
+            await self.save_conf()
 
         # Register internal functions
-        await self.register_function(self.qualified_name, GENERATE_IMAGE)
-        await self.register_function(self.qualified_name, EDIT_IMAGE)
+        # Image models can take a few minutes, so these get more room than the guild's timeout
+        await self.register_function(self.qualified_name, GENERATE_IMAGE, timeout=300)
+        await self.register_function(self.qualified_name, EDIT_IMAGE, timeout=300)
         await self.register_function(self.qualified_name, SEARCH_INTERNET)
         await self.register_function(self.qualified_name, CREATE_MEMORY)
         await self.register_function(self.qualified_name, SEARCH_MEMORIES)
         await self.register_function(self.qualified_name, EDIT_MEMORY)
         await self.register_function(self.qualified_name, LIST_MEMORIES)
-        await self.register_function(self.qualified_name, RESPOND_AND_CONTINUE)
+        await self.register_function(self.qualified_name, RESPOND_AND_CONTINUE, concurrent=False)
 
         logging.getLogger("openai").setLevel(logging.WARNING)
         logging.getLogger("aiocache").setLevel(logging.WARNING)
@@ -133,8 +173,16 @@ class Assistant(
             start = perf_counter()
             if not self.db.persistent_conversations:
                 self.db.conversations.clear()
+                await asyncio.to_thread(self.conversation_store.clear)
+            else:
+                await self.save_conversations()
+            # Vectors first, so the config never references entries whose vectors weren't written
+            if changed := self.vector_store.snapshot(self.db.configs):
+                await asyncio.to_thread(self.vector_store.write, changed)
             dump = await asyncio.to_thread(self.db.model_dump)
             await self.config.db.set(dump)
+            if snapshot := self.embedding_cache.snapshot():
+                await asyncio.to_thread(self.embedding_cache.write, snapshot)
             txt = f"Config saved in {round((perf_counter() - start) * 1000, 2)}ms"
             if self.first_run:
                 log.info(txt)
@@ -146,6 +194,74 @@ class Assistant(
         if not self.db.persistent_conversations and self.save_loop.is_running():
             self.save_loop.cancel()
 
+    async def save_conversations(self):
+        """Write conversations that changed, clean up expired ones and unload idle ones"""
+        now = datetime.now().timestamp()
+        idle = []
+        for key, conversation in list(self.db.conversations.items()):
+            member_id, _, guild_id = key.split("-")
+            conf = self.db.configs.get(int(guild_id))
+            guild = self.bot.get_guild(int(guild_id))
+            if conf is None or guild is None:
+                self.db.delete_conversation(key)
+                continue
+            if conversation.is_expired(conf, guild.get_member(int(member_id))):
+                # Same as what cleanup() would do the next time it's used
+                conversation.messages.clear()
+                if not conversation.system_prompt_override:
+                    self.db.delete_conversation(key)
+                    continue
+            if now - conversation.last_updated > IDLE_UNLOAD:
+                idle.append(key)
+
+        if now - self.last_sweep > SWEEP_INTERVAL:
+            self.last_sweep = now
+            await self.sweep_conversations()
+
+        changed = self.conversation_store.snapshot(self.db.conversations)
+        if changed:
+            await asyncio.to_thread(self.conversation_store.write, changed)
+        for key in idle:
+            conversation = self.db.conversations.get(key)
+            # Unless it was used while writing
+            if conversation is not None and now - conversation.last_updated > IDLE_UNLOAD:
+                del self.db.conversations[key]
+                self.conversation_store.unload(key)
+        if changed or idle:
+            log.debug(f"Wrote {len(changed)} conversations, unloaded {len(idle)} idle ones")
+
+    async def sweep_conversations(self):
+        """Expire conversations on disk that were never loaded again, going by when their file was last written"""
+        now = datetime.now().timestamp()
+        ages = await asyncio.to_thread(self.conversation_store.ages, list(self.db.conversations))
+        expired = []
+        for key, written in ages.items():
+            member_id, _, guild_id = key.split("-")
+            conf = self.db.configs.get(int(guild_id))
+            guild = self.bot.get_guild(int(guild_id))
+            if conf is None or guild is None:
+                self.db.delete_conversation(key)
+                continue
+            max_time = conf.get_user_max_time(guild.get_member(int(member_id)))
+            if max_time and now - written > max_time:
+                expired.append(key)
+        if not expired:
+            return
+        # Conversations with a system prompt override only lose their messages, like in save_conversations
+        overrides = await asyncio.to_thread(self.conversation_store.overrides, expired)
+        for key in expired:
+            if key in self.db.conversations:
+                # Loaded while sweeping, save_conversations handles it from here
+                continue
+            if key in overrides:
+                if overrides[key].get("messages"):
+                    conversation = Conversation.model_validate(overrides[key])
+                    conversation.messages.clear()
+                    self.db.conversations[key] = conversation
+            elif self.conversation_store.exists(key):
+                self.db.delete_conversation(key)
+        log.debug(f"Swept {len(expired)} expired conversations from disk")
+
     def _cleanup_db(self):
         cleaned = False
         # Cleanup registry if any cogs no longer exist
@@ -330,6 +446,8 @@ class Assistant(
         cog_name: str,
         schema: dict,
         permission_level: Literal["user", "mod", "admin", "owner"] = "user",
+        timeout: Optional[float] = None,
+        concurrent: bool = True,
     ) -> bool:
         """Allow 3rd party cogs to register their functions for the model to use
 
@@ -337,6 +455,11 @@ class Assistant(
             cog_name (str): the name of the cog registering the function
             schema (dict): JSON schema representation of the command (see https://json-schema.org/understanding-json-schema/)
             permission_level (str): the permission level required to call the function (user, mod, admin, owner)
+            timeout (float, optional): seconds the function gets to finish, defaults to the guild's function timeout.
+                Sync functions can't be stopped, a timed out call keeps running in its thread and its side effects
+                can still happen
+            concurrent (bool, optional): whether the function can run alongside other calls from the same response,
+                set to False for functions with side effects that depend on call order
 
         Returns:
             bool: True if function was successfully registered
@@ -376,7 +499,12 @@ class Assistant(
             self.registry[cog_name] = {}
 
         log.info(f"The {cog_name} cog registered a function object: {function_name}")
-        self.registry[cog_name][function_name] = {"permission_level": permission_level, "schema": schema}
+        self.registry[cog_name][function_name] = {
+            "permission_level": permission_level,
+            "schema": schema,
+            "timeout": timeout,
+            "concurrent": concurrent,
+        }
         return True
 
     async def unregister_function(self, cog_name: str, function_name: str) -> None:
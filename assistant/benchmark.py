@@ -0,0 +1,135 @@
+"""
+Benchmarks for Assistant's embedding search
+
+Builds random embeddings and compares the in-process index (`VectorIndex`) with a Chroma collection:
+- Build time (indexing every vector)
+- Query latency for top-n searches
+- Recall of each engine against an exact search
+
+Usage (from the repo root):
+    python -m assistant.benchmark
+    python -m assistant.benchmark --entries 1000 10000 50000 --dims 1536 --json results.json
+"""
+
+import argparse
+import logging
+import typing as t
+from time import perf_counter
+
+import numpy as np
+import orjson
+
+from .common.vectors import VectorIndex
+
+try:
+    import chromadb
+except ImportError:
+    chromadb = None
+
+
+def random_vectors(rng: np.random.Generator, count: int, dims: int) -> np.ndarray:
+    # Real embeddings cluster, so mix a few shared directions in rather than using pure noise
+    centers = rng.standard_normal((32, dims)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), count)] + rng.standard_normal((count, dims)).astype(np.float32)
+    return vectors.astype(np.float32)
+
+
+def exact_top_n(vectors: np.ndarray, query: np.ndarray, top_n: int) -> t.Set[int]:
+    normed = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normed @ (query / np.linalg.norm(query))
+    return set(np.argsort(scores)[::-1][:top_n].tolist())
+
+
+def summarize(name: str, entries: int, build: float, timings: t.List[float], recall: float) -> t.Dict[str, t.Any]:
+    timings = sorted(timings)
+    return {
+        "name": name,
+        "entries": entries,
+        "build_ms": build * 1000,
+        "queries": len(timings),
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+        "recall": recall,
+    }
+
+
+def bench(entries: int, dims: int, queries: int, top_n: int, seed: int) -> t.List[t.Dict[str, t.Any]]:
+    rng = np.random.default_rng(seed)
+    vectors = random_vectors(rng, entries, dims)
+    names = [f"entry-{i}" for i in range(entries)]
+    probes = vectors[rng.integers(0, entries, queries)] + rng.standard_normal((queries, dims)).astype(np.float32) * 0.5
+    expected = [exact_top_n(vectors, probe, top_n) for probe in probes]
+
+    def _recall(found: t.List[t.List[str]]) -> float:
+        hits = sum(len({int(name.split("-")[1]) for name in result} & want) for result, want in zip(found, expected))
+        return hits / (len(expected) * top_n)
+
+    results = []
+
+    start = perf_counter()
+    index = VectorIndex(names, vectors, entries)
+    build = perf_counter() - start
+    timings, found = [], []
+    for probe in probes:
+        start = perf_counter()
+        found.append([name for name, _ in index.search(probe, top_n)])
+        timings.append(perf_counter() - start)
+    results.append(summarize("local index", entries, build, timings, _recall(found)))
+
+    if chromadb is None:
+        return results
+
+    client = chromadb.Client()
+    collection = client.create_collection(f"benchmark-{entries}-{dims}", configuration={"hnsw": {"space": "cosine"}})
+    batch_size = client.get_max_batch_size()
+    start = perf_counter()
+    for idx in range(0, entries, batch_size):
+        collection.add(ids=names[idx : idx + batch_size], embeddings=vectors[idx : idx + batch_size])
+    build = perf_counter() - start
+    timings, found = [], []
+    for probe in probes:
+        start = perf_counter()
+        res = collection.query(query_embeddings=[probe], n_results=top_n)
+        timings.append(perf_counter() - start)
+        found.append(res["ids"][0])
+    results.append(summarize("chroma", entries, build, timings, _recall(found)))
+    client.delete_collection(collection.name)
+    return results
+
+
+def print_results(results: t.List[t.Dict[str, t.Any]]) -> None:
+    header = f"{'engine':<14} {'entries':>9} {'build ms':>11} {'queries':>8} {'p50 ms':>9} {'p99 ms':>9} {'recall':>7}"
+    print(header)
+    print("-" * len(header))
+    for res in results:
+        print(
+            f"{res['name']:<14} {res['entries']:>9} {res['build_ms']:>11.1f} {res['queries']:>8} "
+            f"{res['p50_ms']:>9.3f} {res['p99_ms']:>9.3f} {res['recall']:>7.3f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Assistant's embedding search")
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 5000, 20000], help="Embedding counts to test")
+    parser.add_argument("--dims", type=int, default=1536, help="Vector size, 1536 for text-embedding-3-small")
+    parser.add_argument("--queries", type=int, default=200, help="Searches per engine")
+    parser.add_argument("--top-n", type=int, default=3, help="Results per search")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if chromadb is None:
+        print("chromadb is not installed, only the local index will be tested")
+    results = []
+    for entries in args.entries:
+        results.extend(bench(entries, args.dims, args.queries, args.top_n, args.seed))
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "wb") as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    main()
@@ -31,6 +31,7 @@ from redbot.core.utils.chat_formatting import (
 from ..abc import MixinMeta
 from ..common.constants import MODELS, PRICES
 from ..common.models import DB, Embedding
+from ..common.tokens import token_cache
 from ..common.utils import get_attachments
 from ..views import CodeMenu, EmbeddingMenu, SetAPI
 
@@ -86,6 +87,7 @@ class Admin(MixinMeta):
             + _("`Mention on Reply:    `{}\n").format(conf.mention)
             + _("`Respond to Mentions: `{}\n").format(conf.mention_respond)
             + _("`Collaborative Mode:  `{}\n").format(conf.collab_convos)
+            + _("`Stream Responses:    `{}\n").format(conf.stream_responses)
             + _("`Max Retention:       `{}\n").format(conf.max_retention)
             + _("`Retention Expire:    `{}s\n").format(conf.max_retention_time)
             + _("`Max Tokens:          `{}\n").format(conf.max_tokens)
@@ -182,6 +184,8 @@ class Admin(MixinMeta):
         custom_func_field = (
             _("`Function Calling:  `{}\n").format(conf.use_function_calls)
             + _("`Maximum Recursion: `{}\n").format(conf.max_function_calls)
+            + _("`Concurrent Calls:  `{}\n").format(conf.max_concurrent_functions)
+            + _("`Call Timeout:      `{}\n").format(f"{conf.function_timeout}s" if conf.function_timeout else _("None"))
             + _("`Function Tokens:   `{}\n").format(humanize_number(func_tokens))
         )
         if self.registry:
@@ -927,6 +931,23 @@ class Admin(MixinMeta):
             await ctx.send(_("Collaborative conversations are now **Enabled**"))
         await self.save_conf()
 
+    @assistant.command(name="streaming", aliases=["stream"])
+    async def toggle_streaming(self, ctx: commands.Context):
+        """
+        Toggle streaming responses
+
+        Replies are posted as soon as the model starts writing and edited as the rest comes in.
+        Replies that end up too long for a single message are re-sent in full once they're complete.
+        """
+        conf = self.db.get_conf(ctx.guild)
+        if conf.stream_responses:
+            conf.stream_responses = False
+            await ctx.send(_("Streaming responses are now **Disabled**"))
+        else:
+            conf.stream_responses = True
+            await ctx.send(_("Streaming responses are now **Enabled**"))
+        await self.save_conf()
+
     @assistant.command(name="maxretention")
     async def max_retention(self, ctx: commands.Context, max_retention: int):
         """
@@ -1085,6 +1106,36 @@ class Admin(MixinMeta):
         )
         conf.max_function_calls = recursion
 
+    @assistant.command(name="functionconcurrency")
+    async def set_function_concurrency(self, ctx: commands.Context, limit: int):
+        """Set how many function calls from a single response can run at once
+
+        When the model calls several functions at the same time they are run side by side, up to this limit.
+        Repeat calls to the same function, memory functions and functions that opted out always run one after another.
+        Set to 1 to run them one after another.
+        """
+        conf = self.db.get_conf(ctx.guild)
+        conf.max_concurrent_functions = max(1, limit)
+        await ctx.send(_("Up to {} function calls will now run at once").format(conf.max_concurrent_functions))
+        await self.save_conf()
+
+    @assistant.command(name="functiontimeout")
+    async def set_function_timeout(self, ctx: commands.Context, seconds: int):
+        """Set how long a function call can take before it's abandoned
+
+        The model is told the call timed out so it can carry on without it.
+        Functions that aren't async can't be stopped, they finish in the background and their side effects still happen.
+        Cogs can set their own timeout for the functions they register, image generation gets 5 minutes.
+        Set to 0 for no limit (default).
+        """
+        conf = self.db.get_conf(ctx.guild)
+        conf.function_timeout = max(0, seconds)
+        if conf.function_timeout:
+            await ctx.send(_("Function calls will now time out after {} seconds").format(conf.function_timeout))
+        else:
+            await ctx.send(_("Function calls no longer time out"))
+        await self.save_conf()
+
     @assistant.command(name="minlength")
     async def min_length(self, ctx: commands.Context, min_question_length: int):
         """
@@ -1213,6 +1264,7 @@ class Admin(MixinMeta):
             return await ctx.send(_("Not wiping embedding data"))
         conf = self.db.get_conf(ctx.guild)
         conf.embeddings = {}
+        await asyncio.to_thread(conf.sync_embeddings, ctx.guild.id)
         await ctx.send(_("All embedding data has been wiped!"))
         await self.save_conf()
 
@@ -1225,9 +1277,9 @@ class Admin(MixinMeta):
         """
         if not yes_or_no:
             return await ctx.send(_("Not wiping conversations"))
-        for key, convo in self.db.conversations.items():
+        for key in await asyncio.to_thread(self.db.conversation_keys):
             if ctx.guild.id == int(key.split("-")[2]):
-                convo.messages.clear()
+                self.db.delete_conversation(key)
         await ctx.send(_("Conversations have been wiped in this server!"))
         await self.save_conf()
 
@@ -1394,35 +1446,35 @@ class Admin(MixinMeta):
 
         df = await asyncio.to_thread(pd.concat, frames)
 
-        entries = len(df.index)
-        split_by = 10
-        if entries > 300:
-            split_by = round(entries / 25)
-        imported = 0
-        for index, row in enumerate(df.values):
+        pending = []
+        for row in df.values:
             if pd.isna(row[0]) or pd.isna(row[1]):
                 continue
             name = str(row[0])
-            proc = _("processing")
             if name in conf.embeddings:
-                proc = _("overwriting")
                 if row[1] == conf.embeddings[name].text or not overwrite:
                     continue
-            text = str(row[1])[:4000]
-            if index and (index + 1) % split_by == 0:
+            pending.append((name, str(row[1])[:4000]))
+
+        # Rows are embedded a batch at a time instead of one API call each
+        imported = 0
+        batch_size = self.db.embed_batch_size
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start : start + batch_size]
+            if start:
                 with contextlib.suppress(discord.DiscordServerError):
                     await message.edit(
                         content=_("{}\n`Currently {}: `**{}** ({}/{})").format(
-                            message_text, proc, name, index + 1, len(df)
+                            message_text, _("processing"), chunk[0][0], start + 1, len(pending)
                         )
                     )
-            query_embedding = await self.request_embedding(text, conf)
-            if len(query_embedding) == 0:
-                await ctx.send(_("Failed to process embedding: `{}`").format(name))
-                continue
-
-            conf.embeddings[name] = Embedding(text=text, embedding=query_embedding, model=conf.embed_model)
-            imported += 1
+            embeddings = await self.request_embeddings([i[1] for i in chunk], conf)
+            for (name, text), query_embedding in zip(chunk, embeddings):
+                if len(query_embedding) == 0:
+                    await ctx.send(_("Failed to process embedding: `{}`").format(name))
+                    continue
+                conf.embeddings[name] = Embedding(text=text, embedding=query_embedding, model=conf.embed_model)
+                imported += 1
         await asyncio.to_thread(conf.sync_embeddings, ctx.guild.id)
         await message.edit(content=_("{}\n**COMPLETE**").format(message_text))
         await ctx.send(_("Successfully imported {} embeddings!").format(humanize_number(imported)))
@@ -1520,42 +1572,40 @@ class Admin(MixinMeta):
             message_text = _("Processing the following files in the background\n{}").format(box(humanize_list(files)))
             message = await ctx.send(message_text)
             df = await asyncio.to_thread(pd.concat, frames)
-            entries = len(df.index)
-            split_by = 10
-            if entries > 300:
-                split_by = round(entries / 25)
-            imported = 0
-            for index, row in df.iterrows():
+            pending = []
+            for _index, row in df.iterrows():
                 name = row["name"]
                 text = row["text"]
-                proc = _("processing")
                 if name in conf.embeddings:
-                    proc = _("overwriting")
                     if not overwrite or conf.embeddings[name].text == text:
                         continue
-                created_tz = pd.to_datetime(row["created"]).tz_localize(tz)
+                pending.append((name, text, row["ai_created"], pd.to_datetime(row["created"]).tz_localize(tz)))
 
-                if index and (index + 1) % split_by == 0:
+            # Rows are embedded a batch at a time instead of one API call each
+            imported = 0
+            batch_size = self.db.embed_batch_size
+            for start in range(0, len(pending), batch_size):
+                chunk = pending[start : start + batch_size]
+                if start:
                     with contextlib.suppress(discord.DiscordServerError):
                         await message.edit(
                             content=_("{}\n`Currently {}: `**{}** ({}/{})").format(
-                                message_text, proc, name, index + 1, len(df)
+                                message_text, _("processing"), chunk[0][0], start + 1, len(pending)
                             )
                         )
-
-                query_embedding = await self.request_embedding(text, conf)
-                if len(query_embedding) == 0:
-                    await ctx.send(_("Failed to process embedding: `{}`").format(name))
-                    continue
-
-                conf.embeddings[name] = Embedding(
-                    text=text,
-                    embedding=query_embedding,
-                    ai_created=row["ai_created"],
-                    created=created_tz,
-                    model=conf.embed_model,
-                )
-                imported += 1
+                embeddings = await self.request_embeddings([i[1] for i in chunk], conf)
+                for (name, text, ai_created, created_tz), query_embedding in zip(chunk, embeddings):
+                    if len(query_embedding) == 0:
+                        await ctx.send(_("Failed to process embedding: `{}`").format(name))
+                        continue
+                    conf.embeddings[name] = Embedding(
+                        text=text,
+                        embedding=query_embedding,
+                        ai_created=ai_created,
+                        created=created_tz,
+                        model=conf.embed_model,
+                    )
+                    imported += 1
 
             if imported:
                 await asyncio.to_thread(conf.sync_embeddings, ctx.guild.id)
@@ -1666,7 +1716,7 @@ class Admin(MixinMeta):
             return await ctx.send(_("There are no embeddings to export!"))
 
         async with ctx.typing():
-            dump = {name: em.model_dump() for name, em in conf.embeddings.items()}
+            dump = {name: em.dump_with_vector() for name, em in conf.embeddings.items()}
             json_buffer = BytesIO(orjson.dumps(dump))
             file = discord.File(json_buffer, filename="embeddings_export.json")
 
@@ -2074,9 +2124,13 @@ class Admin(MixinMeta):
         """
 
         def _dump():
-            # Delete and convo data
-            self.db.conversations.clear()
-            return self.db.json()
+            # Conversations are excluded from the dump
+            dump = self.db.model_dump()
+            # Vectors aren't part of the config, add them so the backup doesn't need re-embedding
+            for guild_id, conf in self.db.configs.items():
+                for name, em in conf.embeddings.items():
+                    dump["configs"][str(guild_id)]["embeddings"][name]["embedding"] = em.embedding.tolist()
+            return orjson.dumps(dump).decode()
 
         dump = await asyncio.to_thread(_dump)
 
@@ -2124,6 +2178,9 @@ class Admin(MixinMeta):
             )
         dump = await attachments[0].read()
         self.db = await asyncio.to_thread(DB.parse_raw, dump)
+        self.db.attach_store(self.conversation_store)
+        # Backups made before vectors moved out of the config don't include them
+        await asyncio.to_thread(self.vector_store.load, self.db.configs)
         await ctx.send(_("Cog has been restored!"))
         await self.save_conf()
 
@@ -2137,8 +2194,8 @@ class Admin(MixinMeta):
         """
         if not yes_or_no:
             return await ctx.send(_("Not wiping conversations"))
-        for convo in self.db.conversations.values():
-            convo.messages.clear()
+        for key in await asyncio.to_thread(self.db.conversation_keys):
+            self.db.delete_conversation(key)
         await ctx.send(_("Conversations have been wiped for all servers!"))
         await self.save_conf()
 
@@ -2152,6 +2209,8 @@ class Admin(MixinMeta):
         else:
             self.db.persistent_conversations = True
             await ctx.send(_("Persistent conversations have been **Enabled**"))
+            if not self.save_loop.is_running():
+                self.save_loop.start()
         await self.save_conf()
 
     @assistant.command(name="resetglobalembeddings")
@@ -2185,3 +2244,142 @@ class Admin(MixinMeta):
             self.db.listen_to_bots = True
             await ctx.send(_("Assistant will listen to other bot messages"))
         await self.save_conf()
+
+    @assistant.command(name="embedbatch")
+    @commands.is_owner()
+    async def set_embed_batching(
+        self,
+        ctx: commands.Context,
+        batch_size: commands.positive_int,
+        concurrency: commands.positive_int,
+    ):
+        """
+        Set how embedding requests are batched
+
+        Embedding requests are grouped into API calls of up to `batch_size` texts, with at most `concurrency` calls running at once.
+        - Defaults are 256 and 4
+        """
+        if batch_size > 2048:
+            return await ctx.send(_("Batch size cannot be more than 2048"))
+        self.db.embed_batch_size = batch_size
+        self.db.embed_concurrency = concurrency
+        self.embedding_batcher.configure(batch_size, concurrency)
+        await ctx.send(
+            _("Embeddings will be requested in batches of up to **{}**, with **{}** requests at a time").format(
+                batch_size, concurrency
+            )
+        )
+        await self.save_conf()
+
+    @assistant.command(name="embedcache")
+    @commands.is_owner()
+    async def set_embed_cache_size(self, ctx: commands.Context, max_entries: int):
+        """
+        Set how many embeddings are cached
+
+        Embeddings are cached by model and text so repeated questions and resyncs don't need another API call.
+        - Default is 10000
+        - Set to 0 to disable the cache
+        """
+        if max_entries < 0:
+            return await ctx.send(_("Cache size cannot be negative"))
+        self.db.embed_cache_size = max_entries
+        self.embedding_cache.max_size = max_entries
+        self.embedding_cache.trim()
+        await ctx.send(_("Up to **{}** embeddings will be cached").format(humanize_number(max_entries)))
+        await self.save_conf()
+
+    @assistant.command(name="telemetry")
+    @commands.is_owner()
+    @commands.bot_has_permissions(embed_links=True)
+    async def view_telemetry(
+        self,
+        ctx: commands.Context,
+        group_by: t.Literal["guild", "user", "model", "kind"] = "guild",
+        hours: float = 24,
+    ):
+        """
+        View cost and latency of recent API and function calls
+
+        Calls are grouped by guild, user, model or kind (chat, embedding, function), most expensive first.
+        Only the most recent 100k calls since the cog was loaded are kept.
+
+        **Arguments**
+        - `group_by`: guild, user, model or kind (Default: guild)
+        - `hours`: How far back to look, 0 for everything kept (Default: 24)
+        """
+        events = self.telemetry.select(hours)
+        if not events:
+            return await ctx.send(_("No calls have been recorded in that time"))
+        rows = self.telemetry.summarize(events, group_by)
+
+        def _name(key) -> str:
+            if group_by == "guild":
+                guild = self.bot.get_guild(key)
+                return guild.name if guild else str(key or _("Unknown"))
+            if group_by == "user":
+                user = self.bot.get_user(key)
+                return user.name if user else str(key or _("Unknown"))
+            return str(key)
+
+        emb_total = self.embedding_cache.hits + self.embedding_cache.misses
+        tok_total = token_cache.hits + token_cache.misses
+        window = _("the last {} hours").format(hours) if hours else _("all recorded calls")
+        desc = (
+            _("Showing {}\n").format(window)
+            + _("`Calls:          `{}\n").format(humanize_number(len(events)))
+            + _("`Estimated Cost: `${}\n").format(round(sum(i.cost for i in events), 4))
+            + _("`Embedding Cache:`{}% hit rate\n").format(
+                round(self.embedding_cache.hits / emb_total * 100, 1) if emb_total else 0
+            )
+            + _("`Token Cache:    `{}% hit rate").format(
+                round(token_cache.hits / tok_total * 100, 1) if tok_total else 0
+            )
+        )
+        embed = discord.Embed(title=_("Assistant Telemetry"), description=desc, color=ctx.author.color)
+        for row in rows[:10]:
+            value = (
+                _("`Calls:   `{} ({} failed)\n").format(humanize_number(row["calls"]), row["errors"])
+                + _("`Tokens:  `{} in / {} out\n").format(
+                    humanize_number(row["input_tokens"]), humanize_number(row["output_tokens"])
+                )
+                + _("`Cost:    `${}\n").format(round(row["cost"], 4))
+                + _("`Latency: `{}ms p50 / {}ms p95").format(round(row["p50"] * 1000), round(row["p95"] * 1000))
+            )
+            if row["first_token_p50"]:
+                value += _("\n`1st Token: `{}ms p50").format(round(row["first_token_p50"] * 1000))
+            if row["cache_rate"]:
+                value += _("\n`Cached:  `{}%").format(round(row["cache_rate"] * 100, 1))
+            embed.add_field(name=_name(row[group_by]), value=value, inline=False)
+        if len(rows) > 10:
+            embed.set_footer(text=_("{} more not shown, export for the full data").format(len(rows) - 10))
+        await ctx.send(embed=embed)
+
+    @assistant.command(name="telemetryexport")
+    @commands.is_owner()
+    async def export_telemetry(
+        self, ctx: commands.Context, file_type: t.Literal["csv", "json"] = "csv", hours: float = 0
+    ):
+        """
+        Export recorded API and function calls
+
+        Each row is a single call with its guild, user, model, latency, tokens and estimated cost.
+
+        **Arguments**
+        - `file_type`: csv or json (Default: csv)
+        - `hours`: How far back to export, 0 for everything kept (Default: 0)
+        """
+        events = self.telemetry.select(hours)
+        if not events:
+            return await ctx.send(_("No calls have been recorded in that time"))
+        if file_type == "csv":
+            raw = (await asyncio.to_thread(self.telemetry.to_csv, events)).encode()
+        else:
+            raw = await asyncio.to_thread(self.telemetry.to_json, events)
+        buffer = BytesIO(raw)
+        buffer.name = f"assistant_telemetry_{int(datetime.now().timestamp())}.{file_type}"
+        buffer.seek(0)
+        try:
+            await ctx.send(_("Here is your export!"), file=discord.File(buffer))
+        except discord.HTTPException:
+            await ctx.send(_("File too large, try a shorter time frame"))
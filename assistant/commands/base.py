@@ -551,7 +551,7 @@ If a file has no extension it will still try to read it only if it can be decode
 
         new_mem_id = channel.id if conf.collab_convos else ctx.author.id
         key = f"{new_mem_id}-{channel.id}-{ctx.guild.id}"
-        if key in self.db.conversations:
+        if self.db.has_conversation(key):
             txt = _("This conversation has been overwritten in {}").format(channel.mention)
         else:
             txt = _("This conversation has been copied over to {}").format(channel.mention)
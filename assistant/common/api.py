@@ -3,22 +3,23 @@ import inspect
 import json
 import logging
 import math
+from time import perf_counter
 from typing import List, Optional
 
 import aiohttp
 import discord
-import tiktoken
 from openai.types.chat.chat_completion import ChatCompletion
 from openai.types.chat.chat_completion_message import ChatCompletionMessage
-from openai.types.create_embedding_response import CreateEmbeddingResponse
 from redbot.core import commands
 from redbot.core.i18n import Translator, cog_i18n
 from redbot.core.utils.chat_formatting import box, humanize_number
 
 from ..abc import MixinMeta
-from .calls import request_chat_completion_raw, request_embedding_raw
-from .constants import MODELS, VISION_COSTS
+from .calls import request_chat_completion_raw
+from .constants import MODELS
 from .models import GuildSettings
+from .streaming import StreamEditor, StreamedReply
+from .tokens import REPLY_PRIMER, get_encoding, token_cache
 
 log = logging.getLogger("red.vrt.assistant.api")
 _ = Translator("Assistant", __file__)
@@ -48,7 +49,12 @@ class API(MixinMeta):
         response_token_override: int = None,
         model_override: Optional[str] = None,
         temperature_override: Optional[float] = None,
+        stream: Optional[StreamEditor] = None,
     ) -> ChatCompletionMessage:
+        """Get the next message from the model
+
+        If a `stream` is passed the completion is streamed, and its content is shown as it arrives.
+        """
         model = model_override or conf.get_user_model(member)
 
         max_convo_tokens = self.get_max_tokens(conf, member)
@@ -85,46 +91,126 @@ class API(MixinMeta):
             model = "gpt-5"
             await self.save_conf()
 
-        response: ChatCompletion = await request_chat_completion_raw(
-            model=model,
-            messages=messages,
-            temperature=temperature_override if temperature_override is not None else conf.temperature,
-            api_key=conf.api_key,
-            max_tokens=response_tokens,
-            functions=functions,
-            frequency_penalty=conf.frequency_penalty,
-            presence_penalty=conf.presence_penalty,
-            seed=conf.seed,
-            base_url=self.db.endpoint_override,
-            reasoning_effort=conf.reasoning_effort,
-            verbosity=conf.verbosity,
-        )
-        message: ChatCompletionMessage = response.choices[0].message
-
-        conf.update_usage(
-            response.model,
-            response.usage.total_tokens,
-            response.usage.prompt_tokens,
-            response.usage.completion_tokens,
+        kwargs = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature_override if temperature_override is not None else conf.temperature,
+            "api_key": conf.api_key,
+            "max_tokens": response_tokens,
+            "functions": functions,
+            "frequency_penalty": conf.frequency_penalty,
+            "presence_penalty": conf.presence_penalty,
+            "seed": conf.seed,
+            "base_url": self.db.endpoint_override,
+            "reasoning_effort": conf.reasoning_effort,
+            "verbosity": conf.verbosity,
+        }
+        user_id = member.id if isinstance(member, discord.Member) else 0
+        start = perf_counter()
+        try:
+            if stream is None:
+                response: ChatCompletion = await request_chat_completion_raw(**kwargs)
+            else:
+                stream.reset()
+                streamed = StreamedReply(stream.feed)
+                await streamed.consume(await request_chat_completion_raw(stream=True, **kwargs))
+        except Exception:
+            self.telemetry.record("chat", model, perf_counter() - start, conf.guild_id, user_id, ok=False)
+            raise
+
+        if stream is None:
+            message: ChatCompletionMessage = response.choices[0].message
+            model = response.model
+            prompt_tokens = response.usage.prompt_tokens
+            completion_tokens = response.usage.completion_tokens
+            total_tokens = response.usage.total_tokens
+            first_token = 0.0
+            log.debug(f"MESSAGE TYPE: {type(message)}")
+        else:
+            message = streamed.message()
+            first_token = streamed.first_token or 0.0
+            model = streamed.model or model
+            if streamed.usage:
+                prompt_tokens = streamed.usage.prompt_tokens
+                completion_tokens = streamed.usage.completion_tokens
+                total_tokens = streamed.usage.total_tokens
+            else:
+                # Endpoint didn't report usage for the stream, count it ourselves
+                prompt_tokens = current_convo_tokens
+                completion_tokens = await self.count_payload_tokens([message.model_dump(exclude_none=True)], model)
+                total_tokens = prompt_tokens + completion_tokens
+
+        conf.update_usage(model, total_tokens, prompt_tokens, completion_tokens)
+        self.telemetry.record(
+            "chat",
+            model,
+            perf_counter() - start,
+            conf.guild_id,
+            user_id,
+            input_tokens=prompt_tokens,
+            output_tokens=completion_tokens,
+            first_token=first_token,
         )
-        log.debug(f"MESSAGE TYPE: {type(message)}")
         return message
 
     async def request_embedding(self, text: str, conf: GuildSettings) -> List[float]:
-        response: CreateEmbeddingResponse = await request_embedding_raw(
-            text=text,
-            api_key=conf.api_key,
-            model=conf.embed_model,
-            base_url=self.db.endpoint_override,
-        )
-
-        conf.update_usage(
-            response.model,
-            response.usage.total_tokens,
-            response.usage.prompt_tokens,
-            0,
+        start = perf_counter()
+        key = self.embedding_cache.key(conf.embed_model, self.db.endpoint_override, text)
+        if cached := self.embedding_cache.get(key):
+            self.telemetry.record(
+                "embedding", conf.embed_model, perf_counter() - start, conf.guild_id, items=1, cached=1
+            )
+            return cached
+        try:
+            embedding, model, tokens = await self.embedding_batcher.submit(
+                text=text,
+                api_key=conf.api_key,
+                model=conf.embed_model,
+                base_url=self.db.endpoint_override,
+            )
+        except Exception:
+            self.telemetry.record("embedding", conf.embed_model, perf_counter() - start, conf.guild_id, ok=False)
+            raise
+        conf.update_usage(model, tokens, tokens, 0)
+        self.telemetry.record("embedding", model, perf_counter() - start, conf.guild_id, input_tokens=tokens, items=1)
+        self.embedding_cache.set(key, embedding)
+        return embedding
+
+    async def request_embeddings(self, texts: List[str], conf: GuildSettings) -> List[List[float]]:
+        """Embed many texts at once, only texts that aren't cached are sent and they go out in batches"""
+        keys = [self.embedding_cache.key(conf.embed_model, self.db.endpoint_override, text) for text in texts]
+        embeddings = [self.embedding_cache.get(key) for key in keys]
+        # Identical texts only need to be embedded once
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if not embedding))
+        start = perf_counter()
+        model, tokens = conf.embed_model, 0
+        if missing:
+            try:
+                results, model, tokens = await self.embedding_batcher.embed(
+                    texts=missing,
+                    api_key=conf.api_key,
+                    model=conf.embed_model,
+                    base_url=self.db.endpoint_override,
+                )
+            except Exception:
+                self.telemetry.record("embedding", model, perf_counter() - start, conf.guild_id, ok=False)
+                raise
+            conf.update_usage(model, tokens, tokens, 0)
+            fetched = dict(zip(missing, results))
+            for idx, (key, text) in enumerate(zip(keys, texts)):
+                if not embeddings[idx]:
+                    embeddings[idx] = fetched[text]
+                    self.embedding_cache.set(key, fetched[text])
+        self.telemetry.record(
+            "embedding",
+            model,
+            perf_counter() - start,
+            conf.guild_id,
+            input_tokens=tokens,
+            items=len(texts),
+            cached=len(texts) - len(missing),
         )
-        return response.data[0].embedding
+        return embeddings
 
     # -------------------------------------------------------
     # -------------------------------------------------------
@@ -135,37 +221,8 @@ class API(MixinMeta):
     async def count_payload_tokens(self, messages: List[dict], model: str = "gpt-5") -> int:
         if not messages:
             return 0
-
-        def _count_payload():
-            try:
-                encoding = tiktoken.encoding_for_model(model)
-            except KeyError:
-                encoding = tiktoken.get_encoding("o200k_base")
-
-            tokens_per_message = 3
-            tokens_per_name = 1
-            num_tokens = 0
-            for message in messages:
-                num_tokens += tokens_per_message
-                for key, value in message.items():
-                    if key == "name":
-                        num_tokens += tokens_per_name
-
-                    if key == "content" and isinstance(value, list):
-                        for item in value:
-                            if item["type"] == "text":
-                                num_tokens += len(encoding.encode(item["text"]))
-                            elif item["type"] == "image_url":
-                                num_tokens += VISION_COSTS.get(model, [1000])[
-                                    0
-                                ]  # Just assume around 1k tokens for images
-                    else:  # String, probably
-                        num_tokens += len(encoding.encode(str(value)))
-
-            num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-            return num_tokens
-
-        return await asyncio.to_thread(_count_payload)
+        # Each message is only tokenized the first time it's seen, later turns just sum the cached counts
+        return await asyncio.to_thread(token_cache.payload_tokens, messages, model)
 
     async def count_function_tokens(self, functions: List[dict], model: str = "gpt-5") -> int:
         # Initialize function settings to 0
@@ -233,11 +290,7 @@ class API(MixinMeta):
             log.warning(f"Incompatible model: {model}")
 
         def _count_tokens():
-            try:
-                encoding = tiktoken.encoding_for_model(model)
-            except KeyError:
-                encoding = tiktoken.get_encoding("o200k_base")
-
+            encoding = get_encoding(model)
             func_token_count = 0
 
             if len(functions) > 0:
@@ -271,7 +324,8 @@ class API(MixinMeta):
                 func_token_count += func_end
             return func_token_count
 
-        return await asyncio.to_thread(_count_tokens)
+        # The same schema set is sent every turn, so it's only counted once per model
+        return await asyncio.to_thread(token_cache.function_tokens, functions, model, _count_tokens)
 
     async def get_tokens(self, text: str, model: str = "gpt-5") -> list[int]:
         """Get token list from text"""
@@ -281,14 +335,7 @@ class API(MixinMeta):
         if isinstance(text, bytes):
             text = text.decode(encoding="utf-8")
 
-        def _get_encoding():
-            try:
-                enc = tiktoken.encoding_for_model(model)
-            except KeyError:
-                enc = tiktoken.get_encoding("o200k_base")
-            return enc
-
-        encoding = await asyncio.to_thread(_get_encoding)
+        encoding = await asyncio.to_thread(get_encoding, model)
 
         return await asyncio.to_thread(encoding.encode, text)
 
@@ -324,24 +371,24 @@ class API(MixinMeta):
         sample = list(conf.embeddings.values())[0]
         sample_embed = await self.request_embedding(sample.text, conf)
 
-        async def update_embedding(name: str, text: str):
-            conf.embeddings[name].embedding = await self.request_embedding(text, conf)
+        names = [
+            name
+            for name, em in conf.embeddings.items()
+            if conf.embed_model != em.model or len(em.embedding) != len(sample_embed)
+        ]
+        if not names:
+            return 0
+
+        embeddings = await self.request_embeddings([conf.embeddings[name].text for name in names], conf)
+        for name, embedding in zip(names, embeddings):
+            conf.embeddings[name].embedding = embedding
             conf.embeddings[name].update()
             conf.embeddings[name].model = conf.embed_model
-            log.debug(f"Updated embedding: {name}")
-
-        synced = 0
-        tasks = []
-        for name, em in conf.embeddings.items():
-            if conf.embed_model != em.model or len(em.embedding) != len(sample_embed):
-                synced += 1
-                tasks.append(update_embedding(name, em.text))
-
-        if synced:
-            await asyncio.gather(*tasks)
-            await asyncio.to_thread(conf.sync_embeddings, guild_id)
-            await self.save_conf()
-        return synced
+        log.debug(f"Updated {len(names)} embeddings")
+
+        await asyncio.to_thread(conf.sync_embeddings, guild_id)
+        await self.save_conf()
+        return len(names)
 
     def get_max_tokens(self, conf: GuildSettings, user: Optional[discord.Member]) -> int:
         user_max = conf.get_user_max_tokens(user)
@@ -361,14 +408,7 @@ class API(MixinMeta):
     async def get_text(self, tokens: list, model: str = "gpt-5") -> str:
         """Get text from token list"""
 
-        def _get_encoding():
-            try:
-                enc = tiktoken.encoding_for_model(model)
-            except KeyError:
-                enc = tiktoken.get_encoding("o200k_base")
-            return enc
-
-        encoding = await asyncio.to_thread(_get_encoding)
+        encoding = await asyncio.to_thread(get_encoding, model)
 
         return await asyncio.to_thread(encoding.decode, tokens)
 
@@ -408,8 +448,9 @@ class API(MixinMeta):
         model = conf.get_user_model(user)
         # Fetch the max token limit for the current user
         max_tokens = self.get_max_tokens(conf, user)
-        # Token count of current conversation
-        convo_tokens = await self.count_payload_tokens(messages, model)
+        # Token count of each message in the current conversation, kept in step with the messages as they're removed
+        message_tokens = await asyncio.to_thread(lambda: [token_cache.message_tokens(i, model) for i in messages])
+        convo_tokens = sum(message_tokens) + REPLY_PRIMER if messages else 0
         # Token count of function calls available to model
         function_tokens = await self.count_function_tokens(function_list, model)
 
@@ -424,28 +465,12 @@ class API(MixinMeta):
         def count(role: str):
             return sum(1 for msg in messages if msg["role"] == role)
 
-        async def pop(role: str) -> int:
+        def pop(role: str) -> int:
             for idx, msg in enumerate(messages):
                 if msg["role"] != role:
                     continue
-                removed = messages.pop(idx)
-                reduction = 4
-                if "name" in removed:
-                    reduction += 1
-                if content := removed.get("content"):
-                    if isinstance(content, list):
-                        for i in content:
-                            if i["type"] == "text":
-                                reduction += await self.count_tokens(i["text"], model)
-                            else:
-                                reduction += 2
-                    else:
-                        reduction += await self.count_tokens(str(content), model)
-                elif tool_calls := removed.get("tool_calls"):
-                    reduction += await self.count_tokens(str(tool_calls), model)
-                elif function_call := removed.get("function_call"):
-                    reduction += await self.count_tokens(str(function_call), model)
-                return reduction
+                messages.pop(idx)
+                return message_tokens.pop(idx)
             return 0
 
         # We will NOT remove the most recent user message or assistant message
@@ -463,24 +488,24 @@ class API(MixinMeta):
                 break
             # First we will iterate through the messages and remove in the following sweep order:
             # 1. Remove oldest tool call or response
-            reduced = await pop("tool")
+            reduced = pop("tool")
             if reduced:
                 total_tokens -= reduced
                 if total_tokens <= max_tokens:
                     break
-            reduced = await pop("function")
+            reduced = pop("function")
             if reduced:
                 total_tokens -= reduced
                 if total_tokens <= max_tokens:
                     break
             # 2. Remove oldest assistant message
-            reduced = await pop("assistant")
+            reduced = pop("assistant")
             if reduced:
                 total_tokens -= reduced
                 if total_tokens <= max_tokens:
                     break
             # 3. Remove oldest user message
-            reduced = await pop("user")
+            reduced = pop("user")
             if reduced:
                 total_tokens -= reduced
                 if total_tokens <= max_tokens:
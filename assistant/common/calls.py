@@ -4,9 +4,9 @@ from typing import List, Optional
 
 import httpx
 import openai
-from aiocache import cached
+from openai import AsyncStream
 from openai.types import CreateEmbeddingResponse, Image, ImagesResponse
-from openai.types.chat import ChatCompletion
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
 from pydantic import BaseModel
 from sentry_sdk import add_breadcrumb
 from tenacity import (
@@ -46,10 +46,17 @@ async def request_chat_completion_raw(
     base_url: Optional[str] = None,
     reasoning_effort: Optional[str] = None,
     verbosity: Optional[str] = None,
-) -> ChatCompletion:
+    stream: bool = False,
+) -> t.Union[ChatCompletion, AsyncStream[ChatCompletionChunk]]:
     client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url)
 
     kwargs = {"model": model, "messages": messages}
+    if stream:
+        # Retries only cover opening the stream, once chunks are flowing an error goes straight to the caller
+        kwargs["stream"] = True
+        if base_url is None:
+            # Other endpoints may reject this, their usage gets estimated instead
+            kwargs["stream_options"] = {"include_usage": True}
 
     if model in PRICES and base_url is None:
         # Using an OpenAI model
@@ -101,13 +108,15 @@ async def request_chat_completion_raw(
         level="info",
         data=kwargs,
     )
-    response: ChatCompletion = await client.chat.completions.create(**kwargs)
+    response = await client.chat.completions.create(**kwargs)
+    if stream:
+        log.debug(f"request_chat_completion_raw: {model} -> stream")
+        return response
 
     log.debug(f"request_chat_completion_raw: {model} -> {response.model}")
     return response
 
 
-@cached(ttl=60)
 @retry(
     retry=retry_if_exception_type(
         t.Union[
@@ -121,7 +130,7 @@ async def request_chat_completion_raw(
     reraise=True,
 )
 async def request_embedding_raw(
-    text: str,
+    text: t.Union[str, List[str]],
     api_key: str,
     model: str,
     base_url: Optional[str] = None,
@@ -131,7 +140,7 @@ async def request_embedding_raw(
         category="api",
         message="Calling request_embedding_raw",
         level="info",
-        data={"text": text},
+        data={"text": text} if isinstance(text, str) else {"inputs": len(text)},
     )
     response: CreateEmbeddingResponse = await client.embeddings.create(input=text, model=model)
     log.debug(f"request_embedding_raw: {model} -> {response.model}")
@@ -1,15 +1,14 @@
 import asyncio
 import base64
-import functools
 import json
 import logging
-import multiprocessing as mp
 import re
 import traceback
 from datetime import datetime
 from inspect import iscoroutinefunction
 from io import BytesIO, StringIO
-from typing import Callable, Dict, List, Optional, Union
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import discord
 import httpx
@@ -28,9 +27,15 @@ from redbot.core.utils.chat_formatting import box, humanize_number, text_to_file
 from sentry_sdk import add_breadcrumb
 
 from ..abc import MixinMeta
-from .constants import DO_NOT_RESPOND_SCHEMA, READ_EXTENSIONS, SUPPORTS_VISION
+from .constants import (
+    DO_NOT_RESPOND_SCHEMA,
+    MEMORY_FUNCTIONS,
+    READ_EXTENSIONS,
+    SUPPORTS_VISION,
+)
 from .models import Conversation, GuildSettings
 from .reply import send_reply
+from .streaming import StreamEditor
 from .utils import (
     clean_name,
     clean_response,
@@ -167,6 +172,16 @@ class ChatHandler(MixinMeta):
                         name = f"@{ref_author.name}({ref_author.display_name})"
                     question = f"{name}: {ref.content}\n\n# REPLY\n{question}"
 
+        stream = None
+        if conf.stream_responses and not any([get_last_message, outputfile, extract, auto_answer]):
+
+            async def clean(text: str) -> str:
+                # Partial replies go through the same blacklist as the final one, a timeout stops the preview
+                text, _errors = await self.regex_pool.sub(conf.regex_blacklist, text)
+                return text
+
+            stream = StreamEditor(message, mention=conf.mention, clean=clean)
+
         if get_last_message:
             reply = conversation.messages[-1]["content"] if conversation.messages else _("No message history!")
         else:
@@ -181,6 +196,7 @@ class ChatHandler(MixinMeta):
                     images=images,
                     model_override=model_override,
                     auto_answer=auto_answer,
+                    stream=stream,
                 )
             except openai.InternalServerError as e:
                 if e.body and isinstance(e.body, dict):
@@ -214,6 +230,9 @@ class ChatHandler(MixinMeta):
                 )
                 reply += "\n\n" + _("API Status: {}").format(status)
 
+        if stream and await stream.finish(reply):
+            return
+
         if reply is None:
             return
 
@@ -273,6 +292,7 @@ class ChatHandler(MixinMeta):
         images: list[str] = None,
         model_override: Optional[str] = None,
         auto_answer: Optional[bool] = False,
+        stream: Optional[StreamEditor] = None,
     ) -> Union[str, None]:
         """Call the API asynchronously"""
         functions = function_calls.copy() if function_calls else []
@@ -321,6 +341,7 @@ class ChatHandler(MixinMeta):
                 images=images,
                 model_override=model_override,
                 auto_answer=auto_answer,
+                stream=stream,
             )
         finally:
             conversation.cleanup(conf, author)
@@ -340,6 +361,7 @@ class ChatHandler(MixinMeta):
         images: list[str] = None,
         model_override: Optional[str] = None,
         auto_answer: Optional[bool] = False,
+        stream: Optional[StreamEditor] = None,
     ) -> Union[str, None]:
         if isinstance(author, int):
             author = guild.get_member(author)
@@ -467,6 +489,7 @@ class ChatHandler(MixinMeta):
                     functions=function_calls,
                     member=author,
                     model_override=model_override,
+                    stream=stream,
                 )
             except httpx.ReadTimeout:
                 reply = _("Request timed out, please try again.")
@@ -531,42 +554,43 @@ class ChatHandler(MixinMeta):
             # Add function call count
             conf.functions_called += len(response_functions)
 
+            data = {
+                **extras,
+                "user": guild.get_member(author) if isinstance(author, int) else author,
+                "channel": guild.get_channel_or_thread(channel) if isinstance(channel, int) else channel,
+                "guild": guild,
+                "bot": self.bot,
+                "conf": conf,
+                "conversation": conversation,
+                "messages": messages,
+                "message_obj": message_obj,
+            }
+            role = "tool"
+            # (function name, tool call ID, parsed args, parse succeeded)
+            parsed: List[Tuple[str, Optional[str], dict, bool]] = []
             for function_call in response_functions:
                 if hasattr(function_call, "name") and hasattr(function_call, "arguments"):
                     # This is a FunctionCall
                     function_name = function_call.name
                     arguments = function_call.arguments
                     tool_id = None
-                    role = "tool"
                 elif hasattr(function_call, "function") and hasattr(function_call, "id"):
                     # This is a ChatCompletionMessageToolCall
                     function_name = function_call.function.name
                     arguments = function_call.function.arguments
                     tool_id = function_call.id
-                    role = "tool"
                 else:
                     log.error(f"Unknown function call type: {type(function_call)}: {function_call}")
                     # Try to handle as ChatCompletionMessageToolCall as fallback
                     function_name = function_call.function.name
                     arguments = function_call.function.arguments
                     tool_id = function_call.id
-                    role = "tool"
 
                 calls += 1
 
                 if function_name not in function_map:
                     log.error(f"GPT suggested a function not provided: {function_name}")
-                    e = {
-                        "role": role,
-                        "name": "invalid_function",
-                        "content": f"{function_name} is not a valid function name",
-                    }
-                    if tool_id:
-                        e["tool_call_id"] = tool_id
-                    messages.append(e)
-                    conversation.messages.append(e)
-                    # Remove the function call from the list
-                    function_calls = [i for i in function_calls if i["name"] != function_name]
+                    parsed.append((function_name, tool_id, {}, False))
                     continue
 
                 if arguments != "{}":
@@ -579,36 +603,84 @@ class ChatHandler(MixinMeta):
                 else:
                     args = {}
                     parse_success = True
+                parsed.append((function_name, tool_id, args, parse_success))
+
+            # Calls are split into batches of independent calls, each batch runs at the same time and the batches run
+            # in the order the model made the calls. Repeat calls to a function (or to the memory functions) go in
+            # separate batches, and functions that opted out of running alongside others get a batch of their own
+            batches: List[List[int]] = []
+            shared: Optional[set] = None
+            for idx, (function_name, _tool_id, _args, _ok) in enumerate(parsed):
+                key = self.get_function_group(function_name)
+                if shared is None or key is None or key in shared:
+                    batches.append([])
+                    shared = set()
+                batches[-1].append(idx)
+                if key is None:
+                    shared = None
+                else:
+                    shared.add(key)
 
-                if parse_success:
-                    data = {
-                        **extras,
-                        "user": guild.get_member(author) if isinstance(author, int) else author,
-                        "channel": guild.get_channel_or_thread(channel) if isinstance(channel, int) else channel,
-                        "guild": guild,
-                        "bot": self.bot,
-                        "conf": conf,
-                        "conversation": conversation,
-                        "messages": messages,
-                        "message_obj": message_obj,
-                    }
-                    kwargs = {**args, **data}
-                    func = function_map[function_name]
+            semaphore = asyncio.Semaphore(max(1, conf.max_concurrent_functions))
+
+            async def execute(function_name: str, args: dict, parse_success: bool) -> Tuple[Any, bool]:
+                """Returns the function's result and whether it failed"""
+                if function_name not in function_map:
+                    return None, True
+                if not parse_success:
+                    # Help the model self-correct
+                    return f"JSONDecodeError: Failed to parse arguments for function {function_name}", False
+                func = function_map[function_name]
+                timeout = self.get_function_timeout(function_name, conf)
+                kwargs = {**args, **data}
+                async with semaphore:
+                    start = perf_counter()
                     try:
                         if iscoroutinefunction(func):
-                            func_result = await func(**kwargs)
+                            coro = func(**kwargs)
                         else:
-                            func_result = await asyncio.to_thread(func, **kwargs)
+                            # The thread can't be stopped on timeout, it's left to finish in the background
+                            coro = asyncio.to_thread(func, **kwargs)
+                        result = await asyncio.wait_for(coro, timeout=timeout or None), False
+                    except asyncio.TimeoutError:
+                        log.warning(f"Function {function_name} timed out after {timeout}s\nArgs: {args}")
+                        result = f"TimeoutError: {function_name} did not finish within {timeout} seconds", True
                     except Exception as e:
                         log.error(
-                            f"Custom function {function_name} failed to execute!\nArgs: {arguments}",
+                            f"Custom function {function_name} failed to execute!\nArgs: {args}",
                             exc_info=e,
                         )
-                        func_result = traceback.format_exc()
-                        function_calls = [i for i in function_calls if i["name"] != function_name]
-                else:
-                    # Help the model self-correct
-                    func_result = f"JSONDecodeError: Failed to parse arguments for function {function_name}"
+                        result = traceback.format_exc(), True
+                self.telemetry.record(
+                    "function", function_name, perf_counter() - start, guild.id, user_id, ok=not result[1]
+                )
+                return result
+
+            async def run_batches():
+                """Yields each call with its outcome, a batch only starts once the previous one has been handled"""
+                for batch in batches:
+                    outcomes = await asyncio.gather(*(execute(parsed[i][0], parsed[i][2], parsed[i][3]) for i in batch))
+                    for idx, outcome in zip(batch, outcomes):
+                        yield parsed[idx], outcome
+
+            # Leaving this loop early (return_null) means the remaining batches never run
+            async for (function_name, tool_id, args, _parsed), (func_result, failed) in run_batches():
+                if function_name not in function_map:
+                    e = {
+                        "role": role,
+                        "name": "invalid_function",
+                        "content": f"{function_name} is not a valid function name",
+                    }
+                    if tool_id:
+                        e["tool_call_id"] = tool_id
+                    messages.append(e)
+                    conversation.messages.append(e)
+                    # Remove the function call from the list
+                    function_calls = [i for i in function_calls if i["name"] != function_name]
+                    continue
+
+                if failed:
+                    function_calls = [i for i in function_calls if i["name"] != function_name]
 
                 return_null = False
 
@@ -711,16 +783,7 @@ class ChatHandler(MixinMeta):
 
         block = False
         if reply:
-            for regex in conf.regex_blacklist:
-                try:
-                    reply = await self.safe_regex(regex, reply)
-                except (asyncio.TimeoutError, mp.TimeoutError):
-                    log.error(f"Regex {regex} in {guild.name} took too long to process. Skipping...")
-                    if conf.block_failed_regex:
-                        block = True
-                except Exception as e:
-                    log.error("Regex sub error", exc_info=e)
-
+            reply, block = await self.apply_regex_blacklist(reply, conf, guild)
             conversation.update_messages(reply, "assistant", clean_name(self.bot.user.name))
 
         if block:
@@ -732,20 +795,56 @@ class ChatHandler(MixinMeta):
 
         return reply
 
-    async def safe_regex(self, regex: str, content: str):
-        process = self.mp_pool.apply_async(
-            re.sub,
-            args=(
-                regex,
-                "",
-                content,
-            ),
-        )
-        task = functools.partial(process.get, timeout=2)
-        loop = asyncio.get_running_loop()
-        new_task = loop.run_in_executor(None, task)
-        subbed = await asyncio.wait_for(new_task, timeout=5)
-        return subbed
+    def get_function_group(self, function_name: str) -> Optional[str]:
+        """Calls in the same group never run at the same time, None means the function runs on its own"""
+        if function_name == "do_not_respond":
+            return None
+        if function_name in MEMORY_FUNCTIONS:
+            return "memories"
+        for functions in self.registry.values():
+            if function_name in functions and not functions[function_name].get("concurrent", True):
+                return None
+        return function_name
+
+    def get_function_timeout(self, function_name: str, conf: GuildSettings) -> float:
+        """Seconds a function gets to finish, cogs can set their own when registering a function
+
+        A guild timeout of 0 turns timeouts off, including the ones set by cogs.
+        """
+        if not conf.function_timeout:
+            return 0
+        for functions in self.registry.values():
+            if function_name in functions and functions[function_name].get("timeout"):
+                return functions[function_name]["timeout"]
+        return conf.function_timeout
+
+    async def apply_regex_blacklist(self, content: str, conf: GuildSettings, guild: discord.Guild) -> Tuple[str, bool]:
+        """Strip the guild's blacklisted patterns from a reply
+
+        Returns:
+            Tuple[str, bool]: The cleaned reply and whether it should be blocked because a pattern timed out
+        """
+        if not conf.regex_blacklist:
+            return content, False
+        try:
+            content, errors = await self.regex_pool.sub(conf.regex_blacklist, content)
+            failed = [(regex, error) for regex, error in zip(conf.regex_blacklist, errors) if error]
+        except asyncio.TimeoutError:
+            # Run them one at a time to find the slow pattern(s) and skip them, the rest still apply
+            failed = []
+            for regex in conf.regex_blacklist:
+                try:
+                    content, errors = await self.regex_pool.sub([regex], content)
+                except asyncio.TimeoutError:
+                    log.error(f"Regex {regex} in {guild.name} took too long to process. Skipping...")
+                    if conf.block_failed_regex:
+                        return content, True
+                    continue
+                if errors[0]:
+                    failed.append((regex, errors[0]))
+        for regex, error in failed:
+            log.error(f"Regex sub error for {regex} in {guild.name}: {error}")
+        return content, False
 
     async def prepare_messages(
         self,
@@ -461,3 +461,9 @@ RESPOND_AND_CONTINUE = {
         "required": ["content"],
     },
 }
+
+# Built-in functions that read or write the guild's memories, these never run at the same time as each other
+MEMORY_FUNCTIONS = {"create_memory", "search_memories", "edit_memory", "list_memories"}
+
+# Guilds with up to this many embeddings are searched with the in-process index instead of Chroma
+LOCAL_INDEX_LIMIT = 5000
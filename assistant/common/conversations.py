@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import typing as t
+from pathlib import Path
+
+import orjson
+
+if t.TYPE_CHECKING:
+    from .models import Conversation
+
+log = logging.getLogger("red.vrt.assistant.conversations")
+
+# Conversations untouched for this long are written out and dropped from memory, they're loaded again when used
+IDLE_UNLOAD = 3600
+# How often conversation files that aren't in memory are checked for expiry
+SWEEP_INTERVAL = 3600
+
+
+class ConversationStore:
+    """Persistent conversations kept on disk as one file per `{member}-{channel}-{guild}` key
+
+    Only conversations in memory are checked for changes, and only the ones that changed since they were last
+    written (or loaded) are rewritten, so a save costs the same no matter how many conversations exist on disk.
+
+    Args:
+        path (Path): Directory holding the conversation files
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        # Key: content hash as of the last write or load
+        self.written: t.Dict[str, bytes] = {}
+        # Keys whose files should be removed on the next write
+        self.removed: t.Set[str] = set()
+
+    def file(self, key: str) -> Path:
+        return self.path / f"{key}.json"
+
+    @staticmethod
+    def digest(raw: bytes) -> bytes:
+        return hashlib.blake2b(raw, digest_size=16).digest()
+
+    def exists(self, key: str) -> bool:
+        return key not in self.removed and self.file(key).exists()
+
+    def keys(self) -> t.Set[str]:
+        if not self.path.exists():
+            return set()
+        return {i.stem for i in self.path.glob("*.json")} - self.removed
+
+    def load(self, key: str) -> t.Optional[dict]:
+        if not self.exists(key):
+            return None
+        try:
+            raw = self.file(key).read_bytes()
+            data = orjson.loads(raw)
+        except (OSError, orjson.JSONDecodeError) as e:
+            log.error(f"Failed to load conversation {key}, starting it fresh", exc_info=e)
+            return None
+        self.written[key] = self.digest(raw)
+        return data
+
+    def ages(self, loaded: t.Iterable[str]) -> t.Dict[str, float]:
+        """Blocking call, last write time of every conversation file that isn't loaded
+
+        A file is written shortly after its conversation was last updated, so this stands in for `last_updated`
+        without having to parse it.
+        """
+        if not self.path.exists():
+            return {}
+        skip = set(loaded) | self.removed
+        ages = {}
+        for path in self.path.glob("*.json"):
+            if path.stem in skip:
+                continue
+            try:
+                ages[path.stem] = path.stat().st_mtime
+            except OSError:
+                continue
+        return ages
+
+    def overrides(self, keys: t.Iterable[str]) -> t.Dict[str, dict]:
+        """Blocking call, the conversations among `keys` that have a system prompt override"""
+        found = {}
+        for key in keys:
+            try:
+                data = orjson.loads(self.file(key).read_bytes())
+            except (OSError, orjson.JSONDecodeError):
+                continue
+            if data.get("system_prompt_override"):
+                found[key] = data
+        return found
+
+    def discard(self, key: str) -> None:
+        """Remove a conversation from disk on the next write"""
+        self.written.pop(key, None)
+        self.removed.add(key)
+
+    def snapshot(self, conversations: t.Dict[str, "Conversation"]) -> t.Dict[str, t.Optional[bytes]]:
+        """Serialize the conversations that changed, meant to run on the event loop before `write`
+
+        Returns:
+            t.Dict[str, t.Optional[bytes]]: File contents per changed key, None if the file should be removed
+        """
+        changed: t.Dict[str, t.Optional[bytes]] = {key: None for key in self.removed}
+        self.removed.clear()
+        for key, conversation in conversations.items():
+            raw = orjson.dumps(conversation.model_dump(), default=str)
+            digest = self.digest(raw)
+            if self.written.get(key) == digest:
+                continue
+            changed[key] = raw
+            self.written[key] = digest
+        return changed
+
+    def write(self, changed: t.Dict[str, t.Optional[bytes]]) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        for key, raw in changed.items():
+            path = self.file(key)
+            if raw is None:
+                path.unlink(missing_ok=True)
+                continue
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(raw)
+            tmp.replace(path)
+
+    def unload(self, key: str) -> None:
+        """Forget a conversation that was dropped from memory, its file stays as it was last written"""
+        self.written.pop(key, None)
+
+    def clear(self) -> None:
+        self.written.clear()
+        self.removed.clear()
+        if not self.path.exists():
+            return
+        for path in self.path.glob("*.json"):
+            path.unlink(missing_ok=True)
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import logging
+import typing as t
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+
+import msgpack
+import numpy as np
+
+from .calls import request_embedding_raw
+
+log = logging.getLogger("red.vrt.assistant.embeddings")
+
+
+class EmbeddingCache:
+    """Bounded LRU of embeddings keyed by a hash of the model, endpoint and text
+
+    Vectors are held as float32 bytes, a fraction of the size of a list of floats, and the cache is persisted
+    to disk so identical texts stay cached across reloads. The model and endpoint decide the dimensions of the
+    vectors, so entries made with a different model or endpoint are never returned.
+
+    Args:
+        path (Path): File the cache is persisted to
+        max_size (int): Max number of cached embeddings
+    """
+
+    def __init__(self, path: Path, max_size: int = 10000):
+        self.path = path
+        self.max_size = max_size
+        self.cache: t.OrderedDict[bytes, bytes] = OrderedDict()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, endpoint: t.Optional[str], text: str) -> bytes:
+        raw = f"{model}\x00{endpoint or ''}\x00{text}".encode()
+        return hashlib.blake2b(raw, digest_size=16).digest()
+
+    def get(self, key: bytes) -> t.Optional[t.List[float]]:
+        raw = self.cache.get(key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return np.frombuffer(raw, dtype=np.float32).tolist()
+
+    def set(self, key: bytes, embedding: t.List[float]) -> None:
+        if not embedding:
+            return
+        self.cache[key] = np.asarray(embedding, dtype=np.float32).tobytes()
+        self.cache.move_to_end(key)
+        self.trim()
+        self.dirty = True
+
+    def trim(self) -> None:
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+            self.dirty = True
+
+    def clear(self) -> None:
+        self.cache.clear()
+        self.dirty = True
+
+    def load(self) -> int:
+        if not self.path.exists():
+            return 0
+        try:
+            data = msgpack.unpackb(self.path.read_bytes(), raw=True)
+        except Exception as e:
+            log.warning("Embedding cache is corrupt, starting fresh", exc_info=e)
+            return 0
+        # Saved oldest first, so the most recently used entries are the ones kept
+        self.cache = OrderedDict(data)
+        self.trim()
+        self.dirty = False
+        return len(self.cache)
+
+    def snapshot(self) -> t.Optional[t.Dict[bytes, bytes]]:
+        """Copy of the cache to write to disk, None if nothing changed since the last one"""
+        if not self.dirty:
+            return None
+        self.dirty = False
+        return dict(self.cache)
+
+    def write(self, snapshot: t.Dict[bytes, bytes]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_bytes(msgpack.packb(snapshot, use_bin_type=True))
+        tmp.replace(self.path)
+
+
+# (api key, model, endpoint)
+BatchKey = t.Tuple[str, str, t.Optional[str]]
+
+
+class EmbeddingBatcher:
+    """Coalesces embedding requests into multi-input API calls
+
+    Single requests made within `window` seconds of each other for the same key/model/endpoint are sent together,
+    and bulk requests are split into batches of `max_batch` texts. At most `concurrency` calls are in flight at once.
+
+    Token usage of a batch is only reported as a total, so it is split between the texts by their length.
+
+    Args:
+        max_batch (int): Max texts per API call
+        concurrency (int): Max API calls in flight
+        window (float): Seconds to wait for more requests before sending a partial batch
+    """
+
+    def __init__(self, max_batch: int = 256, concurrency: int = 4, window: float = 0.05):
+        self.max_batch = max_batch
+        self.window = window
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pending: t.Dict[BatchKey, t.List[t.Tuple[str, asyncio.Future]]] = defaultdict(list)
+        self.timers: t.Dict[BatchKey, asyncio.TimerHandle] = {}
+        self.tasks: t.Set[asyncio.Task] = set()
+        self.calls = 0
+
+    def configure(self, max_batch: int, concurrency: int) -> None:
+        self.max_batch = max_batch
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def submit(
+        self,
+        text: str,
+        api_key: str,
+        model: str,
+        base_url: t.Optional[str] = None,
+    ) -> t.Tuple[t.List[float], str, int]:
+        """Embed a single text, batched with any other texts submitted around the same time
+
+        Returns:
+            t.Tuple[t.List[float], str, int]: The embedding, the model that made it and the tokens used for it
+        """
+        key = (api_key, model, base_url)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key].append((text, future))
+        if len(self.pending[key]) >= self.max_batch:
+            self.flush(key)
+        elif key not in self.timers:
+            self.timers[key] = asyncio.get_running_loop().call_later(self.window, self.flush, key)
+        return await future
+
+    def flush(self, key: BatchKey) -> None:
+        if timer := self.timers.pop(key, None):
+            timer.cancel()
+        batch = self.pending.pop(key, [])
+        if batch:
+            task = asyncio.create_task(self.send(key, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, key: BatchKey, batch: t.List[t.Tuple[str, asyncio.Future]]) -> None:
+        texts = [text for text, _ in batch]
+        try:
+            embeddings, model, shares = await self.request(key, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), embedding, tokens in zip(batch, embeddings, shares):
+            if not future.done():
+                future.set_result((embedding, model, tokens))
+
+    async def embed(
+        self,
+        texts: t.List[str],
+        api_key: str,
+        model: str,
+        base_url: t.Optional[str] = None,
+    ) -> t.Tuple[t.List[t.List[float]], str, int]:
+        """Embed many texts in as few calls as the batch size allows
+
+        Returns:
+            t.Tuple[t.List[t.List[float]], str, int]: The embeddings in order, the model that made them and total tokens used
+        """
+        if not texts:
+            return [], model, 0
+        key = (api_key, model, base_url)
+        chunks = [texts[i : i + self.max_batch] for i in range(0, len(texts), self.max_batch)]
+        results = await asyncio.gather(*(self.request(key, chunk) for chunk in chunks))
+        embeddings = [embedding for chunk_embeddings, _, _ in results for embedding in chunk_embeddings]
+        return embeddings, results[0][1], sum(sum(shares) for _, _, shares in results)
+
+    async def request(self, key: BatchKey, texts: t.List[str]) -> t.Tuple[t.List[t.List[float]], str, t.List[int]]:
+        api_key, model, base_url = key
+        async with self.semaphore:
+            response = await request_embedding_raw(texts, api_key, model, base_url)
+        self.calls += 1
+        # Results come back with an index, don't rely on their order
+        embeddings = [i.embedding for i in sorted(response.data, key=lambda x: x.index)]
+        total = response.usage.prompt_tokens
+        lengths = [len(text) or 1 for text in texts]
+        combined = sum(lengths)
+        shares = [round(total * length / combined) for length in lengths]
+        return embeddings, response.model, shares
@@ -1,19 +1,39 @@
+import hashlib
 import logging
 import typing as t
 from datetime import datetime, timezone
 from time import perf_counter
 
-import chromadb
 import discord
 import numpy as np
 import orjson
-from chromadb.errors import ChromaError
-from pydantic import VERSION, BaseModel, Field
+from pydantic import VERSION, BaseModel, Field, PrivateAttr
 from redbot.core.bot import Red
 
+from .constants import LOCAL_INDEX_LIMIT
+from .conversations import ConversationStore
+from .vectors import VectorIndex
+
+try:
+    import chromadb
+    from chromadb.errors import ChromaError
+except ImportError:  # Searches fall back to the local index
+    chromadb = None
+    ChromaError = Exception
+
+if VERSION >= "2.0.1":
+    from pydantic import model_validator
+
 log = logging.getLogger("red.vrt.assistant.models")
 
-_chroma_client = chromadb.Client()
+_chroma_client = chromadb.Client() if chromadb else None
+
+
+def _max_batch_size() -> int:
+    try:
+        return _chroma_client.get_max_batch_size()
+    except Exception:
+        return 5000
 
 
 class AssistantBaseModel(BaseModel):
@@ -31,12 +51,59 @@ class AssistantBaseModel(BaseModel):
 
 class Embedding(AssistantBaseModel):
     text: str
-    embedding: t.List[float]
     ai_created: bool = False
     created: datetime = Field(default_factory=lambda: datetime.now(tz=timezone.utc))
     modified: datetime = Field(default_factory=lambda: datetime.now(tz=timezone.utc))
     model: str = "text-embedding-3-small"
 
+    # The vector lives in the VectorStore, not the config, so it isn't part of the dump
+    _vector: t.Optional[np.ndarray] = PrivateAttr(default=None)
+
+    if VERSION >= "2.0.1":
+
+        @model_validator(mode="wrap")
+        @classmethod
+        def _pop_vector(cls, data: t.Any, handler: t.Callable) -> "Embedding":
+            # Older configs, imports and backups carry the vector inline
+            vector = None
+            if isinstance(data, dict) and "embedding" in data:
+                data = dict(data)
+                vector = data.pop("embedding")
+            obj = handler(data)
+            if vector is not None:
+                obj.embedding = vector
+            return obj
+
+    else:
+
+        def __init__(self, **data: t.Any):
+            # Pydantic 1 builds nested models through __init__, so the inline vector is popped here
+            vector = data.pop("embedding", None)
+            super().__init__(**data)
+            if vector is not None:
+                self.embedding = vector
+
+        def __setattr__(self, name: str, value: t.Any) -> None:
+            # Pydantic 1 only allows fields to be assigned, so the vector goes through its property
+            if name == "embedding":
+                type(self).embedding.fset(self, value)
+            else:
+                super().__setattr__(name, value)
+
+    @property
+    def embedding(self) -> np.ndarray:
+        if self._vector is None:
+            return np.empty(0, dtype=np.float32)
+        return self._vector
+
+    @embedding.setter
+    def embedding(self, value: t.Union[t.List[float], np.ndarray]) -> None:
+        self._vector = np.asarray(value, dtype=np.float32)
+
+    def dump_with_vector(self) -> dict:
+        """Dump including the vector, for exports and backups"""
+        return {**self.model_dump(), "embedding": self.embedding.tolist()}
+
     def created_at(self, relative: bool = False):
         t_type = "R" if relative else "F"
         return f"<t:{int(self.created.timestamp())}:{t_type}>"
@@ -48,6 +115,17 @@ class Embedding(AssistantBaseModel):
     def update(self):
         self.modified = datetime.now(tz=timezone.utc)
 
+    def content_hash(self) -> str:
+        """Changes whenever the entry does, every edit to the text or vector also bumps `modified`"""
+        raw = (
+            f"{self.text}\x00{self.model}\x00{self.modified.isoformat()}\x00{self.ai_created}\x00{len(self.embedding)}"
+        )
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    def metadata(self) -> dict:
+        """Metadata stored alongside the vector in the collection"""
+        return {**self.model_dump(), "hash": self.content_hash()}
+
     def __str__(self) -> str:
         return self.text
 
@@ -99,6 +177,7 @@ class GuildSettings(AssistantBaseModel):
     model: str = "gpt-5"
     embed_model: str = "text-embedding-3-small"  # Or text-embedding-3-large, text-embedding-ada-002
     collab_convos: bool = False
+    stream_responses: bool = False  # Edit the reply in as it's generated
     reasoning_effort: str = "low"  # low, medium, high (or minimal for gpt-5)
     verbosity: str = "low"  # low, medium, high (gpt-5 only)
 
@@ -129,72 +208,96 @@ class GuildSettings(AssistantBaseModel):
 
     use_function_calls: bool = False
     max_function_calls: int = 20  # Max calls in a row
+    max_concurrent_functions: int = 4  # Max calls from a single response running at once
+    function_timeout: int = 0  # Seconds a function call gets before it's abandoned, 0 for no limit
     function_statuses: t.Dict[str, bool] = {}  # {"function_name": True/False for enabled/disabled}
     functions_called: int = 0
 
-    def sync_embeddings(self, guild_id: int):
+    # Dimensions: local search index, rebuilt after a sync or when the number of entries changes
+    _indexes: t.Dict[int, VectorIndex] = PrivateAttr(default_factory=dict)
+    # Set by DB.get_conf, for attributing usage to the guild
+    _guild_id: int = PrivateAttr(default=0)
+
+    @property
+    def guild_id(self) -> int:
+        return self._guild_id
+
+    def uses_chroma(self) -> bool:
+        """Small guilds (or all of them if Chroma isn't installed) are searched with the local index instead"""
+        return _chroma_client is not None and len(self.embeddings) > LOCAL_INDEX_LIMIT
+
+    def get_collection(self, guild_id: int) -> t.Tuple["chromadb.Collection", bool]:
+        """Get the guild's collection, creating it if needed
+
+        Returns:
+            t.Tuple[chromadb.Collection, bool]: The collection and whether it was just created
+        """
         try:
-            collection = _chroma_client.get_collection(f"assistant-{guild_id}")
-        except ChromaError as e:
+            return _chroma_client.get_collection(f"assistant-{guild_id}"), False
+        except (ChromaError, ValueError) as e:
             log.info(f"Failed to get collection for guild {guild_id}: {e}")
-            collection = None
+        collection = _chroma_client.create_collection(
+            f"assistant-{guild_id}",
+            configuration={"hnsw": {"space": "cosine"}},
+        )
+        return collection, True
+
+    def get_local_index(self, dims: int) -> VectorIndex:
+        index = self._indexes.get(dims)
+        if index is None or index.size != len(self.embeddings):
+            index = self._indexes[dims] = VectorIndex.build(self.embeddings, dims)
+        return index
 
-        if not collection:
-            collection = _chroma_client.create_collection(
-                f"assistant-{guild_id}",
-                configuration={"hnsw": {"space": "cosine"}},
+    def sync_embeddings(self, guild_id: int) -> t.Tuple[int, int, int]:
+        """Bring the guild's search index in line with its embeddings
+
+        Each entry's content hash is stored in its metadata, so only entries that were added, edited or removed
+        since the last sync are sent to the collection. Vectors are never read back to compare them.
+        Guilds searched locally have their collection dropped, their index is rebuilt on the next search.
+
+        Returns:
+            t.Tuple[int, int, int]: The number of entries added, updated and deleted
+        """
+        self._indexes.clear()
+        if not self.uses_chroma():
+            if _chroma_client is not None:
+                try:
+                    _chroma_client.delete_collection(f"assistant-{guild_id}")
+                    log.info(f"Guild {guild_id} is small enough to search locally, dropped its collection")
+                except (ChromaError, ValueError):
+                    pass
+            return 0, 0, 0
+
+        collection, created = self.get_collection(guild_id)
+        stored: t.Dict[str, t.Optional[str]] = {}
+        if not created:
+            existing = collection.get(include=["metadatas"])
+            for embed_name, metadata in zip(existing["ids"], existing["metadatas"] or []):
+                stored[embed_name] = (metadata or {}).get("hash")
+
+        hashes = {name: em.content_hash() for name, em in self.embeddings.items()}
+        to_add = [i for i in hashes if i not in stored]
+        to_update = [i for i in hashes if i in stored and stored[i] != hashes[i]]
+        to_delete = [i for i in stored if i not in hashes]
+
+        batch_size = _max_batch_size()
+        for names, method in ((to_add, collection.add), (to_update, collection.update)):
+            for idx in range(0, len(names), batch_size):
+                batch = names[idx : idx + batch_size]
+                method(
+                    ids=batch,
+                    embeddings=[self.embeddings[i].embedding for i in batch],
+                    metadatas=[self.embeddings[i].metadata() for i in batch],
+                )
+        for idx in range(0, len(to_delete), batch_size):
+            collection.delete(ids=to_delete[idx : idx + batch_size])
+
+        if to_add or to_update or to_delete:
+            log.info(
+                f"Synced embeddings for guild {guild_id}: {len(to_add)} added, "
+                f"{len(to_update)} updated, {len(to_delete)} removed ({len(self.embeddings)} total)"
             )
-            # Populate the collection with existing embeddings
-            ids = list(self.embeddings.keys())
-            if ids:  # Only add if there are embeddings
-                log.info(f"Populating collection with {len(ids)} existing embeddings for guild {guild_id}")
-                embeddings = [em.embedding for em in self.embeddings.values()]
-                metadatas = [i.model_dump(exclude=["embedding"]) for i in self.embeddings.values()]
-                collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas)
-        else:
-            # Make sure everything in self.embeddings is in the collection
-            ids = list(self.embeddings.keys())
-            collection_data = collection.get()
-            existing_ids = collection_data["ids"] if collection_data["ids"] else []
-            new_ids = [i for i in ids if i not in existing_ids]
-            if new_ids:
-                log.info(f"Adding {len(new_ids)} new embeddings to collection for guild {guild_id}")
-                embeddings = [self.embeddings[i].embedding for i in new_ids]
-                metadatas = [self.embeddings[i].model_dump(exclude=["embedding"]) for i in new_ids]
-                collection.add(ids=new_ids, embeddings=embeddings, metadatas=metadatas)
-
-            # See if there are any embeddings in the collection that are not in self.embeddings
-            missing_ids = [i for i in existing_ids if i not in ids]
-            if missing_ids:
-                log.info(f"Removing {len(missing_ids)} old embeddings from collection for guild {guild_id}")
-                collection.delete(ids=list(set(missing_ids)))
-
-            # Make sure that all embeddings match the current text and vector (check for updates)
-            for embed_name, em in self.embeddings.items():
-                if embed_name not in existing_ids:
-                    continue
-                # Get the embedding by ID instead of text for more reliable matching
-                result = collection.get(ids=[embed_name])
-
-                if not result["ids"] or not result["embeddings"]:
-                    log.warning(f"Embedding {embed_name} not found in collection for guild {guild_id}. Adding it.")
-                    collection.add(
-                        ids=[embed_name],
-                        embeddings=[em.embedding],
-                        metadatas=[em.model_dump(exclude=["embedding"])],
-                    )
-                else:
-                    existing_embedding = result["embeddings"][0] if result["embeddings"] else []
-                    if existing_embedding != em.embedding:
-                        log.info(f"Updating embedding {embed_name} in collection for guild {guild_id}.")
-                        collection.update(
-                            ids=[embed_name],
-                            embeddings=[em.embedding],
-                            metadatas=[em.model_dump(exclude=["embedding"])],
-                        )
-                    else:
-                        log.debug(f"Embedding {embed_name} is already up-to-date in collection for guild {guild_id}.")
-        log.info(f"Synced embeddings for guild {guild_id} with {len(self.embeddings)} embeddings.")
+        return len(to_add), len(to_update), len(to_delete)
 
     def get_related_embeddings(
         self,
@@ -203,73 +306,70 @@ class GuildSettings(AssistantBaseModel):
         top_n_override: t.Optional[int] = None,
         relatedness_override: t.Optional[float] = None,
     ) -> t.List[t.Tuple[str, str, float, int]]:
-        def cosine_similarity(a, b):
-            return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-        if not query_embedding:
+        if not len(query_embedding):
             return []
         # Name, text, score, dimensions
         q_length = len(query_embedding)
         top_n = top_n_override or self.top_n
         min_relatedness = relatedness_override or self.min_relatedness
 
-        if not top_n or q_length == 0 or not self.embeddings:
+        if not top_n or not self.embeddings:
             return []
 
-        if not all(q_length == len(em.embedding) for em in self.embeddings.values()):
-            log.warning(
-                f"Query embedding length {q_length} does not match all stored embeddings in guild {guild_id}. "
-                "Skipping related embeddings search."
-            )
-            return []
-
-        try:
-            collection = _chroma_client.get_collection(f"assistant-{guild_id}")
-        except ChromaError as e:
-            log.info(f"Failed to get collection for guild {guild_id}: {e}")
-            collection = None
-
-        if not collection:
-            collection = _chroma_client.create_collection(
-                f"assistant-{guild_id}",
-                metadata={"hnsw:space": "cosine", "guild_id": guild_id},
-            )
-            # Populate the collection with existing embeddings
-            ids = list(self.embeddings.keys())
-            log.info(f"Populating collection with {len(ids)} existing embeddings for guild {guild_id}")
-            embeddings = [em.embedding for em in self.embeddings.values()]
-            metadatas = [i.model_dump(exclude=["embedding"]) for i in self.embeddings.values()]
-            collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas)
-
         start = perf_counter()
-        results = collection.query(query_embeddings=[query_embedding], n_results=top_n_override or self.top_n)
-        # print(results)
+        results = None
+        if self.uses_chroma():
+            results = self.query_collection(guild_id, query_embedding, top_n)
+        if results is None:
+            index = self.get_local_index(q_length)
+            if len(index.names) != len(self.embeddings):
+                log.debug(
+                    f"{len(self.embeddings) - len(index.names)} embeddings in guild {guild_id} don't match the "
+                    f"query length of {q_length} and were skipped, they need to be refreshed"
+                )
+            results = index.search(query_embedding, top_n)
+
         strings_and_relatedness = []
-        for idx in range(len(results["ids"][0])):
-            embed_name = results["ids"][0][idx]
-            embed_obj = self.embeddings.get(embed_name)
-            if not embed_obj:
-                # In collection but not config, remove it
-                collection.delete(ids=[embed_name])
+        for embed_name, relatedness in results:
+            em = self.embeddings.get(embed_name)
+            if em is None or relatedness < min_relatedness:
                 continue
-            embedding = self.embeddings[embed_name].embedding
-            metadata = results["metadatas"][0][idx] if results["metadatas"] else {}
-            distance = results["distances"][0][idx] if results["distances"] else 0.0
-            relatedness = 1 - distance
-            if relatedness >= min_relatedness:
-                strings_and_relatedness.append((embed_name, metadata["text"], relatedness, len(embedding)))
+            strings_and_relatedness.append((embed_name, em.text, relatedness, len(em.embedding)))
 
-        end = perf_counter()
-        iter_time = end - start
         log.debug(
-            f"Got {len(strings_and_relatedness)} related embeddings in {iter_time:.2f} seconds for guild {guild_id}."
+            f"Got {len(strings_and_relatedness)} related embeddings in {perf_counter() - start:.4f} seconds for guild {guild_id}."
         )
+        return strings_and_relatedness
 
-        if not strings_and_relatedness:
-            return []
-
-        strings_and_relatedness.sort(key=lambda x: x[2], reverse=True)
-        return strings_and_relatedness[:top_n]
+    def query_collection(
+        self,
+        guild_id: int,
+        query_embedding: t.List[float],
+        top_n: int,
+    ) -> t.Optional[t.List[t.Tuple[str, float]]]:
+        """Search the guild's collection, returns None if it can't be used so the local index is searched instead"""
+        try:
+            collection = _chroma_client.get_collection(f"assistant-{guild_id}")
+        except (ChromaError, ValueError):
+            return None
+        if collection.count() != len(self.embeddings):
+            # Out of sync until the next sync, don't hold up the reply to resync it here
+            return None
+        try:
+            results = collection.query(query_embeddings=[query_embedding], n_results=top_n)
+        except (ChromaError, ValueError) as e:
+            # Most likely the query is a different size than the stored vectors
+            log.debug(f"Collection query failed for guild {guild_id}: {e}")
+            return None
+        found = []
+        for idx, embed_name in enumerate(results["ids"][0]):
+            if embed_name not in self.embeddings:
+                # In collection but not config, remove it
+                collection.delete(ids=[embed_name])
+                continue
+            distance = results["distances"][0][idx] if results["distances"] else 0.0
+            found.append((embed_name, 1 - distance))
+        return found
 
     def update_usage(
         self,
@@ -464,16 +564,27 @@ class Conversation(AssistantBaseModel):
 
 class DB(AssistantBaseModel):
     configs: t.Dict[int, GuildSettings] = {}
-    conversations: t.Dict[str, Conversation] = {}
+    # Conversations in memory, persistent ones live in the conversation store and aren't part of the config
+    conversations: t.Dict[str, Conversation] = Field(default_factory=dict, exclude=True)
     persistent_conversations: bool = False
     functions: t.Dict[str, CustomFunction] = {}
     listen_to_bots: bool = False
     brave_api_key: t.Optional[str] = None
     endpoint_override: t.Optional[str] = None
+    embed_batch_size: int = 256  # Max texts per embedding API call
+    embed_concurrency: int = 4  # Max embedding API calls in flight
+    embed_cache_size: int = 10000  # Max embeddings cached on disk
+
+    _store: t.Optional[ConversationStore] = PrivateAttr(default=None)
+
+    def attach_store(self, store: ConversationStore) -> None:
+        self._store = store
 
     def get_conf(self, guild: t.Union[discord.Guild, int]) -> GuildSettings:
         gid = guild if isinstance(guild, int) else guild.id
-        return self.configs.setdefault(gid, GuildSettings())
+        conf = self.configs.setdefault(gid, GuildSettings())
+        conf._guild_id = gid
+        return conf
 
     def get_conversation(
         self,
@@ -482,7 +593,31 @@ class DB(AssistantBaseModel):
         guild_id: int,
     ) -> Conversation:
         key = f"{member_id}-{channel_id}-{guild_id}"
-        return self.conversations.setdefault(key, Conversation())
+        if key in self.conversations:
+            return self.conversations[key]
+        conversation = None
+        if self.persistent_conversations and self._store is not None:
+            # A single small file, not worth leaving the event loop for
+            if data := self._store.load(key):
+                conversation = Conversation.model_validate(data)
+        return self.conversations.setdefault(key, conversation or Conversation())
+
+    def has_conversation(self, key: str) -> bool:
+        if key in self.conversations:
+            return True
+        return self.persistent_conversations and self._store is not None and self._store.exists(key)
+
+    def conversation_keys(self) -> t.Set[str]:
+        """Keys of every conversation, in memory or on disk"""
+        keys = set(self.conversations)
+        if self.persistent_conversations and self._store is not None:
+            keys |= self._store.keys()
+        return keys
+
+    def delete_conversation(self, key: str) -> None:
+        self.conversations.pop(key, None)
+        if self._store is not None:
+            self._store.discard(key)
 
     async def prep_functions(
         self,
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import typing as t
+from multiprocessing.connection import Connection
+
+log = logging.getLogger("red.vrt.assistant.regex")
+
+# Runs in the worker process. Passed as source to `exec` so the child never has to import the cog,
+# which platforms that spawn processes instead of forking them can't do.
+WORKER_SOURCE = """
+import re
+from functools import lru_cache
+
+compile_pattern = lru_cache(maxsize=1024)(re.compile)
+conn.send("ready")
+while True:
+    try:
+        job = conn.recv()
+    except (EOFError, OSError):
+        break
+    if job is None:
+        break
+    patterns, text = job
+    errors = []
+    for pattern in patterns:
+        try:
+            text = compile_pattern(pattern).sub("", text)
+            errors.append(None)
+        except re.error as e:
+            errors.append(str(e))
+    conn.send((text, errors))
+"""
+
+
+class RegexWorker:
+    """A single long lived process that regex substitutions are sent to"""
+
+    def __init__(self):
+        self.conn: t.Optional[Connection] = None
+        self.process: t.Optional[mp.Process] = None
+
+    def start(self) -> None:
+        """Blocking call, waits for the worker to be ready so startup time never counts against a batch"""
+        self.conn, child = mp.Pipe()
+        self.process = mp.Process(target=exec, args=(WORKER_SOURCE, {"conn": child}), daemon=True)
+        self.process.start()
+        child.close()
+        self.conn.recv()
+
+    def stop(self) -> None:
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(0.5)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+        self.process = None
+
+    def restart(self) -> None:
+        if self.process is not None:
+            # Most likely stuck on catastrophic backtracking, don't wait for it
+            self.process.kill()
+            self.conn.close()
+            self.process = None
+        self.start()
+
+    def run(
+        self, patterns: t.List[str], text: str, timeout: float
+    ) -> t.Optional[t.Tuple[str, t.List[t.Optional[str]]]]:
+        """Blocking call, returns None if the worker didn't answer in time"""
+        if self.process is None or not self.process.is_alive():
+            self.restart()
+        try:
+            self.conn.send((patterns, text))
+            if not self.conn.poll(timeout):
+                return None
+            return self.conn.recv()
+        except (EOFError, OSError) as e:
+            # Worker died mid-job, replace it and try once more
+            log.warning("Regex worker died, restarting it", exc_info=e)
+            self.restart()
+            self.conn.send((patterns, text))
+            if not self.conn.poll(timeout):
+                return None
+            return self.conn.recv()
+
+
+class RegexPool:
+    """Warm worker processes that apply a guild's whole regex blacklist in one round trip
+
+    Patterns are compiled once per worker and cached, and each batch has a hard timeout. A worker that runs over
+    (a pattern with catastrophic backtracking) is killed and replaced, so a bad pattern can't hold a process hostage.
+
+    Args:
+        size (int): Number of worker processes
+    """
+
+    def __init__(self, size: int = 0):
+        self.size = size or min(4, os.cpu_count() or 1)
+        self.idle: t.Optional[asyncio.Queue] = None
+        self.workers: t.List[RegexWorker] = []
+
+    def start(self) -> None:
+        self.workers = [RegexWorker() for _ in range(self.size)]
+        for worker in self.workers:
+            worker.start()
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.stop()
+        self.workers.clear()
+        self.idle = None
+
+    async def sub(
+        self,
+        patterns: t.List[str],
+        text: str,
+        timeout: float = 2.0,
+    ) -> t.Tuple[str, t.List[t.Optional[str]]]:
+        """Remove every match of each pattern from the text, applied in order
+
+        Raises:
+            asyncio.TimeoutError: If the batch took longer than `timeout`
+
+        Returns:
+            t.Tuple[str, t.List[t.Optional[str]]]: The text and, per pattern, the error if it failed to compile
+        """
+        if not patterns:
+            return text, []
+        if not self.workers:
+            await asyncio.to_thread(self.start)
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+            for worker in self.workers:
+                self.idle.put_nowait(worker)
+        worker: RegexWorker = await self.idle.get()
+        try:
+            result = await asyncio.to_thread(worker.run, patterns, text, timeout)
+            if result is None:
+                await asyncio.to_thread(worker.restart)
+                raise asyncio.TimeoutError
+            return result
+        finally:
+            self.idle.put_nowait(worker)
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import re
+import typing as t
+from time import monotonic
+
+import discord
+from openai import AsyncStream
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletionChunk
+from openai.types.chat.chat_completion_message import ChatCompletionMessage
+
+log = logging.getLogger("red.vrt.assistant.streaming")
+
+THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+CURSOR = " \N{BLACK VERTICAL RECTANGLE}"
+# Discord allows 5 edits per 5 seconds on a message, staying under that leaves room for the final edit
+EDIT_INTERVAL = 1.5
+
+
+class StreamedReply:
+    """Rebuilds a full completion from the chunks of a streamed one
+
+    Content deltas are forwarded to `on_content` as they arrive, tool call deltas are stitched together by index.
+    Usage only comes with the last chunk, and only if the endpoint honors `stream_options`.
+    """
+
+    def __init__(self, on_content: t.Optional[t.Callable[[str], t.Awaitable[None]]] = None):
+        self.on_content = on_content
+        self.model: t.Optional[str] = None
+        self.content: t.List[str] = []
+        self.refusal: t.List[str] = []
+        # Index: {"id", "type", "function": {"name", "arguments"}}
+        self.tool_calls: t.Dict[int, dict] = {}
+        self.function_call: t.Optional[dict] = None
+        self.usage: t.Optional[CompletionUsage] = None
+        self.first_token: t.Optional[float] = None
+
+    async def consume(self, stream: AsyncStream[ChatCompletionChunk]) -> "StreamedReply":
+        start = monotonic()
+        async for chunk in stream:
+            self.model = chunk.model or self.model
+            if chunk.usage:
+                self.usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                if self.first_token is None:
+                    self.first_token = monotonic() - start
+                self.content.append(delta.content)
+                if self.on_content:
+                    await self.on_content(delta.content)
+            if getattr(delta, "refusal", None):
+                self.refusal.append(delta.refusal)
+            for call in delta.tool_calls or []:
+                entry = self.tool_calls.setdefault(
+                    call.index,
+                    {"id": "", "type": "function", "function": {"name": "", "arguments": ""}},
+                )
+                if call.id:
+                    entry["id"] = call.id
+                if call.function:
+                    entry["function"]["name"] += call.function.name or ""
+                    entry["function"]["arguments"] += call.function.arguments or ""
+            if delta.function_call:
+                if self.function_call is None:
+                    self.function_call = {"name": "", "arguments": ""}
+                self.function_call["name"] += delta.function_call.name or ""
+                self.function_call["arguments"] += delta.function_call.arguments or ""
+        if self.first_token is not None:
+            log.debug(f"Streamed reply from {self.model}, first token after {self.first_token:.2f}s")
+        return self
+
+    def message(self) -> ChatCompletionMessage:
+        return ChatCompletionMessage.model_validate(
+            {
+                "role": "assistant",
+                "content": "".join(self.content) or None,
+                "refusal": "".join(self.refusal) or None,
+                "tool_calls": [self.tool_calls[i] for i in sorted(self.tool_calls)] or None,
+                "function_call": self.function_call,
+            }
+        )
+
+
+class StreamEditor:
+    """Shows a reply while it's being generated by posting it early and editing it as more arrives
+
+    Edits are sent from a background task no more often than every `interval` seconds, so reading the stream is
+    never held up by Discord. Once the reply is done, `finish` either edits in the final text or removes the
+    preview so the reply can be sent the usual way (long replies, files, embeds).
+
+    Args:
+        message (discord.Message): The message being replied to
+        mention (bool): Whether to mention the author in the reply
+        clean (t.Callable[[str], t.Awaitable[str]], optional): Filter applied to the text before it's shown
+        interval (float): Min seconds between edits
+    """
+
+    def __init__(
+        self,
+        message: discord.Message,
+        mention: bool = False,
+        clean: t.Optional[t.Callable[[str], t.Awaitable[str]]] = None,
+        interval: float = EDIT_INTERVAL,
+    ):
+        self.source = message
+        self.mention = mention
+        self.clean = clean
+        self.interval = interval
+        self.text = ""
+        self.shown = ""
+        self.message: t.Optional[discord.Message] = None
+        self.task: t.Optional[asyncio.Task] = None
+        self.last_edit = 0.0
+        self.failed = False
+
+    def reset(self) -> None:
+        """Start over for a new completion, the text of the previous one was only a lead-in to a tool call"""
+        self.text = ""
+
+    async def preview(self) -> str:
+        text = self.text
+        if self.clean:
+            text = await self.clean(text)
+        text = THINK_BLOCK.sub("", text)
+        if "<think>" in text:
+            # Still thinking, don't show it
+            text = text[: text.index("<think>")]
+        text = text.strip()
+        if not text:
+            return ""
+        if len(text) > 2000 - len(CURSOR):
+            text = text[: 1999 - len(CURSOR)] + "\N{HORIZONTAL ELLIPSIS}"
+        return text + CURSOR
+
+    async def feed(self, delta: str) -> None:
+        self.text += delta
+        if self.failed or (self.task and not self.task.done()):
+            return
+        if monotonic() - self.last_edit < self.interval:
+            return
+        self.task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        try:
+            content = await self.preview()
+        except Exception as e:
+            # A blacklist regex failing here would fail the final reply too, stop showing anything
+            log.warning("Failed to clean streamed reply, it will be sent once complete", exc_info=e)
+            self.failed = True
+            return
+        if not content or content == self.shown:
+            return
+        try:
+            if self.message is None:
+                self.message = await self.source.reply(content, mention_author=self.mention)
+            else:
+                await self.message.edit(content=content)
+        except discord.HTTPException as e:
+            log.warning("Failed to update streamed reply, it will be sent once complete", exc_info=e)
+            self.failed = True
+            return
+        self.shown = content
+        self.last_edit = monotonic()
+
+    async def finish(self, reply: t.Optional[str]) -> bool:
+        """Put the final reply in place of the preview
+
+        Returns:
+            bool: True if the reply was delivered, False if it still needs to be sent
+        """
+        if self.task:
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.message is None:
+            return False
+        if reply and not self.failed and len(reply) <= 2000 and "<think>" not in reply:
+            try:
+                await self.message.edit(content=reply)
+                return True
+            except discord.HTTPException as e:
+                log.warning("Failed to finish streamed reply, sending it instead", exc_info=e)
+        try:
+            await self.message.delete()
+        except discord.HTTPException:
+            pass
+        self.message = None
+        return False
@@ -0,0 +1,155 @@
+import csv
+import logging
+import typing as t
+from collections import deque
+from dataclasses import asdict, dataclass, fields
+from io import StringIO
+from time import time
+
+import orjson
+
+from .constants import PRICES
+
+log = logging.getLogger("red.vrt.assistant.telemetry")
+
+GroupBy = t.Literal["guild", "user", "model", "kind"]
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """Cost in USD, dated model names (gpt-4o-2024-08-06) are priced as their base model"""
+    prices = PRICES.get(model)
+    if prices is None:
+        base = max((name for name in PRICES if model.startswith(name)), key=len, default=None)
+        prices = PRICES[base] if base else [0, 0]
+    return input_tokens / 1000 * prices[0] + output_tokens / 1000 * prices[1]
+
+
+@dataclass(slots=True)
+class Event:
+    """A single API call or function call
+
+    Args:
+        timestamp (float): Unix time the call finished
+        kind (str): chat, embedding or function
+        guild_id (int): Guild the call was made for, 0 if unknown
+        user_id (int): User the call was made for, 0 if unknown
+        model (str): Model that handled the call, or the function's name
+        latency (float): Seconds the call took
+        input_tokens (int): Prompt tokens
+        output_tokens (int): Completion tokens
+        cost (float): Estimated cost in USD
+        ok (bool): False if the call raised or timed out
+        first_token (float): Seconds until the first streamed token, 0 if not streamed
+        items (int): Texts in an embedding request
+        cached (int): Texts served from the embedding cache
+    """
+
+    timestamp: float
+    kind: str
+    guild_id: int
+    user_id: int
+    model: str
+    latency: float
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0.0
+    ok: bool = True
+    first_token: float = 0.0
+    items: int = 0
+    cached: int = 0
+
+
+def percentile(values: t.List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+class Telemetry:
+    """Rolling window of the most recent calls, kept in memory
+
+    Recording is a deque append, the oldest events fall off once `max_events` is reached.
+
+    Args:
+        max_events (int): Max events kept
+    """
+
+    def __init__(self, max_events: int = 100000):
+        self.events: t.Deque[Event] = deque(maxlen=max_events)
+
+    def record(
+        self,
+        kind: str,
+        model: str,
+        latency: float,
+        guild_id: int = 0,
+        user_id: int = 0,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        ok: bool = True,
+        **kwargs,
+    ) -> None:
+        cost = estimate_cost(model, input_tokens, output_tokens) if kind != "function" else 0.0
+        self.events.append(
+            Event(
+                timestamp=time(),
+                kind=kind,
+                guild_id=guild_id,
+                user_id=user_id,
+                model=model,
+                latency=latency,
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                cost=cost,
+                ok=ok,
+                **kwargs,
+            )
+        )
+
+    def select(self, hours: float = 0, guild_id: int = 0) -> t.List[Event]:
+        """Events from the last `hours` (all of them if 0), optionally for a single guild"""
+        cutoff = time() - hours * 3600 if hours else 0
+        return [i for i in self.events if i.timestamp >= cutoff and (not guild_id or i.guild_id == guild_id)]
+
+    @staticmethod
+    def summarize(events: t.List[Event], by: GroupBy) -> t.List[t.Dict[str, t.Any]]:
+        """Totals per group, most expensive first"""
+        attr = {"guild": "guild_id", "user": "user_id", "model": "model", "kind": "kind"}[by]
+        groups: t.Dict[t.Any, t.List[Event]] = {}
+        for event in events:
+            groups.setdefault(getattr(event, attr), []).append(event)
+        rows = []
+        for key, group in groups.items():
+            latencies = [i.latency for i in group]
+            first_tokens = [i.first_token for i in group if i.first_token]
+            items = sum(i.items for i in group)
+            rows.append(
+                {
+                    by: key,
+                    "calls": len(group),
+                    "errors": sum(not i.ok for i in group),
+                    "input_tokens": sum(i.input_tokens for i in group),
+                    "output_tokens": sum(i.output_tokens for i in group),
+                    "cost": sum(i.cost for i in group),
+                    "p50": percentile(latencies, 0.5),
+                    "p95": percentile(latencies, 0.95),
+                    "first_token_p50": percentile(first_tokens, 0.5),
+                    "cache_rate": sum(i.cached for i in group) / items if items else 0.0,
+                }
+            )
+        rows.sort(key=lambda x: (x["cost"], x["calls"]), reverse=True)
+        return rows
+
+    @staticmethod
+    def to_csv(events: t.List[Event]) -> str:
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([i.name for i in fields(Event)])
+        for event in events:
+            writer.writerow([getattr(event, i.name) for i in fields(Event)])
+        return buffer.getvalue()
+
+    @staticmethod
+    def to_json(events: t.List[Event]) -> bytes:
+        return orjson.dumps([asdict(i) for i in events])
@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import threading
+import typing as t
+from collections import OrderedDict
+from functools import lru_cache
+
+import orjson
+import tiktoken
+
+from .constants import VISION_COSTS
+
+log = logging.getLogger("red.vrt.assistant.tokens")
+
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+REPLY_PRIMER = 3  # every reply is primed with <|start|>assistant<|message|>
+
+
+@lru_cache(maxsize=64)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def content_hash(obj: t.Any) -> bytes:
+    """Stable digest of a message or schema, keys are sorted so dict order doesn't matter"""
+    raw = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS, default=str)
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+
+class TokenCache:
+    """Bounded LRU of token counts, keyed by content hash so identical content is only ever tokenized once
+
+    Messages are keyed by their encoding (image costs are keyed by model since they differ between models of the
+    same encoding), function schema sets are keyed by model since the per-function overhead differs between models.
+    Counting runs in worker threads, so lookups and inserts hold a lock.
+    """
+
+    def __init__(self, max_size: int = 20000):
+        self.max_size = max_size
+        self.cache: t.OrderedDict[t.Tuple[str, bytes], int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: t.Tuple[str, bytes]) -> t.Optional[int]:
+        with self.lock:
+            tokens = self.cache.get(key)
+            if tokens is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return tokens
+
+    def set(self, key: t.Tuple[str, bytes], tokens: int) -> None:
+        with self.lock:
+            self.cache[key] = tokens
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def message_tokens(self, message: dict, model: str) -> int:
+        """Tokens a single message adds to the payload, not including the reply primer"""
+        has_images = isinstance(message.get("content"), list) and any(
+            i.get("type") == "image_url" for i in message["content"]
+        )
+        encoding = get_encoding(model)
+        key = (model if has_images else encoding.name, content_hash(message))
+        if (tokens := self.get(key)) is not None:
+            return tokens
+
+        tokens = TOKENS_PER_MESSAGE
+        for k, value in message.items():
+            if k == "name":
+                tokens += TOKENS_PER_NAME
+            if k == "content" and isinstance(value, list):
+                for item in value:
+                    if item["type"] == "text":
+                        tokens += len(encoding.encode(item["text"]))
+                    elif item["type"] == "image_url":
+                        tokens += VISION_COSTS.get(model, [1000])[0]  # Just assume around 1k tokens for images
+            else:  # String, probably
+                tokens += len(encoding.encode(str(value)))
+
+        self.set(key, tokens)
+        return tokens
+
+    def payload_tokens(self, messages: t.List[dict], model: str) -> int:
+        if not messages:
+            return 0
+        return sum(self.message_tokens(message, model) for message in messages) + REPLY_PRIMER
+
+    def function_tokens(self, functions: t.List[dict], model: str, count: t.Callable[[], int]) -> int:
+        """Token count of a function schema set, `count` is only called if the set hasn't been seen before"""
+        key = (model, content_hash(functions))
+        if (tokens := self.get(key)) is not None:
+            return tokens
+        tokens = count()
+        self.set(key, tokens)
+        return tokens
+
+
+token_cache = TokenCache()
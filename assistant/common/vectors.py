@@ -0,0 +1,197 @@
+import logging
+import typing as t
+from collections import defaultdict
+from pathlib import Path
+from time import time_ns
+
+import numpy as np
+import orjson
+
+if t.TYPE_CHECKING:
+    from .models import Embedding, GuildSettings
+
+log = logging.getLogger("red.vrt.assistant.vectors")
+
+# Entry name, entry, and its vector when the snapshot was taken
+Entry = t.Tuple[str, "Embedding", np.ndarray]
+
+
+class VectorStore:
+    """Embedding vectors kept on disk as float32 arrays instead of in Red's config
+
+    Each guild gets one `.npy` file per vector size (mixed sizes only exist until embeddings are refreshed after a
+    model change) and an index file listing each file and which entry each row belongs to. Files are memory-mapped
+    on load, so vectors are only paged in when they're used.
+
+    Files are rewritten as a whole, but only for guilds whose entries changed since the last write. A mapped file
+    can't be replaced on Windows, so every write goes to a new file name and the index is switched over to it. Old
+    files are removed once nothing maps them anymore.
+
+    Args:
+        path (Path): Directory holding the vector files
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        # Guild ID: {entry name: content hash} as of the last write
+        self.written: t.Dict[int, t.Dict[str, str]] = {}
+
+    def index_path(self, guild_id: int) -> Path:
+        return self.path / f"{guild_id}.json"
+
+    def array_path(self, guild_id: int, dims: int) -> Path:
+        """A file name that hasn't been used before, so writing it never touches a mapped file"""
+        return self.path / f"{guild_id}-{dims}-{time_ns()}.npy"
+
+    def remove(self, files: t.Iterable[Path]) -> None:
+        for file in files:
+            try:
+                file.unlink(missing_ok=True)
+            except OSError:
+                # Still mapped by an entry, it's tried again on the guild's next write or load
+                log.debug(f"Vector file {file.name} is still in use")
+
+    def load(self, configs: t.Dict[int, "GuildSettings"]) -> int:
+        """Attach stored vectors to their entries
+
+        Entries that already have a vector (configs saved before vectors moved out) keep it and get written out on
+        the next save.
+
+        Returns:
+            int: The number of vectors loaded
+        """
+        loaded = 0
+        for guild_id, conf in configs.items():
+            index_path = self.index_path(guild_id)
+            if not index_path.exists():
+                continue
+            try:
+                # {dims: {"file": file name, "names": entry name per row}}
+                index: t.Dict[str, t.Dict[str, t.Any]] = orjson.loads(index_path.read_bytes())
+            except orjson.JSONDecodeError:
+                log.error(f"Vector index for guild {guild_id} is corrupt, its embeddings will need to be refreshed")
+                continue
+            for dims, group in index.items():
+                if isinstance(group, list):
+                    # Written before file names were versioned
+                    index[dims] = {"file": f"{guild_id}-{dims}.npy", "names": group}
+            # Files left behind by an interrupted write or one that couldn't remove them
+            in_use = {self.path / i["file"] for i in index.values()}
+            self.remove(set(self.path.glob(f"{guild_id}-*.npy")) - in_use)
+            written = {}
+            for group in index.values():
+                array_path = self.path / group["file"]
+                names: t.List[str] = group["names"]
+                if not array_path.exists():
+                    log.error(f"Vector file {array_path.name} is missing, its embeddings will need to be refreshed")
+                    continue
+                matrix = np.load(array_path, mmap_mode="r")
+                for row, name in enumerate(names):
+                    em = conf.embeddings.get(name)
+                    if em is None:
+                        continue
+                    if len(em.embedding):
+                        # Vector came from the config itself, it is newer than what's on disk
+                        continue
+                    em.embedding = matrix[row]
+                    written[name] = em.content_hash()
+                    loaded += 1
+            self.written[guild_id] = written
+        return loaded
+
+    def snapshot(self, configs: t.Dict[int, "GuildSettings"]) -> t.Dict[int, t.Optional[t.List[Entry]]]:
+        """Collect the guilds that need writing, meant to run on the event loop before `write`
+
+        Returns:
+            t.Dict[int, t.Optional[t.List[Entry]]]: Entries per changed guild, None if the guild's files should be removed
+        """
+        changed = {}
+        for guild_id, conf in configs.items():
+            hashes = {name: em.content_hash() for name, em in conf.embeddings.items()}
+            if hashes == self.written.get(guild_id, {}):
+                continue
+            changed[guild_id] = [(name, em, em.embedding) for name, em in conf.embeddings.items()]
+            self.written[guild_id] = hashes
+        for guild_id in list(self.written):
+            if guild_id not in configs:
+                changed[guild_id] = None
+                del self.written[guild_id]
+        return changed
+
+    def write(self, changed: t.Dict[int, t.Optional[t.List[Entry]]]) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        for guild_id, entries in changed.items():
+            old_files = set(self.path.glob(f"{guild_id}-*.npy"))
+            if not entries:
+                self.index_path(guild_id).unlink(missing_ok=True)
+                self.remove(old_files)
+                continue
+
+            grouped: t.Dict[int, t.List[Entry]] = defaultdict(list)
+            for entry in entries:
+                if dims := len(entry[2]):
+                    grouped[dims].append(entry)
+
+            index = {}
+            for dims, group in grouped.items():
+                array_path = self.array_path(guild_id, dims)
+                with array_path.open("wb") as f:
+                    np.save(f, np.stack([vector for _, _, vector in group]).astype(np.float32, copy=False))
+                index[str(dims)] = {"file": array_path.name, "names": [name for name, _, _ in group]}
+
+                # Point the entries at the new file so the old one can be let go
+                matrix = np.load(array_path, mmap_mode="r")
+                for row, (_, em, vector) in enumerate(group):
+                    if em.embedding is vector:  # Unless it was edited while writing
+                        em.embedding = matrix[row]
+
+            tmp = self.index_path(guild_id).with_suffix(".tmp")
+            tmp.write_bytes(orjson.dumps(index))
+            tmp.replace(self.index_path(guild_id))
+            self.remove(old_files)
+
+
+class VectorIndex:
+    """Exact in-process nearest neighbour search over a guild's vectors of one size
+
+    Vectors are normalized once when the index is built, so a search is a single matrix-vector product and a
+    partial sort. Below a few thousand entries this is well under a millisecond and doesn't need Chroma at all.
+
+    Args:
+        names (t.List[str]): Entry name for each row
+        matrix (np.ndarray): Vectors, one per row
+        size (int): Number of entries in the guild when the index was built, to tell when it's stale
+    """
+
+    def __init__(self, names: t.List[str], matrix: np.ndarray, size: int):
+        self.names = names
+        self.size = size
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = (matrix / norms).astype(np.float32, copy=False)
+
+    @classmethod
+    def build(cls, embeddings: t.Dict[str, "Embedding"], dims: int) -> "VectorIndex":
+        """Index every entry whose vector has `dims` dimensions"""
+        names = [name for name, em in embeddings.items() if len(em.embedding) == dims]
+        if names:
+            matrix = np.stack([embeddings[name].embedding for name in names]).astype(np.float32, copy=False)
+        else:
+            matrix = np.empty((0, dims), dtype=np.float32)
+        return cls(names, matrix, len(embeddings))
+
+    def search(self, query: t.Union[t.List[float], np.ndarray], top_n: int) -> t.List[t.Tuple[str, float]]:
+        """Entry names and cosine similarities of the `top_n` closest vectors, best first"""
+        if not self.names or top_n <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return []
+        scores = self.matrix @ (query / norm)
+        if top_n < len(scores):
+            top = np.argpartition(scores, -top_n)[-top_n:]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(self.names[i], float(scores[i])) for i in top]
@@ -319,6 +319,7 @@ class EmbeddingMenu(discord.ui.View):
         name = self.pages[self.page].fields[self.place].name.replace("➣ ", "", 1)
         await interaction.response.send_message(_("Deleted `{}` embedding.").format(name), ephemeral=True)
         del self.conf.embeddings[name]
+        await asyncio.to_thread(self.conf.sync_embeddings, self.ctx.guild.id)
         await self.get_pages()
         self.page %= len(self.pages)
         self.message = await self.message.edit(embed=self.pages[self.page], view=self)
@@ -10,7 +10,14 @@ from discord.ext.commands.cog import CogMeta
 from redbot.core import commands
 from redbot.core.bot import Red
 
+from .common.cache import ContentCache, RenderCache
+from .common.journal import Journal
+from .common.lbcache import LeaderboardCache
 from .common.models import DB, GuildSettings, Profile, VoiceTracking
+from .common.rolesync import RolePlan, RoleQueue
+from .common.rules import PendingXP
+from .generator.endpoints import EndpointPool
+from .generator.pool import RenderPool
 from .generator.tenor.converter import TenorAPI
 
 
@@ -28,8 +35,15 @@ class MixinMeta(ABC):
         self.db: DB
         self.lastmsg: t.Dict[int, t.Dict[int, float]]
         self.voice_tracking: t.Dict[int, t.Dict[int, VoiceTracking]]
-        self.profile_cache: t.Dict[int, t.Dict[int, t.Tuple[str, bytes]]]
+        self.voice_channels: t.Dict[int, t.Set[int]]
+        self.profile_cache: t.Dict[int, t.Dict[int, t.Tuple[float, str]]]
+        self.render_cache: RenderCache
+        self.content_cache: ContentCache
         self.stars: t.Dict[int, t.Dict[int, datetime]]
+        self.pending_xp: t.Dict[t.Tuple[int, int], PendingXP]
+        self.role_plans: t.Dict[int, RolePlan]
+        self.role_queue: RoleQueue
+        self.lb_cache: LeaderboardCache
 
         self.cog_path: Path
         self.bundled_path: Path
@@ -42,6 +56,7 @@ class MixinMeta(ABC):
         self.backgrounds: Path
 
         # Save state
+        self.journal: Journal
         self.last_save: float
 
         # Tenor
@@ -49,9 +64,11 @@ class MixinMeta(ABC):
 
         # Internal API
         self.api_proc: t.Union[asyncio.subprocess.Process, mp.Process]
+        self.render_pool: t.Optional[RenderPool]
+        self.endpoints: EndpointPool
 
     @abstractmethod
-    def save(self) -> None:
+    def save(self, full: bool = True, guild: t.Optional[t.Union[discord.Guild, int]] = None) -> None:
         raise NotImplementedError
 
     @abstractmethod
@@ -62,10 +79,57 @@ class MixinMeta(ABC):
     async def stop_api(self) -> bool:
         raise NotImplementedError
 
+    @abstractmethod
+    def refresh_endpoints(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def start_render_pool(self) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def stop_render_pool(self) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def render(self, fn: str, kwargs: t.Dict[str, t.Any], guild_id: int = 0) -> t.Tuple[bytes, bool]:
+        raise NotImplementedError
+
     @abstractmethod
     async def initialize_voice_states(self) -> int:
         raise NotImplementedError
 
+    @abstractmethod
+    def refresh_voice_state(
+        self,
+        conf: GuildSettings,
+        member: discord.Member,
+        perf: float,
+        state: t.Optional[discord.VoiceState] = None,
+    ) -> VoiceTracking:
+        raise NotImplementedError
+
+    @abstractmethod
+    def credit_voice(
+        self,
+        conf: GuildSettings,
+        member: discord.Member,
+        data: VoiceTracking,
+        channel: discord.abc.GuildChannel,
+        perf: float,
+    ) -> float:
+        raise NotImplementedError
+
+    # -------------------------- voice.py --------------------------
+    @abstractmethod
+    async def flush_voice(self, check_levelups: bool = True) -> int:
+        raise NotImplementedError
+
+    # -------------------------- xpbatch.py --------------------------
+    @abstractmethod
+    async def flush_xp(self, check_levelups: bool = True) -> int:
+        raise NotImplementedError
+
     # -------------------------- levelups.py --------------------------
     @abstractmethod
     async def check_levelups(
@@ -90,11 +154,19 @@ class MixinMeta(ABC):
     ) -> t.Tuple[t.List[discord.Role], t.List[discord.Role]]:
         raise NotImplementedError
 
+    @abstractmethod
+    def get_role_plan(self, conf: GuildSettings, guild: discord.Guild) -> RolePlan:
+        raise NotImplementedError
+
     # -------------------------- weeklyreset.py --------------------------
     @abstractmethod
     async def reset_weekly(self, guild: discord.Guild, ctx: commands.Context = None) -> bool:
         raise NotImplementedError
 
+    @abstractmethod
+    async def sync_weekly_roles(self) -> int:
+        raise NotImplementedError
+
     # -------------------------- profile.py --------------------------
     @abstractmethod
     async def add_xp(self, member: discord.Member, xp: int) -> int:
@@ -0,0 +1,361 @@
+"""
+Benchmarks for LevelUp's hot paths
+
+Builds synthetic configs with fake Discord objects and measures throughput, latency and memory of:
+- Message XP handling (`on_message`)
+- Leaderboards (`get_leaderboard`) and user positions (`get_user_position`)
+- Saving and loading the config (`DB.to_file` / `DB.from_file`)
+- Profile and level up rendering
+- Level lookups (`Algorithm.get_level`) against inverting the curve with a float power
+
+Nothing here talks to Discord, level up side effects (role changes, alerts) are not included.
+
+Usage (from the repo root):
+    python -m levelup.benchmark
+    python -m levelup.benchmark --profiles 10000 100000 1000000 --json results.json
+    python -m levelup.benchmark --only message leaderboard --memory
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import random
+import tempfile
+import tracemalloc
+import typing as t
+from io import BytesIO
+from pathlib import Path
+from time import perf_counter
+from types import SimpleNamespace
+
+import discord
+import orjson
+from PIL import Image
+
+from .common.formatter import get_leaderboard, get_user_position
+from .common.models import DB, GuildSettings, Profile, ProfileWeekly
+from .generator import imgtools
+from .generator.levelalert import generate_level_img
+from .generator.styles.default import generate_default_profile
+from .generator.styles.runescape import generate_runescape_profile
+from .listeners.messages import MessageListener
+
+GUILD_ID = 1
+CHANNEL_ID = 10
+SUITES = ("message", "leaderboard", "storage", "render", "algorithm")
+
+
+class FakeMember(discord.Member):
+    # Members use slots and properties, shadowing them lets plain attributes stand in for the real thing
+    id = name = display_name = bot = status = activity = roles = guild = color = None
+
+    def __init__(self, user_id: int, guild: SimpleNamespace, roles: t.List[SimpleNamespace]):
+        self.__dict__.update(
+            id=user_id,
+            name=f"user{user_id}",
+            display_name=f"User {user_id}",
+            bot=False,
+            status=discord.Status.online,
+            activity=None,
+            roles=roles,
+            guild=guild,
+            color=discord.Color.default(),
+        )
+
+
+class BenchListener(MessageListener):
+    """Message listener without the rest of the cog, level ups are checked but never acted on"""
+
+    def __init__(self, bot: SimpleNamespace, db: DB):
+        self.bot = bot
+        self.db = db
+        self.lastmsg = {}
+        self.pending_xp = {}
+        self.last_save = perf_counter()
+
+    def save(self, full: bool = True) -> None:
+        pass
+
+    async def check_levelups(self, guild, member, profile, conf, message=None, channel=None) -> bool:
+        level = conf.algorithm.get_level(profile.xp)
+        if level == profile.level:
+            return False
+        profile.level = level
+        return True
+
+
+# The mixin declares the rest of the cog as abstract, none of it is reached here
+BenchListener.__abstractmethods__ = frozenset()
+
+
+def build_db(profiles: int, weekly: bool = True, seed: int = 0) -> t.Tuple[DB, SimpleNamespace, SimpleNamespace]:
+    """Build a config with one guild holding `profiles` members
+
+    Returns:
+        t.Tuple[DB, SimpleNamespace, SimpleNamespace]: The config, a fake bot and a fake guild
+    """
+    rng = random.Random(seed)
+    db = DB()
+    conf = GuildSettings(enabled=True, cooldown=0)
+    conf.weeklysettings.on = weekly
+    users = {}
+    users_weekly = {}
+    for user_id in range(1, profiles + 1):
+        xp = rng.randint(0, 500_000)
+        users[user_id] = Profile(
+            xp=xp,
+            level=conf.algorithm.get_level(xp),
+            messages=rng.randint(0, 20_000),
+            voice=rng.randint(0, 500_000),
+            stars=rng.randint(0, 50),
+        )
+        if weekly and rng.random() < 0.2:
+            users_weekly[user_id] = ProfileWeekly(xp=rng.randint(0, 5000), messages=rng.randint(0, 500))
+    conf.users = users
+    conf.users_weekly = users_weekly
+    db.configs[GUILD_ID] = conf
+
+    roles = [SimpleNamespace(id=100 + i) for i in range(5)]
+    guild = SimpleNamespace(id=GUILD_ID, name="Benchmark", icon=None)
+    members = {user_id: FakeMember(user_id, guild, roles) for user_id in users}
+    guild.get_member = members.get
+    guild.get_role = lambda role_id: None
+    guild.get_channel = lambda channel_id: None
+
+    async def cog_disabled_in_guild(cog, guild) -> bool:
+        return False
+
+    async def get_valid_prefixes(guild=None) -> t.List[str]:
+        return ["!", "?"]
+
+    bot = SimpleNamespace(
+        get_user=members.get,
+        cog_disabled_in_guild=cog_disabled_in_guild,
+        get_valid_prefixes=get_valid_prefixes,
+    )
+    return db, bot, guild
+
+
+def summarize(name: str, size: int, timings: t.List[float], **extra) -> t.Dict[str, t.Any]:
+    timings = sorted(timings)
+    total = sum(timings)
+    result = {
+        "name": name,
+        "profiles": size,
+        "calls": len(timings),
+        "ops_per_sec": len(timings) / total if total else 0.0,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+        "max_ms": timings[-1] * 1000,
+    }
+    result.update(extra)
+    return result
+
+
+def timed(func: t.Callable[[], t.Any], calls: int) -> t.List[float]:
+    timings = []
+    for _ in range(calls):
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+    return timings
+
+
+def peak_memory(func: t.Callable[[], t.Any]) -> int:
+    """Peak bytes allocated while running a function"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_message(size: int, calls: int, memory: bool) -> t.List[t.Dict[str, t.Any]]:
+    db, bot, guild = build_db(size)
+    listener = BenchListener(bot, db)
+    channel = SimpleNamespace(id=CHANNEL_ID, category_id=None, name="general")
+    rng = random.Random(1)
+    messages = []
+    for _ in range(calls):
+        author = guild.get_member(rng.randint(1, size))
+        message = SimpleNamespace(author=author, guild=guild, channel=channel, content="hello there " * 3)
+        messages.append(message)
+
+    async def _run(batch: bool) -> t.List[float]:
+        db.batch_xp = batch
+        timings = []
+        for message in messages:
+            start = perf_counter()
+            await listener.on_message(message)
+            timings.append(perf_counter() - start)
+        listener.pending_xp.clear()
+        return timings
+
+    results = [
+        summarize("on_message", size, asyncio.run(_run(False))),
+        summarize("on_message (batch_xp)", size, asyncio.run(_run(True))),
+    ]
+    if memory:
+        results[0]["peak_bytes"] = peak_memory(lambda: asyncio.run(_run(False)))
+    return results
+
+
+def bench_leaderboard(size: int, calls: int, memory: bool) -> t.List[t.Dict[str, t.Any]]:
+    db, bot, guild = build_db(size)
+    conf = db.get_conf(GUILD_ID)
+    member = guild.get_member(size // 2)
+    rng = random.Random(2)
+
+    def _leaderboard(lbtype: str = "lb", stat: str = "xp") -> None:
+        get_leaderboard(bot, guild, db, stat, lbtype, False, member=member)
+
+    def _position() -> None:
+        get_user_position(guild, conf, "lb", rng.randint(1, size), "xp")
+
+    def _touch() -> None:
+        # Someone earns XP between queries, like they would in a live server
+        conf.get_profile(rng.randint(1, size)).xp += 10
+        get_user_position(guild, conf, "lb", member.id, "xp")
+
+    cold = timed(_leaderboard, 1)
+    results = [
+        summarize("get_leaderboard (cold)", size, cold),
+        summarize("get_leaderboard", size, timed(_leaderboard, max(1, calls // 100))),
+        summarize("get_leaderboard (weekly)", size, timed(lambda: _leaderboard("weekly"), max(1, calls // 100))),
+        summarize("get_user_position", size, timed(_position, calls)),
+        summarize("get_user_position (after xp)", size, timed(_touch, calls)),
+    ]
+    if memory:
+        conf.invalidate_caches()
+        results[0]["peak_bytes"] = peak_memory(_leaderboard)
+    return results
+
+
+def bench_storage(size: int, calls: int, memory: bool) -> t.List[t.Dict[str, t.Any]]:
+    db, _, _ = build_db(size)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "LevelUp.json"
+        runs = max(1, min(calls // 200, 5))
+        results.append(
+            summarize("DB.to_file", size, timed(lambda: db.to_file(path), runs), file_bytes=path.stat().st_size)
+        )
+        results.append(summarize("DB.from_file", size, timed(lambda: DB.from_file(path), runs)))
+        if memory:
+            results[0]["peak_bytes"] = peak_memory(lambda: db.to_file(path))
+            results[1]["peak_bytes"] = peak_memory(lambda: DB.from_file(path))
+    return results
+
+
+def bench_algorithm(size: int, calls: int) -> t.List[t.Dict[str, t.Any]]:
+    rng = random.Random(3)
+    results = []
+    for base, exp in ((100, 2.0), (250, 1.7), (100, 3.0)):
+        conf = GuildSettings()
+        conf.algorithm.base, conf.algorithm.exp = base, exp
+        algo = conf.algorithm
+        xps = [rng.randint(0, 500_000) for _ in range(size)]
+        # Every level boundary up to the highest level, where the float inverse can land a level short
+        top = algo.get_level(max(xps))
+        boundaries = [algo.get_xp(level) for level in range(1, top + 1)]
+
+        def float_power(xp: int) -> int:
+            return int((xp / base) ** (1 / exp))
+
+        mismatches = sum(float_power(xp) != level for level, xp in enumerate(boundaries, start=1))
+        label = f"{base}x^{exp}"
+        runs = max(1, calls // 200)
+        results.extend(
+            [
+                summarize(
+                    f"float power {label}",
+                    size,
+                    timed(lambda: [float_power(xp) for xp in xps], runs),
+                    boundary_errors=mismatches,
+                ),
+                summarize(
+                    f"get_level {label}",
+                    size,
+                    timed(lambda: [algo.get_level(xp) for xp in xps], runs),
+                    boundary_errors=sum(algo.get_level(xp) != lvl for lvl, xp in enumerate(boundaries, start=1)),
+                ),
+                summarize(f"get_levels {label}", size, timed(lambda: algo.get_levels(xps), runs)),
+            ]
+        )
+    return results
+
+
+def bench_render(calls: int) -> t.List[t.Dict[str, t.Any]]:
+    avatar = (imgtools.STOCK / "defaultpfp.webp").read_bytes()
+    background = next(imgtools.DEFAULT_BACKGROUNDS.iterdir()).read_bytes()
+
+    # Animated avatar, the stock avatar spinning
+    base = Image.open(BytesIO(avatar)).convert("RGBA")
+    frames = [base.rotate(i * 12) for i in range(30)]
+    buffer = BytesIO()
+    frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:], duration=50, loop=0)
+    animated_avatar = buffer.getvalue()
+
+    runs = max(1, calls // 200)
+    cases = {
+        "render default": lambda: generate_default_profile(background_bytes=background, avatar_bytes=avatar),
+        "render default (gif)": lambda: generate_default_profile(
+            background_bytes=background, avatar_bytes=animated_avatar, render_gif=True
+        ),
+        "render runescape": lambda: generate_runescape_profile(avatar_bytes=avatar),
+        "render levelup": lambda: generate_level_img(background_bytes=background, avatar_bytes=avatar),
+    }
+    return [summarize(name, 0, timed(func, runs)) for name, func in cases.items()]
+
+
+def print_results(results: t.List[t.Dict[str, t.Any]]) -> None:
+    header = f"{'benchmark':<30} {'profiles':>9} {'calls':>6} {'ops/s':>11} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for res in results:
+        line = (
+            f"{res['name']:<30} {res['profiles']:>9} {res['calls']:>6} {res['ops_per_sec']:>11.1f} "
+            f"{res['p50_ms']:>9.3f} {res['p99_ms']:>9.3f} {res['max_ms']:>9.3f}"
+        )
+        if "file_bytes" in res:
+            line += f"  file {res['file_bytes'] / 1024 / 1024:.1f}MB"
+        if "boundary_errors" in res:
+            line += f"  boundary errors {res['boundary_errors']}"
+        if "peak_bytes" in res:
+            line += f"  peak {res['peak_bytes'] / 1024 / 1024:.1f}MB"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark LevelUp's hot paths")
+    parser.add_argument("--profiles", type=int, nargs="+", default=[10_000, 100_000], help="Profile counts to test")
+    parser.add_argument("--calls", type=int, default=2000, help="Calls per benchmark, slow paths run fewer")
+    parser.add_argument("--only", nargs="+", choices=SUITES, default=list(SUITES), help="Suites to run")
+    parser.add_argument("--memory", action="store_true", help="Also measure peak memory (slower)")
+    parser.add_argument("--json", type=Path, help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = []
+    for size in args.profiles:
+        if "message" in args.only:
+            results.extend(bench_message(size, args.calls, args.memory))
+        if "leaderboard" in args.only:
+            results.extend(bench_leaderboard(size, args.calls, args.memory))
+        if "storage" in args.only:
+            results.extend(bench_storage(size, args.calls, args.memory))
+        if "algorithm" in args.only:
+            results.extend(bench_algorithm(size, args.calls))
+    if "render" in args.only:
+        results.extend(bench_render(args.calls))
+
+    print_results(results)
+    if args.json:
+        args.json.write_bytes(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == "__main__":
+    main()
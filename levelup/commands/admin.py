@@ -1,5 +1,6 @@
 import asyncio
 import typing as t
+from contextlib import suppress
 from io import BytesIO
 from time import perf_counter
 
@@ -14,7 +15,7 @@ from redbot.core.utils.chat_formatting import (
 )
 
 from ..abc import MixinMeta
-from ..common import const, utils
+from ..common import const, importer, rolesync, utils
 from ..common.models import Emojis, Prestige
 
 _ = Translator("LevelUp", __file__)
@@ -109,7 +110,8 @@ class Admin(MixinMeta):
 
         if conf.levelroles:
             joined = "\n".join(
-                _("• Level {}: {}").format(level, f"<@&{role_id}>") for level, role_id in conf.levelroles.items()
+                _("• Level {}: {}").format(level, f"<@&{role_id}>")
+                for level, role_id in sorted(conf.levelroles.items())
             )
             add_field(embed, _("Level Roles"), joined)
         if conf.prestigelevel and conf.prestigedata:
@@ -230,10 +232,10 @@ class Admin(MixinMeta):
             )
         if style == "none":
             conf.style_override = None
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("Style override has been **disabled**!"))
         conf.style_override = style
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Style override has been set to **{}**").format(style))
 
     @levelset.command(name="toggle")
@@ -242,7 +244,7 @@ class Admin(MixinMeta):
         conf = self.db.get_conf(ctx.guild)
         status = _("**Disabled**") if conf.enabled else _("**Enabled**")
         conf.enabled = not conf.enabled
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("LevelUp has been {}").format(status))
 
     @levelset.command(name="rolegroup")
@@ -265,7 +267,7 @@ class Admin(MixinMeta):
             txt = _("The role {} will now gain expecience points from all members that have it.").format(
                 f"<@&{role_id}>"
             )
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(txt)
 
     @levelset.command(name="addxp")
@@ -284,7 +286,7 @@ class Admin(MixinMeta):
                 return await ctx.send(_("That XP value is too high!"))
             profile.xp += xp
             txt = _("Added {} XP to {}").format(xp, user_or_role.name)
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(txt)
 
         for user in user_or_role.members:
@@ -299,7 +301,7 @@ class Admin(MixinMeta):
             user_or_role.mention,
         )
         await ctx.send(txt)
-        self.save()
+        self.save(guild=ctx.guild)
 
     @levelset.command(name="removexp")
     async def remove_xp_from_user(
@@ -314,7 +316,7 @@ class Admin(MixinMeta):
             profile = conf.get_profile(user_or_role)
             profile.xp -= min(profile.xp, xp)
             txt = _("Removed {} XP from {}").format(min(profile.xp, xp), user_or_role.name)
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(txt)
         for user in user_or_role.members:
             profile = conf.get_profile(user)
@@ -325,7 +327,7 @@ class Admin(MixinMeta):
             user_or_role.mention,
         )
         await ctx.send(txt)
-        self.save()
+        self.save(guild=ctx.guild)
 
     @levelset.command(name="algorithm", aliases=["algo"])
     async def set_level_algorithm(
@@ -361,7 +363,7 @@ class Admin(MixinMeta):
                 return await ctx.send(_("Base must be greater than 0"))
         conf = self.db.get_conf(ctx.guild)
         setattr(conf.algorithm, part, value)
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Algorithm {} has been set to {}").format(part, value))
 
     @levelset.command(name="commandxp")
@@ -370,7 +372,7 @@ class Admin(MixinMeta):
         conf = self.db.get_conf(ctx.guild)
         status = _("**Disabled**") if conf.command_xp else _("**Enabled**")
         conf.command_xp = not conf.command_xp
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Command XP has been {}").format(status))
 
     @levelset.command(name="dm")
@@ -383,7 +385,7 @@ class Admin(MixinMeta):
         conf = self.db.get_conf(ctx.guild)
         status = _("**Disabled**") if conf.notifydm else _("**Enabled**")
         conf.notifydm = not conf.notifydm
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("DM notifications have been {}").format(status))
 
     @levelset.command(name="resetemojis")
@@ -391,7 +393,7 @@ class Admin(MixinMeta):
         """Reset the emojis to default"""
         conf = self.db.get_conf(ctx.guild)
         conf.emojis = Emojis()
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Emojis have been reset to default"))
 
     @levelset.command(name="emojis")
@@ -439,7 +441,7 @@ class Admin(MixinMeta):
         conf.emojis.mic = get_emoji_value(voicetime)
         conf.emojis.bulb = get_emoji_value(experience)
         conf.emojis.money = get_emoji_value(balance)
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Emojis have been set"))
 
     @levelset.command(name="embeds")
@@ -449,11 +451,11 @@ class Admin(MixinMeta):
         if self.db.force_embeds:
             txt = _("Profile rendering is locked to Embeds only by the bot owner!")
             conf.use_embeds = False
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(txt)
         status = _("**Images**") if conf.use_embeds else _("**Embeds**")
         conf.use_embeds = not conf.use_embeds
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Profile rendering has been set to {}").format(status))
 
     @levelset.command(name="levelchannel")
@@ -474,10 +476,10 @@ class Admin(MixinMeta):
             return await ctx.send_help()
         if not channel and conf.notifylog:
             conf.notifylog = 0
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("LevelUp messages will no longer be sent to a specific channel"))
         conf.notifylog = channel.id
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("LevelUp messages will now be sent to {}").format(channel.mention))
 
     @levelset.command(name="levelnotify")
@@ -490,7 +492,7 @@ class Admin(MixinMeta):
         conf = self.db.get_conf(ctx.guild)
         status = _("**Disabled**") if conf.notify else _("**Enabled**")
         conf.notify = not conf.notify
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("LevelUp notifications have been {}").format(status))
 
     @levelset.command(name="mention")
@@ -503,7 +505,7 @@ class Admin(MixinMeta):
         conf = self.db.get_conf(ctx.guild)
         status = _("**Disabled**") if conf.notifymention else _("**Enabled**")
         conf.notifymention = not conf.notifymention
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Mentioning user in LevelUp messages has been {}").format(status))
 
     @levelset.command(name="seelevels")
@@ -563,7 +565,7 @@ class Admin(MixinMeta):
             # Make sure xp is a valid number that python can actually handle
             if profile.xp > 1e308:
                 return await ctx.send(_("That level is too high!"))
-            self.save()
+            self.save(guild=ctx.guild)
             reason = _("{} set {}'s level to {}").format(ctx.author.name, user.name, level)
             added, removed = await self.ensure_roles(user, conf, reason)
             if added or removed:
@@ -588,7 +590,7 @@ class Admin(MixinMeta):
             return await ctx.send(_("That prestige level does not exist!"))
         profile = conf.get_profile(user)
         profile.prestige = prestige
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("{} has been set to prestige level {}").format(user.name, prestige))
 
     @levelset.command(name="showbalance", aliases=["showbal"])
@@ -597,7 +599,7 @@ class Admin(MixinMeta):
         conf = self.db.get_conf(ctx.guild)
         status = _("**Disabled**") if conf.showbal else _("**Enabled**")
         conf.showbal = not conf.showbal
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Including economy balance in profiles has been {}").format(status))
 
     @levelset.command(name="starcooldown")
@@ -609,7 +611,7 @@ class Admin(MixinMeta):
         """
         conf = self.db.get_conf(ctx.guild)
         conf.starcooldown = seconds
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Star cooldown has been set to {} seconds").format(seconds))
 
     @levelset.command(name="starmention")
@@ -621,7 +623,7 @@ class Admin(MixinMeta):
         conf = self.db.get_conf(ctx.guild)
         status = _("**Disabled**") if conf.starmention else _("**Enabled**")
         conf.starmention = not conf.starmention
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Mentioning user when they receive a star has been {}").format(status))
 
     @levelset.command(name="starmentiondelete")
@@ -636,7 +638,7 @@ class Admin(MixinMeta):
             await ctx.send(_("Star mentions will be deleted after {} seconds").format(deleted_after))
         else:
             await ctx.send(_("Star mentions will not be auto-deleted"))
-        self.save()
+        self.save(guild=ctx.guild)
 
     @levelset.group(name="allowed")
     async def allowed(self, ctx: commands.Context):
@@ -663,7 +665,7 @@ class Admin(MixinMeta):
         else:
             conf.allowedchannels.append(channel.id)
             txt = _("Channel {} has been added to the allowed list").format(channel.mention)
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(txt)
 
     @allowed.command(name="role")
@@ -686,7 +688,7 @@ class Admin(MixinMeta):
         else:
             conf.allowedroles.append(role.id)
             txt = _("Role {} has been added to the allowed list").format(role.mention)
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(txt)
 
     @levelset.group(name="ignore")
@@ -714,7 +716,7 @@ class Admin(MixinMeta):
         else:
             conf.ignoredchannels.append(channel.id)
             txt = _("Channel {} has been added to the ignore list").format(channel.mention)
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(txt)
 
     @ignore.command(name="role")
@@ -737,7 +739,7 @@ class Admin(MixinMeta):
         else:
             conf.ignoredroles.append(role.id)
             txt = _("Role {} has been added to the ignore list").format(role.mention)
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(txt)
 
     @ignore.command(name="user")
@@ -760,7 +762,7 @@ class Admin(MixinMeta):
         else:
             conf.ignoredusers.append(user.id)
             txt = _("User {} has been added to the ignore list").format(user.name)
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(txt)
 
     @levelset.group(name="levelupmessages", aliases=["lvlalerts", "levelalerts", "lvlmessages", "lvlmsg"])
@@ -814,7 +816,7 @@ class Admin(MixinMeta):
             return await ctx.send_help()
         if not message and conf.levelup_dm:
             conf.levelup_dm = None
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("LevelUp DM message has been removed"))
         kwargs = {
             "username": ctx.author.name,
@@ -828,7 +830,7 @@ class Admin(MixinMeta):
         except KeyError as e:
             return await ctx.send(_("Invalid placeholder used: {}").format(e))
         conf.levelup_dm = message
-        self.save()
+        self.save(guild=ctx.guild)
         embed = discord.Embed(description=msg, color=await self.bot.get_embed_color(ctx))
         await ctx.send(_("LevelUp DM message has been set"), embed=embed)
 
@@ -851,7 +853,7 @@ class Admin(MixinMeta):
             return await ctx.send_help()
         if not message and conf.role_awarded_dm:
             conf.role_awarded_dm = None
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("LevelUp DM role message has been removed"))
         kwargs = {
             "username": ctx.author.name,
@@ -866,7 +868,7 @@ class Admin(MixinMeta):
         except KeyError as e:
             return await ctx.send(_("Invalid placeholder used: {}").format(e))
         conf.role_awarded_dm = message
-        self.save()
+        self.save(guild=ctx.guild)
         embed = discord.Embed(description=msg, color=await self.bot.get_embed_color(ctx))
         await ctx.send(_("LevelUp DM role message has been set"), embed=embed)
 
@@ -888,7 +890,7 @@ class Admin(MixinMeta):
             return await ctx.send_help()
         if not message and conf.levelup_msg:
             conf.levelup_msg = ""
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("LevelUp message has been removed"))
         kwargs = {
             "username": ctx.author.name,
@@ -902,7 +904,7 @@ class Admin(MixinMeta):
         except KeyError as e:
             return await ctx.send(_("Invalid placeholder used: {}").format(e))
         conf.levelup_msg = message
-        self.save()
+        self.save(guild=ctx.guild)
         embed = discord.Embed(description=msg, color=await self.bot.get_embed_color(ctx))
         await ctx.send(_("LevelUp message has been set"), embed=embed)
 
@@ -925,7 +927,7 @@ class Admin(MixinMeta):
             return await ctx.send_help()
         if not message and conf.role_awarded_msg:
             conf.role_awarded_msg = ""
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("LevelUp role message has been removed"))
         kwargs = {
             "username": ctx.author.name,
@@ -940,7 +942,7 @@ class Admin(MixinMeta):
         except KeyError as e:
             return await ctx.send(_("Invalid placeholder used: {}").format(e))
         conf.role_awarded_msg = message
-        self.save()
+        self.save(guild=ctx.guild)
         embed = discord.Embed(description=msg, color=await self.bot.get_embed_color(ctx))
         await ctx.send(_("LevelUp role message has been set"), embed=embed)
 
@@ -969,16 +971,16 @@ class Admin(MixinMeta):
         if channel.id in conf.channelbonus.msg:
             if min_xp == 0 and max_xp == 0:
                 del conf.channelbonus.msg[channel.id]
-                self.save()
+                self.save(guild=ctx.guild)
                 return await ctx.send(_("Channel bonus has been removed"))
             conf.channelbonus.msg[channel.id] = [min_xp, max_xp]
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("Channel bonus has been updated"))
 
         if min_xp == 0 and max_xp == 0:
             return await ctx.send(_("XP range cannot be 0"))
         conf.channelbonus.msg[channel.id] = [min_xp, max_xp]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Channel bonus has been set"))
 
     @message_group.command(name="cooldown")
@@ -991,7 +993,7 @@ class Admin(MixinMeta):
         """
         conf = self.db.get_conf(ctx.guild)
         conf.cooldown = cooldown
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Cooldown has been set to {} seconds").format(cooldown))
 
     @message_group.command(name="length")
@@ -1004,7 +1006,7 @@ class Admin(MixinMeta):
         """
         conf = self.db.get_conf(ctx.guild)
         conf.min_length = length
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Minimum message length has been set to {}").format(length))
 
     @message_group.command(name="rolebonus")
@@ -1028,16 +1030,16 @@ class Admin(MixinMeta):
         if role.id in conf.rolebonus.msg:
             if min_xp == 0 and max_xp == 0:
                 del conf.rolebonus.msg[role.id]
-                self.save()
+                self.save(guild=ctx.guild)
                 return await ctx.send(_("Role bonus has been removed"))
             conf.rolebonus.msg[role.id] = [min_xp, max_xp]
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("Role bonus has been updated"))
 
         if min_xp == 0 and max_xp == 0:
             return await ctx.send(_("XP range cannot be 0"))
         conf.rolebonus.msg[role.id] = [min_xp, max_xp]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Role bonus has been set"))
 
     @message_group.command(name="xp")
@@ -1054,7 +1056,7 @@ class Admin(MixinMeta):
         if min_xp == 0 and max_xp == 0:
             return await ctx.send(_("XP range cannot be 0"))
         conf.xp = [min_xp, max_xp]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Message XP range has been set to {} - {}").format(min_xp, max_xp))
 
     @levelset.group(name="roles")
@@ -1067,7 +1069,7 @@ class Admin(MixinMeta):
         conf = self.db.get_conf(ctx.guild)
         status = _("**Disabled**") if conf.autoremove else _("**Enabled**")
         conf.autoremove = not conf.autoremove
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Automatic removal of previous level roles has been {}").format(status))
 
     @level_roles.command(name="add")
@@ -1083,7 +1085,7 @@ class Admin(MixinMeta):
         else:
             txt = _("The role associated with level {} has been added").format(level)
         conf.levelroles[level] = role.id
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(txt)
 
     @level_roles.command(name="remove", aliases=["rem", "del"])
@@ -1093,59 +1095,103 @@ class Admin(MixinMeta):
         if level not in conf.levelroles:
             return await ctx.send(_("There is no role associated with level {}").format(level))
         del conf.levelroles[level]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("The role associated with level {} has been removed").format(level))
 
     @level_roles.command(name="initialize", aliases=["init"])
-    @commands.bot_has_permissions(manage_roles=True, embed_links=True)
+    @commands.bot_has_permissions(manage_roles=True, embed_links=True, attach_files=True)
     @commands.cooldown(1, 240, commands.BucketType.guild)
-    async def init_roles(self, ctx: commands.Context):
+    async def init_roles(self, ctx: commands.Context, dry_run: bool = False):
         """
         Initialize level roles
 
         This command is for if you added level roles after users have achieved that level,
         it will apply all necessary roles to a user according to their level and prestige
+
+        Each member that needs changes gets a single role edit, paced to stay within Discord's rate limits.
+        If the sync gets interrupted it can be resumed by running the command again.
+
+        **Arguments**
+        `dry_run` - Only report which roles would be added and removed, without changing anything
         """
         start = perf_counter()
-        roles_added = 0
-        roles_removed = 0
-        embed = discord.Embed(
-            description=_("Synchronizing level roles, this may take a while..."),
-            color=discord.Color.magenta(),
+        conf = self.db.get_conf(ctx.guild)
+        if not conf.levelroles and not conf.prestigedata and not conf.weeklysettings.role:
+            return await ctx.send(_("There are no level, prestige or weekly roles to synchronize!"))
+        plan = self.get_role_plan(conf, ctx.guild)
+        checkpoint_file = self.cog_path / "rolesync" / f"{ctx.guild.id}.json"
+        job = rolesync.RoleSync(
+            ctx.guild,
+            conf,
+            plan,
+            reason=_("Level role initialization"),
+            checkpoint_file=checkpoint_file,
+            dry_run=dry_run,
         )
+        if plan.bad:
+            txt = _("These roles no longer exist or are above my top role and will be skipped: {}").format(
+                ", ".join(str(i) for i in plan.bad)
+            )
+            await ctx.send(txt)
+        if not dry_run and (checkpoint := importer.load_checkpoint(checkpoint_file)):
+            if checkpoint["signature"] == plan.signature:
+                txt = _("A previous sync stopped after checking {} members, resume from there?").format(
+                    humanize_number(checkpoint["progress"]["scanned"])
+                )
+                await ctx.send(txt)
+                if await utils.confirm_msg(ctx):
+                    job.resume(checkpoint)
+
+        def _status() -> str:
+            if dry_run:
+                txt = _("Checking level roles, this may take a while...")
+            else:
+                txt = _("Synchronizing level roles, this may take a while...")
+            txt += "\n" + _("{} of {} members checked, {} need changes").format(
+                humanize_number(job.scanned),
+                humanize_number(ctx.guild.member_count or len(ctx.guild.members)),
+                humanize_number(job.changed),
+            )
+            return txt
+
+        async def _progress(_job: rolesync.RoleSync):
+            embed.description = _status()
+            with suppress(discord.HTTPException):
+                await msg.edit(embed=embed)
+
+        embed = discord.Embed(description=_status(), color=discord.Color.magenta())
         embed.set_thumbnail(url=const.LOADING)
         msg = await ctx.send(embed=embed)
-        last_update = perf_counter()
-        conf = self.db.get_conf(ctx.guild)
-        reason = _("Level role initialization")
-        member_count = len(ctx.guild.members)
         async with ctx.typing():
-            for idx, user in enumerate(ctx.guild.members):
-                added, removed = await self.ensure_roles(user, conf, reason)
-                roles_added += len(added)
-                roles_removed += len(removed)
-
-                # Update message every 5% of the way if there are more than 40 users
-                if member_count > 40 and idx % (member_count // 20) == 0 and perf_counter() - last_update > 5:
-                    desc = _("Synchronizing level roles, this may take a while...\n{:.0%} complete").format(
-                        idx / member_count
-                    )
-                    embed.description = desc
-                    asyncio.create_task(msg.edit(embed=embed))
-                    last_update = perf_counter()
+            await job.run(_progress)
+        if not dry_run:
+            checkpoint_file.unlink(missing_ok=True)
 
+        roles_added = sum(job.added.values())
+        roles_removed = sum(job.removed.values())
         if not roles_added and not roles_removed:
             return await msg.edit(
                 content=_("No roles were added or removed"),
                 embed=None,
             )
-        desc = _("Role initialization complete\nRoles added: {}\nRoles removed: {}").format(roles_added, roles_removed)
+        if dry_run:
+            desc = _(
+                "Dry run complete, nothing was changed\nMembers to update: {}\nRoles to add: {}\nRoles to remove: {}"
+            )
+        else:
+            desc = _("Role initialization complete\nMembers updated: {}\nRoles added: {}\nRoles removed: {}")
+        desc = desc.format(humanize_number(job.changed - job.failed), roles_added, roles_removed)
+        if job.failed:
+            desc += "\n" + _("Failed to update {} members").format(humanize_number(job.failed))
         embed = discord.Embed(description=desc, color=discord.Color.green())
         td = round(perf_counter() - start)
         delta = humanize_timedelta(seconds=td)
         foot = _("Initialization took {} to complete.").format(delta)
         embed.set_footer(text=foot)
         await msg.edit(embed=embed)
+        if dry_run:
+            file = discord.File(BytesIO(job.report().encode()), filename="role-sync-dry-run.txt")
+            await ctx.send(file=file)
 
     @levelset.group(name="voice")
     async def voice_group(self, ctx: commands.Context):
@@ -1173,15 +1219,15 @@ class Admin(MixinMeta):
         if channel.id in conf.channelbonus.voice:
             if min_xp == 0 and max_xp == 0:
                 del conf.channelbonus.voice[channel.id]
-                self.save()
+                self.save(guild=ctx.guild)
                 return await ctx.send(_("Channel bonus has been removed"))
             conf.channelbonus.voice[channel.id] = [min_xp, max_xp]
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("Channel bonus has been updated"))
         if min_xp == 0 and max_xp == 0:
             return await ctx.send(_("XP range cannot be 0"))
         conf.channelbonus.voice[channel.id] = [min_xp, max_xp]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Channel bonus has been set"))
 
     @voice_group.command(name="streambonus")
@@ -1200,10 +1246,10 @@ class Admin(MixinMeta):
             return await ctx.send(_("Min XP value cannot be greater than Max XP value"))
         if min_xp == 0 and max_xp == 0:
             conf.streambonus = None
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("Stream bonus has been removed"))
         conf.streambonus = [min_xp, max_xp]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Stream bonus has been set"))
 
     @voice_group.command(name="rolebonus")
@@ -1227,16 +1273,16 @@ class Admin(MixinMeta):
         if role.id in conf.rolebonus.voice:
             if min_xp == 0 and max_xp == 0:
                 del conf.rolebonus.voice[role.id]
-                self.save()
+                self.save(guild=ctx.guild)
                 return await ctx.send(_("Role bonus has been removed"))
             conf.rolebonus.voice[role.id] = [min_xp, max_xp]
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("Role bonus has been updated"))
 
         if min_xp == 0 and max_xp == 0:
             return await ctx.send(_("XP range cannot be 0"))
         conf.rolebonus.voice[role.id] = [min_xp, max_xp]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Role bonus has been set"))
 
     @voice_group.command(name="deafened")
@@ -1252,7 +1298,7 @@ class Admin(MixinMeta):
         else:
             txt = _("Deafened users will no longer gain XP while in a voice channel")
             conf.ignore_deafened = True
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(txt)
 
     @voice_group.command(name="invisible")
@@ -1268,7 +1314,7 @@ class Admin(MixinMeta):
         else:
             txt = _("Invisible users will no longer gain XP while in a voice channel")
             conf.ignore_invisible = True
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(txt)
 
     @voice_group.command(name="muted")
@@ -1284,7 +1330,7 @@ class Admin(MixinMeta):
         else:
             txt = _("Muted users will no longer gain XP while in a voice channel")
             conf.ignore_muted = True
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(txt)
 
     @voice_group.command(name="solo")
@@ -1300,7 +1346,7 @@ class Admin(MixinMeta):
         else:
             txt = _("Solo users will no longer gain XP while in a voice channel")
             conf.ignore_solo = True
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(txt)
 
     @voice_group.command(name="xp")
@@ -1311,7 +1357,7 @@ class Admin(MixinMeta):
         """
         conf = self.db.get_conf(ctx.guild)
         conf.voicexp = voice_xp
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Voice XP has been set to {} per minute").format(voice_xp))
 
     @levelset.group(name="prestige")
@@ -1324,7 +1370,7 @@ class Admin(MixinMeta):
         conf = self.db.get_conf(ctx.guild)
         status = _("**Disabled**") if conf.keep_level_roles else _("**Enabled**")
         conf.keep_level_roles = not conf.keep_level_roles
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Keeping roles after prestiging has been {}").format(status))
 
     @prestige_group.command(name="level")
@@ -1334,7 +1380,7 @@ class Admin(MixinMeta):
         """
         conf = self.db.get_conf(ctx.guild)
         conf.prestigelevel = level
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Prestige level has been set to {}").format(level))
 
     @prestige_group.command(name="stack")
@@ -1347,7 +1393,7 @@ class Admin(MixinMeta):
         conf = self.db.get_conf(ctx.guild)
         status = _("**Disabled**") if conf.stackprestigeroles else _("**Enabled**")
         conf.stackprestigeroles = not conf.stackprestigeroles
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Stacking roles on prestige has been {}").format(status))
 
     @prestige_group.command(name="add")
@@ -1376,7 +1422,7 @@ class Admin(MixinMeta):
             emoji_url=url,
         )
         conf.prestigedata[prestige] = prestige_obj
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Role and emoji have been set for prestige level {}").format(prestige))
 
     @prestige_group.command(name="remove", aliases=["rem", "del"])
@@ -1388,7 +1434,7 @@ class Admin(MixinMeta):
         if prestige not in conf.prestigedata:
             return await ctx.send(_("That prestige level does not exist!"))
         del conf.prestigedata[prestige]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Prestige level {} has been removed").format(prestige))
 
     @voice_group.command(name="appbonus")
@@ -1420,17 +1466,17 @@ class Admin(MixinMeta):
         if application_name in conf.appbonus.voice:
             if min_xp == 0 and max_xp == 0:
                 del conf.appbonus.voice[application_name]
-                self.save()
+                self.save(guild=ctx.guild)
                 return await ctx.send(_("Application bonus for {} has been removed").format(application_name))
             conf.appbonus.voice[application_name] = [min_xp, max_xp]
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("Application bonus for {} has been updated").format(application_name))
 
         if min_xp == 0 and max_xp == 0:
             return await ctx.send(_("XP range cannot be 0"))
 
         conf.appbonus.voice[application_name] = [min_xp, max_xp]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Application bonus for {} has been set").format(application_name))
 
     @message_group.command(name="appbonus")
@@ -1462,17 +1508,17 @@ class Admin(MixinMeta):
         if application_name in conf.appbonus.msg:
             if min_xp == 0 and max_xp == 0:
                 del conf.appbonus.msg[application_name]
-                self.save()
+                self.save(guild=ctx.guild)
                 return await ctx.send(_("Application bonus for {} has been removed").format(application_name))
             conf.appbonus.msg[application_name] = [min_xp, max_xp]
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("Application bonus for {} has been updated").format(application_name))
 
         if min_xp == 0 and max_xp == 0:
             return await ctx.send(_("XP range cannot be 0"))
 
         conf.appbonus.msg[application_name] = [min_xp, max_xp]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Application bonus for {} has been set").format(application_name))
 
     @levelset.command(name="defaultbackground")
@@ -1495,7 +1541,7 @@ class Admin(MixinMeta):
             return await ctx.send(_("Current default background: `{}`").format(conf.default_background))
 
         conf.default_background = background
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Default background for all users has been set to: `{}`").format(background))
 
         if background.lower() not in ["default", "random"] and not background.lower().startswith("http"):
@@ -1545,17 +1591,17 @@ class Admin(MixinMeta):
         if status in conf.presencebonus.msg:
             if min_xp == 0 and max_xp == 0:
                 del conf.presencebonus.msg[status]
-                self.save()
+                self.save(guild=ctx.guild)
                 return await ctx.send(_("Presence bonus for {} status has been removed for messages").format(status))
             conf.presencebonus.msg[status] = [min_xp, max_xp]
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("Presence bonus for {} status has been updated for messages").format(status))
 
         if min_xp == 0 and max_xp == 0:
             return await ctx.send(_("XP range cannot be 0"))
 
         conf.presencebonus.msg[status] = [min_xp, max_xp]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Presence bonus for {} status has been set for messages").format(status))
 
     @presence_bonus_group.command(name="voice")
@@ -1585,17 +1631,17 @@ class Admin(MixinMeta):
         if status in conf.presencebonus.voice:
             if min_xp == 0 and max_xp == 0:
                 del conf.presencebonus.voice[status]
-                self.save()
+                self.save(guild=ctx.guild)
                 return await ctx.send(_("Presence bonus for {} status has been removed for voice").format(status))
             conf.presencebonus.voice[status] = [min_xp, max_xp]
-            self.save()
+            self.save(guild=ctx.guild)
             return await ctx.send(_("Presence bonus for {} status has been updated for voice").format(status))
 
         if min_xp == 0 and max_xp == 0:
             return await ctx.send(_("XP range cannot be 0"))
 
         conf.presencebonus.voice[status] = [min_xp, max_xp]
-        self.save()
+        self.save(guild=ctx.guild)
         await ctx.send(_("Presence bonus for {} status has been set for voice").format(status))
 
     @presence_bonus_group.command(name="view")
@@ -1,19 +1,19 @@
-import json
+import asyncio
 import logging
-import math
 import typing as t
 from contextlib import suppress
 from datetime import datetime
+from time import perf_counter
 
 import discord
 import orjson
 from pydantic import ValidationError
 from redbot.core import commands
 from redbot.core.i18n import Translator, cog_i18n
-from redbot.core.utils.chat_formatting import box, pagify, text_to_file
+from redbot.core.utils.chat_formatting import box, humanize_number, pagify, text_to_file
 
 from ..abc import MixinMeta
-from ..common import utils
+from ..common import importer, utils
 from ..common.models import DB, GuildSettings
 from ..views.dynamic_menu import DynamicMenu
 
@@ -116,7 +116,7 @@ class DataAdmin(MixinMeta):
             txt += _("Pruned {} voice channel bonuses from the database\n").format(pruned)
         if not txt:
             await ctx.send(_("No data to prune!"))
-        self.save()
+        self.save(guild=ctx.guild)
 
     @lvldata.command(name="resetglobal")
     @commands.is_owner()
@@ -129,6 +129,7 @@ class DataAdmin(MixinMeta):
         for guild_id in list(self.db.configs.keys()):
             self.db.configs[guild_id].users = {}
             self.db.configs[guild_id].users_weekly = {}
+            self.db.configs[guild_id].invalidate_caches()
         self.save()
         await msg.edit(content=_("Global data reset!"))
 
@@ -142,7 +143,7 @@ class DataAdmin(MixinMeta):
         conf = self.db.get_conf(ctx.guild)
         conf.users = {}
         conf.users_weekly = {}
-        self.save()
+        self.save(guild=ctx.guild)
         await msg.edit(content=_("Server data reset!"))
 
     @lvldata.command(name="resetcog")
@@ -247,103 +248,7 @@ class DataAdmin(MixinMeta):
         yes = await utils.confirm_msg(ctx)
         if not yes:
             return await msg.edit(content=_("Import cancelled!"))
-        await msg.edit(content=_("Fetching AmariBot leaderboard data, this could take a while..."))
-        # player_schema = {
-        #     "id": int,
-        #     "level": int,
-        #     "exp": int,
-        #     "weeklyExp": int,
-        #     "username": str,
-        # }
-        players: t.List[t.Dict[str, t.Union[int, str]]] = []
-        pages = math.ceil(len(ctx.guild.members) / 1000)
-        failed_pages = 0
-        async with ctx.typing():
-            for i in range(pages):
-                try:
-                    data, status = await utils.fetch_amari_payload(ctx.guild.id, i, api_key)
-                except Exception as e:
-                    log.warning(
-                        f"Failed to import page {i} of AmariBot leaderboard data in {ctx.guild}",
-                        exc_info=e,
-                    )
-                    await ctx.send(f"Failed to import page {i} of AmariBot leaderboard data: {e}")
-                    failed_pages += 1
-                    if isinstance(e, json.JSONDecodeError):
-                        await msg.edit(content=_("AmariBot is rate limiting too heavily! Import Failed!"))
-                        return
-                    continue
-                error_msg = data.get("error", None)
-                if status == 501:
-                    # No more users
-                    break
-                if status != 200:
-                    if error_msg:
-                        return await ctx.send(error_msg)
-                    else:
-                        return await ctx.send(_("No data found!"))
-                player_data = data.get("data")
-                if not player_data:
-                    break
-                players.extend(player_data)
-        if failed_pages:
-            await ctx.send(
-                _("{} pages failed to fetch from AmariBot api, check logs for more info").format(str(failed_pages))
-            )
-        if not players:
-            return await ctx.send(_("No leaderboard data found!"))
-        await msg.edit(content=_("Data retrieved, importing..."))
-        conf = self.db.get_conf(ctx.guild)
-        imported = 0
-        failed = 0
-        async with ctx.typing():
-            for player in players:
-                uid = player["id"]
-                xp = player["exp"]
-                level = player["level"]
-                weekly_xp = player["weeklyExp"]
-                member = ctx.guild.get_member(int(uid))
-                if not member and not all_users:
-                    failed += 1
-                    continue
-                profile = conf.get_profile(int(uid))
-
-                weekly = conf.get_weekly_profile(int(uid)) if conf.weeklysettings.on else None
-
-                if replace:
-                    if import_by == "level":
-                        profile.level = level
-                        profile.xp = conf.algorithm.get_xp(level)
-                    else:
-                        profile.xp = xp
-                        profile.level = conf.algorithm.get_level(xp)
-
-                    if weekly:
-                        weekly.xp = weekly_xp
-                else:
-                    if import_by == "level":
-                        if level:
-                            profile.level += level
-                            profile.xp = conf.algorithm.get_xp(profile.level)
-                    else:
-                        if xp:
-                            profile.xp += xp
-                            profile.level = conf.algorithm.get_level(profile.xp)
-
-                    if weekly:
-                        weekly.xp += weekly_xp
-
-                imported += 1
-
-        if not imported and not failed:
-            await msg.edit(content=_("No AmariBot stats were found"))
-        else:
-            txt = _("Imported {} User(s)").format(str(imported))
-            if failed:
-                txt += _(" ({} skipped since they are no longer in the discord)").format(str(failed))
-            await msg.edit(content=txt)
-            await ctx.tick()
-            self.save()
+        await self.import_leaderboard(ctx, msg, importer.AMARI, import_by, replace, all_users, api_key=api_key)
 
     @lvldata.command(name="importfixator")
     @commands.is_owner()
@@ -415,6 +320,7 @@ class DataAdmin(MixinMeta):
                 conf.mention = mention
                 conf.xp_range = xp_range
                 conf.ignoredchannels = guild_config.get(guild_id, {}).get("ignored_channels", [])
+                conf.invalidate_caches()
 
                 if server_roles := await db.roles.find_one({"guild_id": guild_id}):
                     for rolename, data in server_roles["roles"].items():
@@ -536,106 +442,30 @@ class DataAdmin(MixinMeta):
         yes = await utils.confirm_msg(ctx)
         if not yes:
             return await msg.edit(content=_("Import cancelled!"))
-        await msg.edit(content=_("Fetching Mee6 leaderboard data, this could take a while..."))
-
-        pages = math.ceil(len(ctx.guild.members) / 1000)
-        # player_schema = {"id": int, "exp": int}
-        players: t.List[t.Dict[str, t.Union[int, str]]] = []
-        failed_pages = 0
-        settings_imported = False
         conf = self.db.get_conf(ctx.guild)
 
-        async with ctx.typing():
-            for i in range(pages):
-                try:
-                    data, status = await utils.fetch_mee6_payload(ctx.guild.id, i)
-                except Exception as e:
-                    log.warning(
-                        f"Failed to import page {i} of Mee6 leaderboard data in {ctx.guild}",
-                        exc_info=e,
-                    )
-                    await ctx.send(f"Failed to import page {i} of Mee6 leaderboard data: {e}")
-                    failed_pages += 1
-                    if isinstance(e, json.JSONDecodeError):
-                        await msg.edit(content=_("Mee6 is rate limiting too heavily! Import Failed!"))
-                        return
-                    continue
-
-                error = data.get("error", {})
-                error_msg = error.get("message", None)
-                if status != 200:
-                    if status == 401:
-                        return await ctx.send(_("Your leaderboard needs to be set to public!"))
-                    elif error_msg:
-                        return await ctx.send(error_msg)
-                    else:
-                        return await ctx.send(_("No data found!"))
-
-                if include_settings and not settings_imported:
-                    settings_imported = True
-                    if xp_rate := data.get("xp_rate"):
-                        conf.algorithm.base = round(xp_rate * 100)
-                    if xp_per_message := data.get("xp_per_message"):
-                        conf.xp = xp_per_message
-                    if role_rewards := data.get("role_rewards"):
-                        for entry in role_rewards:
-                            role_id = int(entry["role_id"])
-                            if not ctx.guild.get_role(role_id):
-                                continue
-                            conf.levelroles[int(entry["rank"])] = role_id
-                    await ctx.send("Settings imported!")
-                player_data = data.get("players")
-                if not player_data:
-                    break
-
-                players.extend(player_data)
-        if failed_pages:
-            await ctx.send(
-                _("{} pages failed to fetch from mee6 api, check logs for more info").format(str(failed_pages))
-            )
-        if not players:
-            return await ctx.send(_("No leaderboard data found!"))
-
-        await msg.edit(content=_("Data retrieved, importing..."))
-        imported = 0
-        failed = 0
-        async with ctx.typing():
-            for user in players:
-                uid = str(user["id"])
-                lvl = int(user["level"])
-                xp = float(user["xp"])
-                member = ctx.guild.get_member(int(uid))
-                if not member and not all_users:
-                    failed += 1
-                    continue
-                if replace:
-                    if import_by == "level":
-                        profile = conf.get_profile(int(uid))
-                        profile.level = lvl
-                        profile.xp = conf.algorithm.get_xp(lvl)
-                    else:
-                        profile = conf.get_profile(int(uid))
-                        profile.xp = xp
-                        profile.level = conf.algorithm.get_level(xp)
-                else:
-                    if import_by == "level":
-                        profile = conf.get_profile(int(uid))
-                        profile.level += lvl
-                        profile.xp = conf.algorithm.get_xp(profile.level)
-                    else:
-                        profile = conf.get_profile(int(uid))
-                        profile.xp += xp
-                        profile.level = conf.algorithm.get_level(profile.xp)
-                imported += 1
-        if not imported and not failed:
-            await msg.edit(content=_("No MEE6 stats were found"))
-        else:
-            txt = _("Imported {} User(s)").format(str(imported))
-            if failed:
-                txt += _(" ({} skipped since they are no longer in the discord)").format(str(failed))
-            await msg.edit(content=txt)
-            await ctx.tick()
-            self.save()
+        async def _import_settings(data: dict):
+            if xp_rate := data.get("xp_rate"):
+                conf.algorithm.base = round(xp_rate * 100)
+            if xp_per_message := data.get("xp_per_message"):
+                conf.xp = xp_per_message
+            if role_rewards := data.get("role_rewards"):
+                for entry in role_rewards:
+                    role_id = int(entry["role_id"])
+                    if not ctx.guild.get_role(role_id):
+                        continue
+                    conf.levelroles[int(entry["rank"])] = role_id
+            await ctx.send(_("Settings imported!"))
+
+        await self.import_leaderboard(
+            ctx,
+            msg,
+            importer.MEE6,
+            import_by,
+            replace,
+            all_users,
+            import_settings=_import_settings if include_settings else None,
+        )
 
     @lvldata.command(name="importpolaris")
     @commands.guildowner()
@@ -662,98 +492,126 @@ class DataAdmin(MixinMeta):
         yes = await utils.confirm_msg(ctx)
         if not yes:
             return await msg.edit(content=_("Import cancelled!"))
-        await msg.edit(content=_("Fetching Polaris leaderboard data, this could take a while..."))
+        conf = self.db.get_conf(ctx.guild)
 
-        # player_schema = {"id": int, "exp": int}
-        players: t.List[t.Dict[str, t.Union[int, str]]] = []
-        failed_pages = 0
-        settings_imported = False
+        async def _import_settings(data: dict):
+            if settings := data.get("settings"):
+                if gain := settings.get("gain"):
+                    conf.xp = [gain["min"], gain["max"]]
+                    conf.cooldown = gain["time"]
+                if curve := settings.get("curve"):
+                    # The cubic curve doesn't translate to quadratic easily, so we won't import this
+                    # cubed = curve["3"]
+                    # squared = curve["2"]
+                    # base = curve["1"]
+                    conf.algorithm.base = curve["1"]
+
+            if role_rewards := data.get("rewards"):
+                for entry in role_rewards:
+                    role = ctx.guild.get_role(int(entry["id"]))
+                    if not role:
+                        continue
+                    conf.levelroles[int(entry["level"])] = role.id
+            await ctx.send(_("Settings Imported!"))
+
+        await self.import_leaderboard(
+            ctx,
+            msg,
+            importer.POLARIS,
+            "exp",
+            replace,
+            all_users,
+            import_settings=_import_settings if include_settings else None,
+        )
+
+    async def import_leaderboard(
+        self,
+        ctx: commands.Context,
+        msg: discord.Message,
+        source: importer.Source,
+        import_by: t.Literal["level", "exp"],
+        replace: bool,
+        all_users: bool,
+        api_key: t.Optional[str] = None,
+        import_settings: t.Optional[t.Callable[[dict], t.Awaitable[None]]] = None,
+    ):
+        """Stream a bot's leaderboard into the guild's profiles
+
+        Pages are applied as they arrive and committed along with a checkpoint, so if the import fails it can pick
+        up where it left off the next time it's run. Replacing stats is safe to repeat, so those imports only
+        checkpoint every few pages. Adding to stats isn't, so every page is checkpointed as soon as it's applied.
+        """
         conf = self.db.get_conf(ctx.guild)
-        async with ctx.typing():
-            for page in range(10):
-                try:
-                    data, status = await utils.fetch_polaris_payload(ctx.guild.id, page)
-                except Exception as e:
-                    log.warning(
-                        f"Failed to import page {page} of Polaris leaderboard data in {ctx.guild}",
-                        exc_info=e,
-                    )
-                    await ctx.send(f"Failed to import page {page} of Polaris leaderboard data: {e}")
-                    failed_pages += 1
-                    if isinstance(e, json.JSONDecodeError):
-                        await msg.edit(content=_("Polaris is rate limiting too heavily! Import Failed!"))
-                        return
-                    continue
-                error = data.get("error", {})
-                error_msg = error.get("message", None)
-                if status != 200:
-                    if status == 401:
-                        return await ctx.send(_("Your leaderboard needs to be set to public!"))
-                    elif error_msg:
-                        return await ctx.send(error_msg)
-                    else:
-                        return await ctx.send(_("No data found!"))
-
-                if include_settings and not settings_imported:
-                    settings_imported = True
-                    if settings := data.get("settings"):
-                        if gain := settings.get("gain"):
-                            conf.xp = [gain["min"], gain["max"]]
-                            conf.cooldown = gain["time"]
-                        if curve := settings.get("curve"):
-                            # The cubic curve doesn't translate to quadratic easily, so we won't import this
-                            # cubed = curve["3"]
-                            # squared = curve["2"]
-                            # base = curve["1"]
-                            conf.algorithm.base = curve["1"]
-
-                    if role_rewards := data.get("rewards"):
-                        for entry in role_rewards:
-                            role = ctx.guild.get_role(int(entry["id"]))
-                            if not role:
-                                continue
-                            conf.levelroles[int(entry["level"])] = role.id
-                    await ctx.send(_("Settings Imported!"))
-
-                player_data = data.get("leaderboard")
-                if not player_data:
-                    break
-
-                players.extend(player_data)
-
-        if failed_pages:
-            await ctx.send(
-                _("{} pages failed to fetch from Polaris api, check logs for more info").format(str(failed_pages))
+        checkpoint_file = self.cog_path / "imports" / f"{ctx.guild.id}-{source.name}.json"
+        options = {"import_by": import_by, "replace": replace, "all_users": all_users}
+        progress = {"next_page": 0, "imported": 0, "skipped": 0}
+        if (checkpoint := importer.load_checkpoint(checkpoint_file)) and checkpoint["options"] == options:
+            await msg.edit(
+                content=_("A previous import stopped at page {} after importing {} users, resume from there?").format(
+                    checkpoint["progress"]["next_page"], humanize_number(checkpoint["progress"]["imported"])
+                )
             )
-        if not players:
-            return await ctx.send(_("No leaderboard data found!"))
-
-        await msg.edit(content=_("Data retrieved, importing..."))
-        imported = 0
-        failed = 0
-        async with ctx.typing():
-            for user in players:
-                uid = str(user["id"])
-                xp = float(user["xp"])
-                member = ctx.guild.get_member(int(user["id"]))
-                if not member and not all_users:
-                    failed += 1
-                    continue
-                profile = conf.get_profile(int(uid))
-                if replace:
-                    profile.xp = xp
-                    profile.level = conf.algorithm.get_level(xp)
-                elif xp:
-                    profile.xp += xp
-                    profile.level = conf.algorithm.get_level(profile.xp)
-                imported += 1
-
-        if not imported and not failed:
-            await msg.edit(content=_("No Polaris stats were found"))
-        else:
-            txt = _("Imported {} User(s)").format(str(imported))
-            if failed:
-                txt += _(" ({} skipped since they are no longer in the discord)").format(str(failed))
-            await msg.edit(content=txt)
-            await ctx.tick()
-            self.save()
+            if await utils.confirm_msg(ctx):
+                progress = checkpoint["progress"]
+
+        async def _commit():
+            checkpoint = {"options": options, "progress": progress}
+            # Held for both so no other save can write applied pages without their checkpoint
+            async with self.io_lock:
+                await self.journal.commit(self.db)
+                await asyncio.to_thread(importer.save_checkpoint, checkpoint_file, checkpoint)
+
+        def _status() -> str:
+            txt = _("Importing from {}... {} users imported from {} pages").format(
+                source.name.capitalize(), humanize_number(progress["imported"]), progress["next_page"]
+            )
+            if progress["skipped"]:
+                txt += _(" ({} skipped since they are no longer in the discord)").format(progress["skipped"])
+            return txt
+
+        start_page = progress["next_page"]
+        await msg.edit(content=_("Fetching {} leaderboard data, this could take a while...").format(source.name))
+        last_update = perf_counter()
+        lb = importer.LeaderboardImporter(source, ctx.guild.id, api_key=api_key)
+        try:
+            async with ctx.typing():
+                async for page, data, players in lb.pages(start_page):
+                    if page == 0 and import_settings:
+                        await import_settings(data)
+                    if not all_users:
+                        members = [i for i in players if ctx.guild.get_member(i.id)]
+                        progress["skipped"] += len(players) - len(members)
+                        players = members
+                    importer.apply_players(conf, players, import_by, replace, weekly=source.weekly)
+                    progress["imported"] += len(players)
+                    progress["next_page"] = page + 1
+                    if not replace or not (page + 1 - start_page) % 10:
+                        await _commit()
+                    if perf_counter() - last_update > 5:
+                        last_update = perf_counter()
+                        with suppress(discord.HTTPException):
+                            await msg.edit(content=_status())
+        except importer.ImportFailed as e:
+            log.warning(f"Failed to import {source.name} leaderboard data in {ctx.guild}", exc_info=e)
+            await _commit()
+            self.save(guild=ctx.guild)
+            if e.status == 401:
+                txt = _("Your leaderboard needs to be set to public!")
+            elif e.message:
+                txt = e.message
+            else:
+                txt = _("{} is rate limiting too heavily!").format(source.name.capitalize())
+            txt += "\n" + _status()
+            if progress["next_page"]:
+                txt += "\n" + _("Run the command again to resume from page {}").format(progress["next_page"])
+            return await msg.edit(content=txt)
+
+        checkpoint_file.unlink(missing_ok=True)
+        if not progress["imported"] and not progress["skipped"]:
+            return await msg.edit(content=_("No {} stats were found").format(source.name.capitalize()))
+        txt = _("Imported {} User(s)").format(humanize_number(progress["imported"]))
+        if progress["skipped"]:
+            txt += _(" ({} skipped since they are no longer in the discord)").format(progress["skipped"])
+        await msg.edit(content=txt)
+        await ctx.tick()
+        self.save(guild=ctx.guild)
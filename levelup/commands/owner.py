@@ -5,6 +5,7 @@ from io import BytesIO, StringIO
 import discord
 from redbot.core import commands
 from redbot.core.i18n import Translator, cog_i18n
+from redbot.core.utils.chat_formatting import humanize_number
 
 from ..abc import MixinMeta
 from ..common import utils
@@ -32,15 +33,17 @@ class Owner(MixinMeta):
             size_bytes += utils.deep_getsizeof(self.lastmsg)
             size_bytes += utils.deep_getsizeof(self.voice_tracking)
             size_bytes += utils.deep_getsizeof(self.profile_cache)
+            size_bytes += self.render_cache.memory.size + self.content_cache.memory.size
             return size_bytes
 
         embed = discord.Embed(color=await self.bot.get_embed_color(ctx))
         size = await asyncio.to_thread(_size)
         embed.add_field(
             name=_("Global Settings"),
-            value=_("`Profile Cache Time: `{}\n" "`Cache Size:         `{}\n").format(
+            value=_("`Profile Cache Time: `{}\n`Cache Size:         `{}\n`Disk Cache Size:    `{}\n").format(
                 utils.humanize_delta(self.db.cache_seconds),
                 utils.humanize_size(size),
+                utils.humanize_size(self.render_cache.disk.size + self.content_cache.disk.size),
             ),
             inline=False,
         )
@@ -55,6 +58,9 @@ class Owner(MixinMeta):
         )
         if self.db.render_gifs:
             txt = _("Users with animated profiles will render as a GIF")
+            frames = humanize_number(self.db.gif_max_frames) if self.db.gif_max_frames else _("Unlimited")
+            size = f"{self.db.gif_max_mb}MB" if self.db.gif_max_mb else _("Unlimited")
+            txt += _("\n- **Frame Budget:** {}\n- **Size Budget:** {}").format(frames, size)
         else:
             txt = _("Profiles will always be static images")
         embed.add_field(
@@ -96,17 +102,64 @@ class Owner(MixinMeta):
         txt = _(
             "*If an internal API port is specified, the bot will spin up subprocesses to handle image generation.*\n"
             "- **Internal API Port:** {}\n"
-            "*If an external API URL is specified, the bot will use that URL for image generation.*\n"
-            "- **External API URL:** {}\n"
+            "*If external API URLs are specified, the bot will use them for image generation.*\n"
+            "- **External API URLs:** {}\n"
         ).format(
             self.db.internal_api_port or _("Not Using"),
-            self.db.external_api_url or _("Not Using"),
+            ", ".join(filter(None, [self.db.external_api_url, *self.db.external_api_urls])) or _("Not Using"),
         )
+        for endpoint in self.endpoints.metrics():
+            txt += _("- `{}`: {} ({}s avg, {}s p95, {} rendered, {} failed)\n").format(
+                endpoint["url"],
+                endpoint["state"],
+                round(endpoint["latency"], 2),
+                round(endpoint["p95"], 2),
+                humanize_number(endpoint["completed"]),
+                humanize_number(endpoint["errors"]),
+            )
+        if self.endpoints.hedged:
+            txt += _("- **Hedged Requests:** {}\n").format(humanize_number(self.endpoints.hedged))
         embed.add_field(
             name=_("API Settings"),
             value=txt,
             inline=False,
         )
+        if self.render_pool is not None:
+            metrics = self.render_pool.metrics()
+            txt = _(
+                "- **Workers:** {}\n"
+                "- **Queued/Rendering:** {}/{}\n"
+                "- **Completed/Failed/Rejected:** {}/{}/{}\n"
+                "- **Render Time (p50/p95):** {}s/{}s\n"
+                "- **Queue Wait (p50/p95):** {}s/{}s\n"
+            ).format(
+                metrics["workers"],
+                metrics["queued"],
+                metrics["inflight"],
+                metrics["completed"],
+                metrics["failed"],
+                metrics["rejected"],
+                round(metrics["render_p50"], 2),
+                round(metrics["render_p95"], 2),
+                round(metrics["wait_p50"], 2),
+                round(metrics["wait_p95"], 2),
+            )
+        else:
+            txt = _("Not Using")
+        embed.add_field(
+            name=_("Render Pool"),
+            value=txt,
+            inline=False,
+        )
+        if self.db.batch_xp:
+            txt = _("Message XP is queued and level ups are checked in batches")
+        else:
+            txt = _("Message XP is applied as soon as it is earned")
+        embed.add_field(
+            name=_("XP Batching"),
+            value=txt,
+            inline=False,
+        )
         status = _("Enabled") if self.db.auto_cleanup else _("Disabled")
         embed.add_field(
             name=_("Auto-Cleanup ({})").format(status),
@@ -189,30 +242,68 @@ class Owner(MixinMeta):
         self.save()
 
     @lvlowner.command(name="externalapi")
-    async def set_external_api(self, ctx: commands.Context, url: str):
+    async def set_external_api(self, ctx: commands.Context, *urls: str):
         """
-        Set the external API URL for image generation
+        Set the external API URLs for image generation
+
+        Set to `none` to disable the external API
 
-        Set to an `none` to disable the external API
+        Multiple URLs can be given to spread image generation across several APIs.
+        Requests go to whichever is responding fastest, slow requests are retried on another API,
+        and APIs that keep failing are skipped until their health checks pass again.
 
         **Notes**
-        - If the API fails, the cog will fall back to the default image generation method.
+        - If every API fails, the cog will fall back to the default image generation method.
         """
-        if url == "none":
+        if not urls:
+            return await ctx.send_help()
+        if urls[0].lower() == "none":
             txt = _("External API disabled")
             self.db.external_api_url = ""
+            self.db.external_api_urls = []
+            self.refresh_endpoints()
             self.save()
             # If interal api is set, start it up
             if self.db.internal_api_port:
                 await self.start_api()
                 txt += _("\nInternal API started since port was set.")
             return await ctx.send(txt)
-        if not url.startswith("http"):
-            return await ctx.send(_("Invalid URL"))
+        for url in urls:
+            if not url.startswith("http"):
+                return await ctx.send(_("Invalid URL: `{}`").format(url))
+
+        self.db.external_api_url = urls[0]
+        self.db.external_api_urls = list(urls[1:])
+        self.refresh_endpoints()
+        await ctx.send(_("External API URLs set to {}").format(", ".join(f"`{i}`" for i in urls)))
+        self.save()
+
+    @lvlowner.command(name="renderpool")
+    async def set_render_pool(self, ctx: commands.Context, workers: int):
+        """
+        Set the number of processes in the built-in render pool
+
+        The render pool spreads image generation across multiple processes without needing to run the API.
+        Jobs are queued fairly across servers, so a burst of level ups in one server won't stall profiles in others.
+        Render pool stats can be viewed with `[p]lvlowner view`.
+
+        Set to 0 to disable the render pool
 
-        self.db.external_api_url = url
-        await ctx.send(_("External API URL set to `{}`").format(url))
+        **Notes**
+        - The internal and external APIs take priority over the render pool for profiles and level up images.
+        - If the pool is full or fails, images are rendered in a thread like normal.
+        """
+        if workers < 0:
+            return await ctx.send(_("The number of workers can't be negative."))
+        self.db.render_workers = workers
         self.save()
+        await self.stop_render_pool()
+        if not workers:
+            return await ctx.send(_("Render pool disabled."))
+        if await self.start_render_pool():
+            await ctx.send(_("Render pool started with {} workers.").format(workers))
+        else:
+            await ctx.send(_("Failed to start the render pool, check your logs for details."))
 
     @lvlowner.command(name="rendergifs", aliases=["rendergif", "gif"])
     async def toggle_gif_rendering(self, ctx: commands.Context):
@@ -225,6 +316,25 @@ class Owner(MixinMeta):
             await ctx.send(_("GIF rendering enabled."))
         self.save()
 
+    @lvlowner.command(name="gifbudget")
+    async def set_gif_budget(self, ctx: commands.Context, max_frames: int, max_mb: int):
+        """
+        Set the frame and size budget for animated profiles
+
+        Animated profiles with more frames than `max_frames` have frames skipped evenly, keeping the same speed.
+        If the result is still larger than `max_mb`, every other frame is dropped until it fits.
+
+        Set either to 0 for no limit (Defaults are 100 frames and 8MB)
+        """
+        if max_frames < 0 or max_mb < 0:
+            return await ctx.send(_("The budget can't be negative."))
+        self.db.gif_max_frames = max_frames
+        self.db.gif_max_mb = max_mb
+        self.save()
+        frames = humanize_number(max_frames) if max_frames else _("Unlimited")
+        size = f"{max_mb}MB" if max_mb else _("Unlimited")
+        await ctx.send(_("Animated profiles are now limited to {} frames and {} in size.").format(frames, size))
+
     @lvlowner.command(name="forceembeds", aliases=["forceembed"])
     async def toggle_force_embeds(self, ctx: commands.Context):
         """Toggle enforcing profile embeds
@@ -240,6 +350,22 @@ class Owner(MixinMeta):
             await ctx.send(_("Profile embeds are now enforced on all servers."))
         self.save()
 
+    @lvlowner.command(name="batchxp")
+    async def toggle_batch_xp(self, ctx: commands.Context):
+        """Toggle batched message XP
+
+        Instead of checking for level ups on every message, XP earned from messages is queued and applied every
+        couple of seconds, checking each member for level ups once per batch.
+        Recommended for bots in large, very active servers.
+        """
+        if self.db.batch_xp:
+            self.db.batch_xp = False
+            await ctx.send(_("Message XP will now be applied as soon as it is earned."))
+        else:
+            self.db.batch_xp = True
+            await ctx.send(_("Message XP will now be queued and applied in batches."))
+        self.save()
+
     @lvlowner.command(name="ignore")
     async def ignore_server(self, ctx: commands.Context, guild_id: int):
         """Add/Remove a server from the ignore list"""
@@ -3,9 +3,10 @@ import asyncio
 import discord
 from redbot.core import commands
 from redbot.core.i18n import Translator, cog_i18n
+from redbot.core.utils.chat_formatting import humanize_number
 
 from ..abc import MixinMeta
-from ..common import formatter, utils
+from ..common import archive, formatter, utils
 from ..views.dynamic_menu import DynamicMenu
 
 _ = Translator("LevelUp", __file__)
@@ -47,11 +48,17 @@ class Weekly(MixinMeta):
     @commands.command(name="lastweekly")
     @commands.guild_only()
     @commands.bot_has_permissions(embed_links=True)
-    async def lastweekly(self, ctx: commands.Context):
-        """View Last Week's Leaderboard"""
+    async def lastweekly(self, ctx: commands.Context, weeks_ago: int = 1):
+        """View Last Week's Leaderboard
+
+        **Arguments**
+        `weeks_ago` - View an older week from the archive, `2` for the week before last and so on
+        """
         conf = self.db.get_conf(ctx.guild)
         if not conf.weeklysettings.on:
             return await ctx.send(_("Weekly stats are not enabled on this server"))
+        if weeks_ago > 1:
+            return await self.archived_weekly(ctx, weeks_ago)
         if not conf.weeklysettings.last_embed:
             return await ctx.send(_("There is no recorded weekly embed saved"))
         embed = discord.Embed.from_dict(conf.weeklysettings.last_embed)
@@ -60,6 +67,32 @@ class Weekly(MixinMeta):
         embed.description = new_desc
         await ctx.send(embed=embed)
 
+    async def archived_weekly(self, ctx: commands.Context, weeks_ago: int):
+        conf = self.db.get_conf(ctx.guild)
+        folder = archive.archive_dir(self.cog_path, ctx.guild.id)
+        resets = await asyncio.to_thread(archive.list_snapshots, folder)
+        if len(resets) < weeks_ago:
+            return await ctx.send(_("Only {} weeks have been archived").format(len(resets)))
+        snapshot = await asyncio.to_thread(archive.read_snapshot, folder, resets[weeks_ago - 1])
+        if snapshot is None:
+            return await ctx.send(_("That week's archive could not be read"))
+        embed = discord.Embed(
+            title=_("Weekly Leaderboard"),
+            description=_("`Reset: `{}").format(f"<t:{snapshot.reset}:F>"),
+            color=await self.bot.get_embed_color(ctx),
+        )
+        place_emojis = ["🥇", "🥈", "🥉"]
+        for idx, (user_id, stats) in enumerate(snapshot.top(max(1, conf.weeklysettings.count))):
+            if stats["xp"] <= 0:
+                break
+            position = place_emojis[idx] if idx < 3 else f"#{idx + 1}."
+            member = ctx.guild.get_member(user_id)
+            name = member.display_name if member else str(user_id)
+            txt = _("`Experience: `{}\n").format(humanize_number(round(stats["xp"])))
+            txt += _("`Messages:   `{}\n").format(humanize_number(stats["messages"]))
+            embed.add_field(name=f"{position} {name}", value=txt, inline=False)
+        await ctx.send(embed=embed)
+
     @commands.group(name="weeklyset", aliases=["wset"])
     @commands.admin_or_permissions(manage_guild=True)
     @commands.guild_only()
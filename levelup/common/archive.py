@@ -0,0 +1,89 @@
+import gzip
+import logging
+import typing as t
+from pathlib import Path
+
+import orjson
+
+log = logging.getLogger("red.vrt.levelup.archive")
+
+# Stats kept for each user, stored as one column per stat
+FIELDS = ("xp", "messages", "voice", "stars")
+# Weeks kept per guild, the oldest are dropped first
+KEEP = 104
+
+
+class WeeklySnapshot:
+    """Column oriented copy of a guild's weekly stats, filled one profile at a time during a reset
+
+    Args:
+        reset (int): Timestamp of the reset the stats were taken at
+    """
+
+    def __init__(self, reset: int):
+        self.reset = reset
+        self.ids: t.List[int] = []
+        self.columns: t.Dict[str, t.List[float]] = {field: [] for field in FIELDS}
+
+    def add(self, user_id: int, stats: t.Any) -> None:
+        self.ids.append(user_id)
+        for field in FIELDS:
+            self.columns[field].append(getattr(stats, field))
+
+    def dump(self) -> bytes:
+        return gzip.compress(orjson.dumps({"reset": self.reset, "ids": self.ids, **self.columns}), compresslevel=6)
+
+    @classmethod
+    def load(cls, raw: bytes) -> "WeeklySnapshot":
+        data = orjson.loads(gzip.decompress(raw))
+        snapshot = cls(data["reset"])
+        snapshot.ids = data["ids"]
+        snapshot.columns = {field: data.get(field, [0] * len(snapshot.ids)) for field in FIELDS}
+        return snapshot
+
+    def top(self, count: int, stat: str = "xp") -> t.List[t.Tuple[int, t.Dict[str, float]]]:
+        """The `count` users with the most of a stat, with all of their stats"""
+        column = self.columns[stat]
+        order = sorted(range(len(self.ids)), key=column.__getitem__, reverse=True)[:count]
+        return [(self.ids[i], {field: self.columns[field][i] for field in FIELDS}) for i in order]
+
+
+def archive_dir(root: Path, guild_id: int) -> Path:
+    return root / "weekly" / str(guild_id)
+
+
+def write_snapshot(folder: Path, snapshot: WeeklySnapshot) -> Path:
+    """Blocking call, writes the snapshot and prunes archives past `KEEP`"""
+    folder.mkdir(parents=True, exist_ok=True)
+    path = folder / f"{snapshot.reset}.json.gz"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(snapshot.dump())
+    tmp.replace(path)
+    for old in list_snapshots(folder)[KEEP:]:
+        (folder / f"{old}.json.gz").unlink(missing_ok=True)
+    return path
+
+
+def list_snapshots(folder: Path) -> t.List[int]:
+    """Reset timestamps of the archived weeks, newest first"""
+    if not folder.exists():
+        return []
+    stamps = []
+    for path in folder.glob("*.json.gz"):
+        try:
+            stamps.append(int(path.name.split(".")[0]))
+        except ValueError:
+            continue
+    return sorted(stamps, reverse=True)
+
+
+def read_snapshot(folder: Path, reset: int) -> t.Optional[WeeklySnapshot]:
+    """Blocking call"""
+    path = folder / f"{reset}.json.gz"
+    if not path.exists():
+        return None
+    try:
+        return WeeklySnapshot.load(path.read_bytes())
+    except (OSError, EOFError, orjson.JSONDecodeError) as e:
+        log.warning(f"Weekly archive {path} is corrupt, skipping it", exc_info=e)
+        return None
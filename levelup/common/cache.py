@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import typing as t
+from collections import OrderedDict
+from pathlib import Path
+from time import time
+
+import aiohttp
+import orjson
+
+log = logging.getLogger("red.vrt.levelup.cache")
+
+HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:126.0) Gecko/20100101 Firefox/126.0"}
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def render_key(style: str, kwargs: t.Dict[str, t.Any], salt: str = "") -> str:
+    """Hash everything that goes into rendering a profile
+
+    Bytes (avatars, backgrounds, emojis) are hashed by content and URLs by value, so two calls with the same
+    inputs produce the same key. Custom fonts are keyed by their modified time in case they get replaced.
+
+    Args:
+        style (str): The profile style
+        kwargs (t.Dict[str, t.Any]): The arguments passed to the generator
+        salt (str, optional): Extra data to key by, like the cog version so renders don't survive updates
+    """
+    hasher = hashlib.blake2b(f"{style}|{salt}".encode(), digest_size=16)
+    for key in sorted(kwargs):
+        if key == "reraise":
+            continue
+        value = kwargs[key]
+        if isinstance(value, bytes):
+            value = hash_bytes(value)
+        elif key == "font_path" and value:
+            value = f"{value}@{os.path.getmtime(value)}"
+        hasher.update(f"|{key}={value}".encode())
+    return hasher.hexdigest()
+
+
+class LRUCache:
+    """Thread safe in-memory LRU cache of bytes, bounded by total size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items: t.OrderedDict[str, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def get(self, key: str) -> t.Optional[bytes]:
+        with self.lock:
+            data = self.items.get(key)
+            if data is not None:
+                self.items.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if old := self.items.pop(key, None):
+                self.size -= len(old)
+            self.items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, key: str) -> None:
+        with self.lock:
+            if old := self.items.pop(key, None):
+                self.size -= len(old)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+
+class DiskCache:
+    """Directory of cached files bounded by total size, the least recently used files get evicted first"""
+
+    def __init__(self, path: Path, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.size = sum(i.stat().st_size for i in self.path.iterdir() if i.is_file())
+
+    def get(self, name: str) -> t.Optional[bytes]:
+        file = self.path / name
+        try:
+            data = file.read_bytes()
+        except FileNotFoundError:
+            return None
+        # Bump the modified time so the file counts as recently used
+        file.touch(exist_ok=True)
+        return data
+
+    def put(self, name: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        file = self.path / name
+        with self.lock:
+            if file.exists():
+                self.size -= file.stat().st_size
+            tmp = file.with_suffix(file.suffix + ".tmp")
+            tmp.write_bytes(data)
+            tmp.replace(file)
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def discard(self, name: str) -> None:
+        file = self.path / name
+        with self.lock:
+            if file.exists():
+                self.size -= file.stat().st_size
+                file.unlink(missing_ok=True)
+
+    def evict(self) -> None:
+        """Delete the oldest files until the cache is back under 90% of its cap"""
+        target = self.max_bytes * 0.9
+        files = [(i.stat(), i) for i in self.path.iterdir() if i.is_file()]
+        files.sort(key=lambda x: x[0].st_mtime)
+        for stat, file in files:
+            if self.size <= target:
+                break
+            file.unlink(missing_ok=True)
+            self.size -= stat.st_size
+
+    def clear(self) -> None:
+        with self.lock:
+            for file in self.path.iterdir():
+                if file.is_file():
+                    file.unlink(missing_ok=True)
+            self.size = 0
+
+
+class RenderCache:
+    """Two tier cache of rendered profile images keyed by a hash of their inputs
+
+    Recent renders are kept in memory, everything else is kept on disk under the cog's data path.
+    Since the key covers every input, an entry never goes stale, it just stops being requested and gets evicted.
+    """
+
+    def __init__(self, path: Path, max_memory: int = 64 * 1024 * 1024, max_disk: int = 512 * 1024 * 1024):
+        self.memory = LRUCache(max_memory)
+        self.disk = DiskCache(path, max_disk)
+
+    async def get(self, key: str) -> t.Optional[t.Tuple[bytes, str]]:
+        """Get a cached render
+
+        Returns:
+            t.Optional[t.Tuple[bytes, str]]: The image bytes and file extension, or None on a miss
+        """
+        for ext in ("webp", "gif"):
+            if data := self.memory.get(f"{key}.{ext}"):
+                return data, ext
+        for ext in ("webp", "gif"):
+            if data := await asyncio.to_thread(self.disk.get, f"{key}.{ext}"):
+                self.memory.put(f"{key}.{ext}", data)
+                return data, ext
+        return None
+
+    async def put(self, key: str, data: bytes, ext: str) -> None:
+        self.memory.put(f"{key}.{ext}", data)
+        try:
+            await asyncio.to_thread(self.disk.put, f"{key}.{ext}", data)
+        except OSError as e:
+            log.warning("Failed to write render to disk cache", exc_info=e)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.disk.clear()
+
+
+class ContentCache:
+    """Cache for downloaded backgrounds, banners, avatars and emojis
+
+    Content is reused without any request for `ttl` seconds, after that it gets revalidated with the ETag or
+    Last-Modified headers the server sent, so unchanged images are never downloaded twice.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        ttl: int = 3600,
+        max_memory: int = 32 * 1024 * 1024,
+        max_disk: int = 256 * 1024 * 1024,
+    ):
+        self.ttl = ttl
+        self.memory = LRUCache(max_memory)
+        self.disk = DiskCache(path, max_disk)
+        # url hash: {"etag": str, "modified": str, "fetched": float}
+        self.meta: t.Dict[str, t.Dict[str, t.Any]] = {}
+        self.meta_file = path.with_suffix(".json")
+        if self.meta_file.exists():
+            try:
+                self.meta = orjson.loads(self.meta_file.read_bytes())
+            except orjson.JSONDecodeError:
+                log.warning("Download cache metadata is corrupt, starting fresh")
+        self.session: t.Optional[aiohttp.ClientSession] = None
+
+    async def close(self) -> None:
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        await asyncio.to_thread(self.save_meta)
+
+    def save_meta(self) -> None:
+        # Drop metadata of files that got evicted
+        self.meta = {k: v for k, v in self.meta.items() if (self.disk.path / k).exists()}
+        self.meta_file.write_bytes(orjson.dumps(self.meta))
+
+    async def _load(self, name: str) -> t.Optional[bytes]:
+        if data := self.memory.get(name):
+            return data
+        if data := await asyncio.to_thread(self.disk.get, name):
+            self.memory.put(name, data)
+        return data
+
+    async def _store(self, name: str, data: bytes) -> None:
+        self.memory.put(name, data)
+        try:
+            await asyncio.to_thread(self.disk.put, name, data)
+        except OSError as e:
+            log.warning("Failed to write download to disk cache", exc_info=e)
+
+    async def fetch(self, url: str) -> t.Optional[bytes]:
+        """Get the content of a URL, returns None if the content no longer exists"""
+        name = hash_bytes(url.encode())
+        meta = self.meta.get(name)
+        cached = await self._load(name) if meta else None
+        if cached is not None and time() - meta["fetched"] < self.ttl:
+            return cached
+
+        headers = {}
+        if cached is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("modified"):
+                headers["If-Modified-Since"] = meta["modified"]
+
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(headers=HEADERS)
+        try:
+            async with self.session.get(url, headers=headers) as resp:
+                if resp.status == 304 and cached is not None:
+                    meta["fetched"] = time()
+                    return cached
+                if resp.status == 404:
+                    self.meta.pop(name, None)
+                    self.memory.discard(name)
+                    await asyncio.to_thread(self.disk.discard, name)
+                    return None
+                data = await resp.content.read()
+                if resp.status != 200:
+                    # Not cacheable, hand it over like a plain request would
+                    return data
+                etag = resp.headers.get("ETag")
+                modified = resp.headers.get("Last-Modified")
+        except aiohttp.ClientError:
+            if cached is not None:
+                # Serve stale content rather than nothing
+                return cached
+            raise
+
+        self.meta[name] = {"etag": etag, "modified": modified, "fetched": time()}
+        await self._store(name, data)
+        return data
+
+    def clear(self) -> None:
+        self.meta.clear()
+        self.memory.clear()
+        self.disk.clear()
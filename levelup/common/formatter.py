@@ -9,7 +9,8 @@ from redbot.core.i18n import Translator
 from redbot.core.utils.chat_formatting import humanize_number
 
 from ..common import utils
-from ..common.models import DB, GuildSettings, Profile, ProfileWeekly, WeeklySettings
+from ..common.models import DB, GuildSettings, Profile, WeeklySettings
+from ..common.ranks import get_stat
 
 _ = Translator("LevelUp", __file__)
 
@@ -24,40 +25,19 @@ def get_user_position(
     """Get the position of a user in the leaderboard
 
     Args:
-        lb (t.Dict[int, t.Union[Profile, ProfileWeekly]]): The leaderboard
+        guild (discord.Guild): The guild
+        conf (GuildSettings): The guild's settings
+        lbtype (t.Literal["lb", "weekly"]): The type of leaderboard
         target_user (int): The user's ID
         key (str): The key to sort by
 
     Returns:
-        int: The user's position
+        dict: The user's position, the total of the stat and the user's percentage of that total
     """
-    if lbtype == "weekly":
-        lb: t.Dict[int, ProfileWeekly] = conf.users_weekly
-    elif not conf.prestigedata:
-        lb: t.Dict[int, Profile] = conf.users
-    else:
-        lb: t.Dict[int, Profile] = {}
-        for user_id in list(conf.users.keys()):
-            profile = (
-                conf.users[user_id].model_copy()
-                if hasattr(conf.users[user_id], "model_copy")
-                else conf.users[user_id].copy()
-            )
-            if profile.prestige and conf.prestigelevel:
-                profile.xp += profile.prestige * conf.algorithm.get_xp(conf.prestigelevel)
-                profile.level += profile.prestige * conf.prestigelevel
-            lb[user_id] = profile
-
-    valid_users = {k: v for k, v in lb.items() if guild.get_member(k)}
-    sorted_users = sorted(valid_users.items(), key=lambda x: getattr(x[1], key), reverse=True)
-    for idx, (uid, _) in enumerate(sorted_users):
-        if uid == target_user:
-            position = idx + 1
-            break
-    else:
-        position = -1
-    total = sum([getattr(x[1], key) for x in sorted_users])
-    percent = getattr(lb[target_user], key) / total * 100 if total else 0
+    index = conf.get_rank_index(guild, "weekly" if lbtype == "weekly" else "lb", key)
+    position = index.rank(target_user)
+    total = index.total
+    percent = index.values.get(target_user, 0) / total * 100 if total else 0
     return {"position": position, "total": total, "percent": percent}
 
 
@@ -97,6 +77,27 @@ def get_role_leaderboard(rolegroups: t.Dict[int, float], color: discord.Color) -
     return embeds
 
 
+def format_stat(
+    conf: GuildSettings,
+    lbtype: str,
+    key: str,
+    is_global: bool,
+    user_id: int,
+    value: float,
+) -> str:
+    """Format a leaderboard value, lifetime XP also shows the user's level including prestiges"""
+    if key == "voice":
+        return utils.humanize_delta(round(value))
+    txt = utils.abbreviate_number(round(value))
+    if key == "xp" and lbtype != "weekly" and not is_global and user_id in conf.users:
+        profile: Profile = conf.users[user_id]
+        level = profile.level
+        if profile.prestige and conf.prestigelevel and conf.prestigedata:
+            level += profile.prestige * conf.prestigelevel
+        txt += f" 🎖{level}"
+    return txt
+
+
 def get_leaderboard(
     bot: Red,
     guild: discord.Guild,
@@ -109,6 +110,7 @@ def get_leaderboard(
     dashboard: bool = False,
     color: discord.Color = discord.Color.random(),
     query: str = None,
+    with_stats: bool = True,
 ) -> t.Union[t.List[discord.Embed], t.Dict[str, t.Any], str]:
     """Format and return the leaderboard
 
@@ -123,6 +125,9 @@ def get_leaderboard(
         use_displayname (bool, optional): If false, uses username. Defaults to True.
         dashboard (bool, optional): True when called by the dashboard integration. Defaults to False.
         color (discord.Color, optional): Defaults to discord.Color.random().
+        query (str, optional): Filter the dashboard entries by name, ID or #position. Defaults to None.
+        with_stats (bool, optional): If False the dashboard payload holds the raw sorted (user_id, value) rows
+            under "rows" instead of formatted "stats" entries. Defaults to True.
 
     Returns:
         t.Union[t.List[discord.Embed], t.Dict[str, t.Any], str]: If called from dashboard returns a dict, else returns a list of embeds or a string
@@ -130,43 +135,14 @@ def get_leaderboard(
     stat = stat.lower()
     color = member.color if member else color
     conf = db.get_conf(guild)
-    lb: t.Dict[int, t.Union[Profile, ProfileWeekly]]
     weekly: WeeklySettings = None
     if lbtype == "weekly":
         title = _("Weekly ")
-        lb = db.get_conf(guild).users_weekly
-        weekly = db.get_conf(guild).weeklysettings
+        weekly = conf.weeklysettings
     elif lbtype == "lb" and is_global:
         title = _("Global LevelUp ")
-        # Add up all the guilds
-        lb: t.Dict[int, Profile] = {}
-        for guild_id in db.configs.keys():
-            guild_conf: GuildSettings = db.configs[guild_id]
-            for user_id in guild_conf.users.keys():
-                profile: Profile = guild_conf.users[user_id]
-                if user_id not in lb:
-                    lb[user_id] = profile.model_copy() if hasattr(profile, "model_copy") else profile.copy()
-                else:
-                    lb[user_id].xp += profile.xp
-                    lb[user_id].messages += profile.messages
-                    lb[user_id].voice += profile.voice
-                    lb[user_id].stars += profile.stars
-
-                if "xp" in stat and profile.prestige and guild_conf.prestigelevel:
-                    lb[user_id].xp += profile.prestige * guild_conf.algorithm.get_xp(guild_conf.prestigelevel)
-                    lb[user_id].level += profile.prestige * guild_conf.prestigelevel
-    elif "xp" in stat and conf.prestigelevel and conf.prestigedata:
-        title = _("LevelUp ")
-        lb = {}
-        for user_id in conf.users.keys():
-            profile: Profile = conf.users[user_id]
-            lb[user_id] = profile.model_copy() if hasattr(profile, "model_copy") else profile.copy()
-            if profile.prestige:
-                lb[user_id].xp += profile.prestige * conf.algorithm.get_xp(conf.prestigelevel)
-                lb[user_id].level += profile.prestige * conf.prestigelevel
     else:
         title = _("LevelUp ")
-        lb = db.get_conf(guild).users.copy()
 
     if "v" in stat:
         title += _("Voice Leaderboard")
@@ -189,32 +165,45 @@ def get_leaderboard(
         emoji = conf.emojis.get("bulb", bot)
         statname = _("Experience")
 
-    if is_global:
-        valid_users: t.Dict[int, t.Union[Profile, ProfileWeekly]] = {k: v for k, v in lb.items() if bot.get_user(k)}
+    # List of (user_id, stat) tuples sorted from highest to lowest
+    sorted_users: t.List[t.Tuple[int, float]]
+    if lbtype == "lb" and is_global:
+        # Add up all the guilds
+        lb: t.Dict[int, float] = {}
+        for guild_id in db.configs.keys():
+            guild_conf: GuildSettings = db.configs[guild_id]
+            for user_id in guild_conf.users.keys():
+                if not bot.get_user(user_id):
+                    continue
+                profile: Profile = guild_conf.users[user_id]
+                lb[user_id] = lb.get(user_id, 0) + get_stat(guild_conf, profile, "lb", key)
+        sorted_users = sorted([i for i in lb.items() if i[1] > 0], key=lambda x: x[1], reverse=True)
+        total_value = sum(i[1] for i in sorted_users)
+        position = next((idx + 1 for idx, i in enumerate(sorted_users) if member and i[0] == member.id), -1)
     else:
-        valid_users: t.Dict[int, t.Union[Profile, ProfileWeekly]] = {k: v for k, v in lb.items() if guild.get_member(k)}
+        index = conf.get_rank_index(guild, lbtype, key)
+        sorted_users = index.page(0, index.positive())
+        total_value = index.total
+        position = index.rank(member.id) if member else -1
 
-    filtered_users: t.Dict[int, t.Union[Profile, ProfileWeekly]] = {
-        k: v for k, v in valid_users.items() if getattr(v, key) > 0
-    }
-    if not filtered_users and not dashboard:
+    if not sorted_users and not dashboard:
         txt = _("There is no data for the {} leaderboard yet").format(
             _("weekly {}").format(statname) if lbtype == "weekly" else statname
         )
         return txt
 
-    sorted_users = sorted(filtered_users.items(), key=lambda x: getattr(x[1], key), reverse=True)
     usercount = len(sorted_users)
     func = utils.humanize_delta if "v" in stat else humanize_number
-    total: str = func(round(sum([getattr(x, key) for x in filtered_users.values()])))
+    total: str = func(round(total_value))
 
-    for idx, (user_id, stats) in enumerate(sorted_users):
-        if member and user_id == member.id:
-            you = _(" | You: {}").format(f"{idx + 1}/{len(sorted_users)}")
-            break
+    if 0 < position <= usercount:
+        you = _(" | You: {}").format(f"{position}/{usercount}")
     else:
         you = ""
 
+    def _format_stat(user_id: int, value: float) -> str:
+        return format_stat(conf, lbtype, key, is_global, user_id, value)
+
     if lbtype == "weekly":
         if dashboard:
             desc = _("➣ Total {}: {}\n").format(statname, f"`{total}`{emoji}")
@@ -252,9 +241,13 @@ def get_leaderboard(
             "total": total,
             "type": lbtype,
             "user_position": you,
+            "key": key,
             "stats": [],
         }
-        for idx, (user_id, stats) in enumerate(sorted_users):
+        if not with_stats:
+            payload["rows"] = sorted_users
+            return payload
+        for idx, (user_id, value) in enumerate(sorted_users):
             user_obj = bot.get_user(user_id) if is_global else guild.get_member(user_id)
             user = (user_obj.display_name if use_displayname else user_obj.name) if user_obj else user_id
             if query:
@@ -272,15 +265,7 @@ def get_leaderboard(
                     if query.lower() not in str(user).lower():
                         continue
             place = idx + 1
-            if key == "voice":
-                stat = utils.humanize_delta(round(getattr(stats, key)))
-            else:
-                stat = utils.abbreviate_number(round(getattr(stats, key)))
-
-                if key == "xp" and lbtype != "weekly" and not is_global:
-                    stat += f" 🎖{stats.level}"
-
-            entry = {"position": place, "name": user, "id": user_id, "stat": stat}
+            entry = {"position": place, "name": user, "id": user_id, "stat": _format_stat(user_id, value)}
             payload["stats"].append(entry)
         return payload
 
@@ -292,18 +277,11 @@ def get_leaderboard(
         stop = min(usercount, stop)
         buffer = StringIO()
         for i in range(start, stop):
-            user_id, stats = sorted_users[i]
+            user_id, value = sorted_users[i]
             user_obj = bot.get_user(user_id) if is_global else guild.get_member(user_id)
             name = (user_obj.display_name if use_displayname else user_obj.name) if user_obj else user_id
             place = i + 1
-            if key == "voice":
-                stat = utils.humanize_delta(round(getattr(stats, key)))
-            else:
-                stat = utils.abbreviate_number(round(getattr(stats, key)))
-                if key == "xp" and lbtype != "weekly" and not is_global:
-                    stat += f" 🎖{stats.level}"
-
-            buffer.write(f"**{place}**. {name} (`{stat}`)\n")
+            buffer.write(f"**{place}**. {name} (`{_format_stat(user_id, value)}`)\n")
 
         embed = discord.Embed(
             title=title,
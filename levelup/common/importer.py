@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import random
+import typing as t
+from dataclasses import dataclass
+from pathlib import Path
+from time import monotonic
+
+import aiohttp
+import orjson
+
+if t.TYPE_CHECKING:
+    from .models import GuildSettings, Profile
+
+log = logging.getLogger("red.vrt.levelup.importer")
+
+HEADERS = {"Accept": "application/json", "User-Agent": "Mozilla/5.0"}
+
+
+class ImportFailed(Exception):
+    """Raised when a page of leaderboard data couldn't be fetched
+
+    Args:
+        page (int): The page that failed, everything before it was delivered
+        status (int): The HTTP status of the last attempt, 0 if the request never got a response
+        message (str): The error returned by the API, if any
+    """
+
+    def __init__(self, page: int, status: int, message: str = ""):
+        super().__init__(f"Page {page} failed with status {status}: {message}")
+        self.page = page
+        self.status = status
+        self.message = message
+
+
+@dataclass(frozen=True)
+class Player:
+    id: int
+    level: int
+    xp: float
+    weekly_xp: float
+
+
+@dataclass(frozen=True)
+class Source:
+    """A bot leaderboard API to import from
+
+    Args:
+        name (str): Name of the bot, used for checkpoints and logs
+        url (str): Page URL, formatted with `guild_id` and `page`
+        players_key (str): Key of the player list in each page
+        weekly (bool): Whether players come with weekly XP
+        max_pages (int): Stop after this many pages, 0 to go until an empty page
+        end_statuses (t.Tuple[int, ...]): Statuses that mean there are no more pages
+    """
+
+    name: str
+    url: str
+    players_key: str
+    weekly: bool = False
+    max_pages: int = 0
+    end_statuses: t.Tuple[int, ...] = ()
+
+    def parse(self, data: dict) -> t.List[Player]:
+        return [
+            Player(
+                id=int(i["id"]),
+                level=int(i.get("level", 0)),
+                xp=float(i.get("xp", i.get("exp", 0))),
+                weekly_xp=float(i.get("weeklyExp", 0)),
+            )
+            for i in data.get(self.players_key) or []
+        ]
+
+
+MEE6 = Source(
+    name="mee6",
+    url="https://mee6.xyz/api/plugins/levels/leaderboard/{guild_id}?page={page}&limit=1000",
+    players_key="players",
+)
+POLARIS = Source(
+    name="polaris",
+    url="https://gdcolon.com/polaris/api/leaderboard/{guild_id}?page={page}",
+    players_key="leaderboard",
+    max_pages=10,
+)
+AMARI = Source(
+    name="amari",
+    url="https://amaribot.com/api/v1/guild/leaderboard/{guild_id}?page={page}&limit=1000",
+    players_key="data",
+    weekly=True,
+    end_statuses=(501,),
+)
+
+
+class RateLimiter:
+    """Caps requests in flight, and holds every request back once the API says to slow down"""
+
+    def __init__(self, concurrency: int):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.resume_at = 0.0
+
+    def pause(self, seconds: float) -> None:
+        self.resume_at = max(self.resume_at, monotonic() + seconds)
+
+    async def __aenter__(self) -> None:
+        await self.semaphore.acquire()
+        while (delay := self.resume_at - monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    async def __aexit__(self, *_) -> None:
+        self.semaphore.release()
+
+
+class LeaderboardImporter:
+    """Fetch a leaderboard page by page, with a few pages in flight at once
+
+    Pages are handed over in order as they arrive, so only `concurrency` pages are ever held in memory.
+    Rate limits pause all requests for as long as the API asks (or with exponential backoff if it doesn't say),
+    and a page that still fails after `retries` attempts raises `ImportFailed` so the import can resume from it.
+
+    Args:
+        source (Source): The API to import from
+        guild_id (int): The guild to import
+        api_key (str, optional): Sent as the Authorization header. Defaults to None.
+        concurrency (int, optional): Pages fetched at once. Defaults to 3.
+        retries (int, optional): Attempts per page. Defaults to 6.
+    """
+
+    def __init__(
+        self,
+        source: Source,
+        guild_id: int,
+        api_key: t.Optional[str] = None,
+        concurrency: int = 3,
+        retries: int = 6,
+    ):
+        self.source = source
+        self.guild_id = guild_id
+        self.headers = {**HEADERS, "Authorization": api_key} if api_key else HEADERS
+        self.concurrency = concurrency
+        self.retries = retries
+        self.limiter = RateLimiter(concurrency)
+
+    async def pages(self, start_page: int = 0) -> t.AsyncIterator[t.Tuple[int, dict, t.List[Player]]]:
+        """Yield (page, raw data, players) in page order, starting from `start_page`"""
+        timeout = aiohttp.ClientTimeout(total=60)
+        async with aiohttp.ClientSession(timeout=timeout, headers=self.headers) as session:
+            pending: t.Dict[int, asyncio.Task] = {}
+            next_page = start_page
+            page = start_page
+            try:
+                while True:
+                    # Keep the window full
+                    while len(pending) < self.concurrency and (
+                        not self.source.max_pages or next_page < self.source.max_pages
+                    ):
+                        pending[next_page] = asyncio.create_task(self.fetch(session, next_page))
+                        next_page += 1
+                    if page not in pending:
+                        return
+                    data = await pending.pop(page)
+                    if data is None:
+                        return
+                    players = self.source.parse(data)
+                    if not players:
+                        return
+                    yield page, data, players
+                    page += 1
+            finally:
+                # Pages past the end (or past a failure) are no longer needed
+                for task in pending.values():
+                    if task.done() and not task.cancelled():
+                        task.exception()
+                    task.cancel()
+
+    async def fetch(self, session: aiohttp.ClientSession, page: int) -> t.Optional[dict]:
+        """Fetch a single page, returns None if the API says there are no more pages"""
+        url = self.source.url.format(guild_id=self.guild_id, page=page)
+        status = 0
+        for attempt in range(self.retries):
+            # Jittered so pages in flight don't all retry at the same moment
+            backoff = min(600, 10 * 2**attempt) * random.uniform(0.8, 1.2)
+            try:
+                async with self.limiter, session.get(url) as res:
+                    status = res.status
+                    retry_after = res.headers.get("Retry-After")
+                    raw = await res.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log.warning(f"{self.source.name} page {page} request failed, retrying in {round(backoff)}s: {e}")
+                await asyncio.sleep(backoff)
+                continue
+            if status in self.source.end_statuses:
+                return None
+            try:
+                data = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                # These APIs serve an HTML error page when rate limiting heavily
+                data = None
+            if status == 429 or data is None:
+                try:
+                    wait = float(retry_after) if retry_after else backoff
+                except ValueError:
+                    wait = backoff
+                log.warning(f"{self.source.name} import is being rate limited! Waiting {round(wait)}s")
+                self.limiter.pause(wait)
+                continue
+            if status != 200:
+                error = data.get("error") if isinstance(data, dict) else None
+                message = error.get("message", "") if isinstance(error, dict) else str(error or "")
+                raise ImportFailed(page, status, message)
+            return data
+        raise ImportFailed(page, status, "Rate limited")
+
+
+def apply_players(
+    conf: "GuildSettings",
+    players: t.List[Player],
+    import_by: t.Literal["level", "exp"],
+    replace: bool,
+    weekly: bool = False,
+) -> None:
+    """Apply a page of imported players to their profiles
+
+    When importing by XP, the levels of the whole page are worked out in one go.
+
+    Args:
+        import_by (t.Literal["level", "exp"]): Import their level and calculate XP from it, or the other way around
+        replace (bool): Replace existing stats instead of adding to them
+        weekly (bool, optional): Import weekly XP too, if weekly stats are on. Defaults to False.
+    """
+    changed: t.List["Profile"] = []
+    for player in players:
+        profile = conf.get_profile(player.id)
+        if import_by == "level":
+            if replace:
+                profile.level = player.level
+                profile.xp = conf.algorithm.get_xp(player.level)
+            elif player.level:
+                profile.level += player.level
+                profile.xp = conf.algorithm.get_xp(profile.level)
+        elif replace:
+            profile.xp = player.xp
+            changed.append(profile)
+        elif player.xp:
+            profile.xp += player.xp
+            changed.append(profile)
+
+        if weekly and conf.weeklysettings.on:
+            weekly_profile = conf.get_weekly_profile(player.id)
+            if replace:
+                weekly_profile.xp = player.weekly_xp
+            else:
+                weekly_profile.xp += player.weekly_xp
+
+    for profile, level in zip(changed, conf.algorithm.get_levels([profile.xp for profile in changed])):
+        profile.level = level
+
+
+def load_checkpoint(path: Path) -> t.Optional[t.Dict[str, t.Any]]:
+    if not path.exists():
+        return None
+    try:
+        return orjson.loads(path.read_bytes())
+    except orjson.JSONDecodeError:
+        log.warning(f"Import checkpoint {path.name} is corrupt, ignoring it")
+        return None
+
+
+def save_checkpoint(path: Path, checkpoint: t.Dict[str, t.Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(orjson.dumps(checkpoint))
+    tmp.replace(path)
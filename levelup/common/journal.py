@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import typing as t
+from pathlib import Path
+
+import orjson
+
+from .models import DB, Profile, ProfileWeekly
+
+log = logging.getLogger("red.vrt.levelup.journal")
+
+# Never compact a journal smaller than this, even if the snapshot is tiny
+MIN_COMPACT_BYTES = 4 * 1024 * 1024  # 4MB
+
+# (guild_id, kind, user_id, payload)
+Record = t.Tuple[int, str, int, t.Any]
+
+
+class Journal:
+    """Append-only log of profile changes layered on top of the LevelUp.json snapshot
+
+    Saving the whole DB means serializing every profile of every guild, which gets expensive on large bots.
+    Instead, profiles that were touched since the last save are appended to the journal as one line each,
+    so a save only costs as much as the amount of changes. Once the journal outgrows the snapshot it gets
+    compacted, meaning a fresh snapshot is written and the journal is truncated.
+
+    On startup the journal is replayed on top of the snapshot to restore any changes made after it was written.
+    """
+
+    def __init__(self, path: Path, snapshot: Path):
+        self.path = path
+        self.snapshot = snapshot
+        self.size: int = path.stat().st_size if path.exists() else 0
+        self.snapshot_size: int = snapshot.stat().st_size if snapshot.exists() else 0
+        self.compact_pending: bool = False
+
+    @property
+    def should_compact(self) -> bool:
+        return self.compact_pending or self.size > max(MIN_COMPACT_BYTES, self.snapshot_size)
+
+    def collect(self, db: DB) -> t.List[Record]:
+        """Pop dirty profiles from all guilds, must be called from the event loop
+
+        Profiles are only looked up here, serialization happens in `write` which runs in a thread.
+        """
+        records: t.List[Record] = []
+        for guild_id, conf in db.configs.items():
+            dirty, dirty_weekly = conf.pop_dirty()
+            if not dirty and not dirty_weekly:
+                continue
+            for user_id in dirty:
+                records.append((guild_id, "users", user_id, conf.users.get(user_id)))
+            for user_id in dirty_weekly:
+                records.append((guild_id, "users_weekly", user_id, conf.users_weekly.get(user_id)))
+            # Role groups are tallied on every message so we tag them along with the guild's profiles
+            if conf.role_groups:
+                records.append((guild_id, "role_groups", 0, conf.role_groups.copy()))
+        return records
+
+    def write(self, records: t.List[Record]) -> None:
+        """Serialize and append records to the journal"""
+        lines = []
+        for guild_id, kind, user_id, obj in records:
+            if isinstance(obj, (Profile, ProfileWeekly)):
+                obj = obj.dump()
+            record = {"g": guild_id, "t": kind, "u": user_id, "d": obj}
+            lines.append(orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS))
+        lines.append(b"")
+        with self.path.open(mode="ab") as fs:
+            fs.write(b"\n".join(lines))
+            fs.flush()
+            os.fsync(fs.fileno())
+            self.size = fs.tell()
+
+    def replay(self, db: DB) -> int:
+        """Apply the journal on top of a freshly loaded snapshot
+
+        Returns:
+            int: The number of records applied
+        """
+        if not self.path.exists():
+            return 0
+        applied = 0
+        with self.path.open(mode="rb") as fs:
+            for line in fs:
+                if not line.strip():
+                    continue
+                try:
+                    record: dict = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # Most likely a partially written line from a crash
+                    log.warning(f"Skipping corrupt journal record after #{applied}")
+                    continue
+                conf = db.get_conf(record["g"])
+                kind, user_id, data = record["t"], record["u"], record["d"]
+                if kind == "role_groups":
+                    conf.role_groups = {int(k): v for k, v in data.items()}
+                elif kind == "users":
+                    if data is None:
+                        conf.users.pop(user_id, None)
+                    else:
+                        conf.users[user_id] = Profile.load(data)
+                elif kind == "users_weekly":
+                    if data is None:
+                        conf.users_weekly.pop(user_id, None)
+                    else:
+                        conf.users_weekly[user_id] = ProfileWeekly.load(data)
+                applied += 1
+        return applied
+
+    def truncate(self) -> None:
+        with self.path.open(mode="wb") as fs:
+            fs.flush()
+            os.fsync(fs.fileno())
+        self.size = 0
+
+    async def commit(self, db: DB) -> int:
+        """Append all dirty profiles to the journal
+
+        Returns:
+            int: The number of records written
+        """
+        records = self.collect(db)
+        if not records:
+            return 0
+        try:
+            await asyncio.to_thread(self.write, records)
+        except Exception:
+            # The dirty marks are gone, fall back to a full snapshot on the next save
+            self.compact_pending = True
+            raise
+        return len(records)
+
+    async def compact(self, db: DB) -> None:
+        """Write a full snapshot and truncate the journal"""
+        # Everything dirty up to this point will be included in the snapshot
+        for conf in db.configs.values():
+            conf.pop_dirty()
+        self.compact_pending = False
+
+        def _compact():
+            db.to_file(self.snapshot)
+            self.truncate()
+            self.snapshot_size = self.snapshot.stat().st_size
+
+        try:
+            await asyncio.to_thread(_compact)
+        except Exception:
+            # Try again on the next save so nothing that was marked dirty gets lost
+            self.compact_pending = True
+            raise
@@ -0,0 +1,169 @@
+import threading
+import typing as t
+from bisect import bisect_left
+from time import monotonic
+
+import discord
+from redbot.core.bot import Red
+
+from . import formatter
+from .models import DB
+from .ranks import LBType, RankIndex
+
+# Seconds a snapshot is served before it's rebuilt
+TTL = 60.0
+# Rebuild early once the stat total drifts this far (fraction) from the snapshot, so big XP changes show up
+DRIFT = 0.01
+# Most entries a single page can hold
+MAX_PER_PAGE = 1000
+# Most distinct snapshots kept, least recently built are dropped first
+MAX_SNAPSHOTS = 128
+# Dashboard stat names to profile attributes
+STAT_KEYS = {"exp": "xp", "messages": "messages", "voice": "voice", "stars": "stars"}
+
+
+class LeaderboardSnapshot:
+    """A guild leaderboard frozen at one point in time, with the names of everyone on it indexed for search
+
+    Rows are kept raw and only the requested page is formatted, so serving a page costs the page size
+    instead of the guild size.
+    """
+
+    def __init__(self, key: t.Tuple[int, LBType, str], index: RankIndex, payload: dict, guild: discord.Guild):
+        self.key = key
+        self.index = index
+        self.built = monotonic()
+        self.total = index.total
+        self.size = len(index)
+        self.title: str = payload["title"]
+        self.description: str = payload["description"]
+        self.statname: str = payload["stat"]
+        self.stat_key: str = payload["key"]
+        self.rows: t.List[t.Tuple[int, float]] = payload["rows"]
+        self.positions: t.Dict[int, int] = {user_id: idx for idx, (user_id, _) in enumerate(self.rows)}
+        self.names: t.List[str] = []
+        # Casefolded display names and usernames, sorted so a prefix search is a bisect, with the row of each
+        names: t.List[str] = []
+        rows: t.List[int] = []
+        get_member = guild.get_member
+        for idx, (user_id, _) in enumerate(self.rows):
+            member = get_member(user_id)
+            if member is None:
+                self.names.append(str(user_id))
+                continue
+            display_name, name = member.display_name, member.name
+            self.names.append(display_name)
+            names.append(display_name.casefold())
+            rows.append(idx)
+            if name != display_name:
+                names.append(name.casefold())
+                rows.append(idx)
+        order = sorted(range(len(names)), key=names.__getitem__)
+        self.name_keys: t.List[str] = [names[i] for i in order]
+        self.name_rows: t.List[int] = [rows[i] for i in order]
+
+    def stale(self, index: RankIndex) -> bool:
+        if index is not self.index or monotonic() - self.built > TTL:
+            return True
+        if len(index) != self.size:
+            return True
+        return abs(index.total - self.total) > max(1, self.total * DRIFT)
+
+    def search(self, query: str) -> t.List[int]:
+        """Rows matching a query, in leaderboard order
+
+        `#5` matches a position, a number matches a user ID or position, anything else is a name prefix.
+        """
+        query = query.strip()
+        if query.startswith("#") and query[1:].isdigit():
+            idx = int(query[1:]) - 1
+            return [idx] if 0 <= idx < len(self.rows) else []
+        if query.isdigit():
+            matches = set()
+            if (idx := self.positions.get(int(query))) is not None:
+                matches.add(idx)
+            if 0 < int(query) <= len(self.rows):
+                matches.add(int(query) - 1)
+            return sorted(matches)
+        prefix = query.casefold()
+        matches = set()
+        for i in range(bisect_left(self.name_keys, prefix), len(self.name_keys)):
+            if not self.name_keys[i].startswith(prefix):
+                break
+            matches.add(self.name_rows[i])
+        return sorted(matches)
+
+    def page(
+        self,
+        db: DB,
+        page: int,
+        per_page: int,
+        query: t.Optional[str] = None,
+    ) -> t.Dict[str, t.Any]:
+        """Format one page of the leaderboard, optionally filtered by a search query
+
+        Returns:
+            t.Dict[str, t.Any]: The page's entries, the clamped page number, the page count and the match count
+        """
+        per_page = max(1, min(per_page, MAX_PER_PAGE))
+        rows = self.search(query) if query else None
+        count = len(self.rows) if rows is None else len(rows)
+        pages = max(1, -(-count // per_page))
+        page = max(1, min(page, pages))
+        start = (page - 1) * per_page
+        selected = range(start, min(start + per_page, count)) if rows is None else rows[start : start + per_page]
+        conf = db.get_conf(self.key[0])
+        lbtype = self.key[1]
+        stats = []
+        for idx in selected:
+            user_id, value = self.rows[idx]
+            stat = formatter.format_stat(conf, lbtype, self.stat_key, False, user_id, value)
+            stats.append({"position": idx + 1, "name": self.names[idx], "id": user_id, "stat": stat})
+        return {"stats": stats, "page": page, "pages": pages, "count": count, "per_page": per_page}
+
+
+class LeaderboardCache:
+    """Leaderboard snapshots for the dashboard, one per (guild, leaderboard type, stat)
+
+    Snapshots are served until they're `TTL` seconds old, the rank index is rebuilt (resets, restores, imports,
+    settings changes), members join or leave, or the stat total moves by more than `DRIFT`. Calls are blocking and
+    meant to be run in a thread.
+    """
+
+    def __init__(self):
+        self.snapshots: t.Dict[t.Tuple[int, LBType, str], LeaderboardSnapshot] = {}
+        self.locks: t.Dict[t.Tuple[int, LBType, str], threading.Lock] = {}
+        self.lock = threading.Lock()
+        self.built = 0
+        self.served = 0
+
+    def get(self, bot: Red, guild: discord.Guild, db: DB, lbtype: LBType, stat: str) -> LeaderboardSnapshot:
+        key = (guild.id, lbtype, STAT_KEYS[stat])
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+        # One build per snapshot at a time, requests that arrive during a build get its result
+        with lock:
+            index = db.get_conf(guild).get_rank_index(guild, lbtype, key[2])
+            snapshot = self.snapshots.get(key)
+            if snapshot is not None and not snapshot.stale(index):
+                self.served += 1
+                return snapshot
+            payload = formatter.get_leaderboard(
+                bot=bot,
+                guild=guild,
+                db=db,
+                stat=stat,
+                lbtype=lbtype,
+                is_global=False,
+                use_displayname=True,
+                dashboard=True,
+                with_stats=False,
+            )
+            snapshot = LeaderboardSnapshot(key, index, payload, guild)
+            with self.lock:
+                self.snapshots.pop(key, None)
+                if len(self.snapshots) >= MAX_SNAPSHOTS:
+                    self.snapshots.pop(next(iter(self.snapshots)))
+                self.snapshots[key] = snapshot
+            self.built += 1
+            return snapshot
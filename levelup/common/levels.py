@@ -0,0 +1,111 @@
+import math
+import typing as t
+from bisect import bisect_right
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Thresholds are only kept for levels this low, anything past it (tiny exponents) is worked out directly
+MAX_LEVELS = 100_000
+# Distinct curves kept, most guilds share the default one
+MAX_TABLES = 256
+
+
+class LevelTable:
+    """XP thresholds for every level of a `base * level ^ exp` curve, so finding a level is a bisect
+
+    The table grows as higher XP values are looked up. A level is reached once its threshold from `get_xp` is met,
+    so `get_level(get_xp(n)) == n` holds at every boundary, where inverting the curve with a float power could land
+    a level short.
+
+    Args:
+        base (int): Base denominator of the curve
+        exp (float): Exponent of the curve
+    """
+
+    def __init__(self, base: int, exp: float):
+        self.base = base
+        self.exp = exp
+        # Index is the level, value is the XP needed to reach it
+        self.thresholds: t.List[int] = [0]
+        self.array: t.Optional["np.ndarray"] = None
+
+    @classmethod
+    def get(cls, base: int, exp: float) -> "LevelTable":
+        """The shared table for a curve, built the first time it's used"""
+        table = TABLES.get((base, exp))
+        if table is None:
+            if len(TABLES) >= MAX_TABLES:
+                TABLES.clear()
+            table = TABLES[(base, exp)] = cls(base, exp)
+        return table
+
+    def xp(self, level: int) -> int:
+        return math.ceil(self.base * (level**self.exp))
+
+    def extend(self, xp: float) -> bool:
+        """Grow the table until it covers `xp`, returns False if that would take more than `MAX_LEVELS` levels"""
+        while self.thresholds[-1] <= xp:
+            size = len(self.thresholds)
+            if size >= MAX_LEVELS:
+                return False
+            self.thresholds.extend(self.xp(level) for level in range(size, min(size * 2, MAX_LEVELS)))
+            self.array = None
+        return True
+
+    def get_xp(self, level: int) -> int:
+        if 0 <= level < len(self.thresholds):
+            return self.thresholds[level]
+        return self.xp(level)
+
+    def get_level(self, xp: t.Union[int, float]) -> int:
+        if xp < self.thresholds[-1] or self.extend(xp):
+            return max(0, bisect_right(self.thresholds, xp) - 1)
+        return self.solve(xp)
+
+    def solve(self, xp: t.Union[int, float]) -> int:
+        """Invert the curve directly, then step to the exact boundary the float power may have missed"""
+        guess = int((xp / self.base) ** (1 / self.exp))
+        # Widen around the guess until the boundary is inside, then bisect down to it
+        low, high, step = guess, guess + 1, 1
+        while low > 0 and self.xp(low) > xp:
+            low, step = max(0, low - step), step * 2
+        step = 1
+        while self.xp(high) <= xp:
+            high, step = high + step, step * 2
+        while high - low > 1:
+            mid = (low + high) // 2
+            if self.xp(mid) <= xp:
+                low = mid
+            else:
+                high = mid
+        return low
+
+    def get_levels(self, xps: t.Sequence[t.Union[int, float]]) -> t.List[int]:
+        """Levels for many XP values at once, vectorized if NumPy is available"""
+        if not xps:
+            return []
+        highest = max(xps)
+        covered = self.extend(highest)
+        if np is None or highest >= 2**53:
+            # Past 2^53 floats can't tell neighbouring XP values apart
+            return [self.get_level(xp) for xp in xps]
+        if self.array is None:
+            self.array = np.asarray(self.thresholds, dtype=np.float64)
+        values = np.asarray(xps, dtype=np.float64)
+        levels = np.maximum(np.searchsorted(self.array, values, side="right") - 1, 0).tolist()
+        if not covered:
+            top = len(self.thresholds) - 1
+            levels = [self.solve(xp) if level >= top else level for xp, level in zip(xps, levels)]
+        return levels
+
+    def get_xps(self, levels: t.Sequence[int]) -> t.List[int]:
+        """XP needed for many levels at once"""
+        if levels:
+            self.extend(self.xp(min(max(levels), MAX_LEVELS - 1)))
+        return [self.get_xp(level) for level in levels]
+
+
+TABLES: t.Dict[t.Tuple[int, float], LevelTable] = {}
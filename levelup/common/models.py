@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import logging
-import math
 import os
 import typing as t
 from contextlib import suppress
@@ -11,9 +10,12 @@ from uuid import uuid4
 
 import discord
 import orjson
-from pydantic import VERSION, BaseModel, Field
+from pydantic import VERSION, BaseModel, Field, PrivateAttr
 from redbot.core.bot import Red
 
+from .levels import LevelTable
+from .ranks import GuildRanks, LBType, RankIndex
+from .rules import MessageRules
 from .utils import get_twemoji
 
 log = logging.getLogger("red.vrt.levelup.models")
@@ -34,10 +36,10 @@ class Base(BaseModel):
             return cls.model_validate_json(obj)
         return cls.parse_raw(obj)
 
-    def dump(self, exclued_defaults: bool = True) -> t.Dict[str, t.Any]:
+    def dump(self, exclued_defaults: bool = True, exclude: t.Optional[t.Set[str]] = None) -> t.Dict[str, t.Any]:
         if VERSION >= "2.0.1":
-            return super().model_dump(mode="json", exclude_defaults=exclued_defaults)
-        return orjson.loads(self.json(exclude_defaults=exclued_defaults))
+            return super().model_dump(mode="json", exclude_defaults=exclued_defaults, exclude=exclude)
+        return orjson.loads(self.json(exclude_defaults=exclued_defaults, exclude=exclude))
 
     def dumpjson(self, exclude_defaults: bool = True, pretty: bool = False) -> str:
         kwargs = {"exclude_defaults": exclude_defaults}
@@ -235,11 +237,15 @@ class Algorithm(Base):
 
     def get_level(self, xp: t.Union[int, float]) -> int:
         """Calculate the level that corresponds to the given XP amount"""
-        return int((xp / self.base) ** (1 / self.exp))
+        return LevelTable.get(self.base, self.exp).get_level(xp)
 
     def get_xp(self, level: int) -> int:
         """Calculate XP required to reach specified level"""
-        return math.ceil(self.base * (level**self.exp))
+        return LevelTable.get(self.base, self.exp).get_xp(level)
+
+    def get_levels(self, xps: t.Sequence[t.Union[int, float]]) -> t.List[int]:
+        """Calculate the levels for many XP amounts at once"""
+        return LevelTable.get(self.base, self.exp).get_levels(xps)
 
 
 class Emojis(Base):
@@ -336,25 +342,69 @@ class GuildSettings(Base):
     starmention: bool = False  # Mention when users add a star
     starmentionautodelete: int = 0  # Auto delete star mention reactions (0 to disable)
 
+    # Non-config, IDs of profiles fetched since the last save that need to be journaled
+    _dirty: t.Set[int] = PrivateAttr(default_factory=set)
+    _dirty_weekly: t.Set[int] = PrivateAttr(default_factory=set)
+    # Non-config, leaderboard indexes
+    _ranks: GuildRanks = PrivateAttr(default_factory=GuildRanks)
+    # Non-config, compiled message eligibility rules
+    _rules: t.Optional[MessageRules] = PrivateAttr(default=None)
+
     def get_profile(self, user: t.Union[discord.Member, int]) -> Profile:
         uid = user if isinstance(user, int) else user.id
+        self._dirty.add(uid)
+        self._ranks.touch(uid)
         return self.users.setdefault(uid, Profile())
 
     def get_weekly_profile(self, user: t.Union[discord.Member, int]) -> ProfileWeekly:
         uid = user if isinstance(user, int) else user.id
+        self._dirty_weekly.add(uid)
+        self._ranks.touch(uid, weekly=True)
         return self.users_weekly.setdefault(uid, ProfileWeekly())
 
+    def get_rank_index(self, guild: discord.Guild, lbtype: LBType, key: str) -> RankIndex:
+        """Get the leaderboard index of a stat, only current members of the guild are ranked"""
+        return self._ranks.get(guild, self, lbtype, key)
+
+    def refresh_rank(self, user_id: int) -> None:
+        """Re-rank a user on the next leaderboard query, used when members join or leave or their stats change"""
+        self._ranks.touch(user_id)
+        self._ranks.touch(user_id, weekly=True)
+
+    def get_rules(self) -> MessageRules:
+        if self._rules is None:
+            self._rules = MessageRules(self)
+        return self._rules
+
+    def invalidate_caches(self) -> None:
+        """Drop everything derived from the settings, called whenever the settings change"""
+        self._ranks.invalidate()
+        self._rules = None
+
+    def pop_dirty(self) -> t.Tuple[t.Set[int], t.Set[int]]:
+        """Return and reset the IDs of profiles that changed since the last save"""
+        dirty, dirty_weekly = self._dirty, self._dirty_weekly
+        self._dirty, self._dirty_weekly = set(), set()
+        # They may have changed after a leaderboard query already re-ranked them
+        self._ranks.touch_many(dirty, dirty_weekly)
+        return dirty, dirty_weekly
+
 
 class DB(Base):
     configs: t.Dict[int, GuildSettings] = {}
     ignored_guilds: t.List[int] = []
     cache_seconds: int = 0  # How long generated profile images should be cached, 0 to disable
     render_gifs: bool = False  # Whether to render profiles as gifs
+    gif_max_frames: int = 100  # Animated profiles are decimated to this many frames, 0 for no limit
+    gif_max_mb: int = 8  # Animated profiles drop frames until they fit this size, 0 for no limit
     force_embeds: bool = False  # Globally force embeds for leveling
     internal_api_port: int = 0  # If specified, starts internal api subprocess
     external_api_url: str = ""  # If specified, overrides internal api
+    external_api_urls: t.List[str] = []  # More external apis, balanced along with external_api_url
+    render_workers: int = 0  # Processes in the built-in render pool, 0 to disable
     auto_cleanup: bool = False  # If True, will clean up configs of old guilds
     ignore_bots: bool = True  # Ignore bots completely
+    batch_xp: bool = False  # Queue message XP and process level ups in batches
 
     def get_conf(self, guild: t.Union[discord.Guild, int]) -> GuildSettings:
         gid = guild if isinstance(guild, int) else guild.id
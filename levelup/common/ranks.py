@@ -0,0 +1,148 @@
+import threading
+import typing as t
+
+import discord
+from sortedcontainers import SortedList
+
+if t.TYPE_CHECKING:
+    from .models import GuildSettings, Profile, ProfileWeekly
+
+LBType = t.Literal["lb", "weekly"]
+STATS = ("xp", "messages", "voice", "stars")
+
+
+class RankIndex:
+    """Sorted index of a single stat for the members of a guild
+
+    Entries are stored as (-value, user_id) so the first entry is the top of the leaderboard
+    and ties are broken by user ID.
+    """
+
+    def __init__(self, values: t.Dict[int, float]):
+        self.values: t.Dict[int, float] = values
+        self.entries = SortedList((-value, user_id) for user_id, value in values.items())
+        self.total: float = sum(values.values())
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def set(self, user_id: int, value: float) -> None:
+        old = self.values.get(user_id)
+        if old == value:
+            return
+        if old is not None:
+            self.entries.remove((-old, user_id))
+            self.total -= old
+        self.entries.add((-value, user_id))
+        self.values[user_id] = value
+        self.total += value
+
+    def discard(self, user_id: int) -> None:
+        old = self.values.pop(user_id, None)
+        if old is None:
+            return
+        self.entries.remove((-old, user_id))
+        self.total -= old
+
+    def rank(self, user_id: int) -> int:
+        """1 based position of a user, or -1 if they aren't ranked"""
+        value = self.values.get(user_id)
+        if value is None:
+            return -1
+        return self.entries.bisect_left((-value, user_id)) + 1
+
+    def positive(self) -> int:
+        """Number of members with a stat above zero, they are always at the top of the index"""
+        return self.entries.bisect_left((0,))
+
+    def page(self, start: int, stop: int) -> t.List[t.Tuple[int, float]]:
+        return [(user_id, -value) for value, user_id in self.entries[start:stop]]
+
+
+class GuildRanks:
+    """Leaderboard indexes of a guild, built on first use and kept up to date as profiles get touched
+
+    Profiles fetched through `GuildSettings.get_profile` are marked as pending and are re-ranked the next time
+    any of the guild's indexes is queried, so keeping the indexes current costs O(log n) per touched profile
+    instead of a full sort on every leaderboard request. A profile can change after it was fetched (across an
+    await), so profiles are marked again when XP is applied and once more when they're saved.
+    """
+
+    def __init__(self):
+        # Only held for O(touched) work, never for a full rebuild, since `touch` takes it on the event loop
+        self.lock = threading.Lock()
+        self.indexes: t.Dict[t.Tuple[LBType, str], RankIndex] = {}
+        self.pending: t.Set[int] = set()
+        self.pending_weekly: t.Set[int] = set()
+        # Bumped on invalidation so an index built from before it isn't kept
+        self.generation = 0
+
+    def touch(self, user_id: int, weekly: bool = False) -> None:
+        with self.lock:
+            if weekly:
+                self.pending_weekly.add(user_id)
+            else:
+                self.pending.add(user_id)
+
+    def touch_many(self, user_ids: t.Set[int], weekly_ids: t.Set[int]) -> None:
+        with self.lock:
+            self.pending |= user_ids
+            self.pending_weekly |= weekly_ids
+
+    def invalidate(self) -> None:
+        """Drop all indexes, used after bulk changes like resets, imports or algorithm changes"""
+        with self.lock:
+            self.indexes.clear()
+            self.pending.clear()
+            self.pending_weekly.clear()
+            self.generation += 1
+
+    def get(self, guild: discord.Guild, conf: "GuildSettings", lbtype: LBType, key: str) -> RankIndex:
+        """Get an up to date index for a stat of the guild's leaderboard or weekly leaderboard
+
+        Only profiles of current guild members are ranked. Building a missing index is O(n), so it happens
+        outside of the lock and is only swapped in once done.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, set()
+            pending_weekly, self.pending_weekly = self.pending_weekly, set()
+            for (index_type, index_key), index in self.indexes.items():
+                profiles = conf.users_weekly if index_type == "weekly" else conf.users
+                for user_id in pending_weekly if index_type == "weekly" else pending:
+                    profile = profiles.get(user_id)
+                    if profile is None or not guild.get_member(user_id):
+                        index.discard(user_id)
+                    else:
+                        index.set(user_id, get_stat(conf, profile, index_type, index_key))
+            index = self.indexes.get((lbtype, key))
+            generation = self.generation
+        if index is not None:
+            return index
+
+        # Profiles touched while this runs stay pending and are applied to the new index on the next query
+        profiles = conf.users_weekly if lbtype == "weekly" else conf.users
+        values = {
+            user_id: get_stat(conf, profile, lbtype, key)
+            for user_id, profile in list(profiles.items())
+            if guild.get_member(user_id)
+        }
+        index = RankIndex(values)
+        with self.lock:
+            if generation != self.generation:
+                # Invalidated during the build, serve it this once without keeping it
+                return index
+            # Another thread may have finished the same build first
+            return self.indexes.setdefault((lbtype, key), index)
+
+
+def get_stat(
+    conf: "GuildSettings",
+    profile: t.Union["Profile", "ProfileWeekly"],
+    lbtype: LBType,
+    key: str,
+) -> float:
+    """Value a profile is ranked by, lifetime XP includes the XP spent on prestiges"""
+    value = getattr(profile, key)
+    if key == "xp" and lbtype == "lb" and conf.prestigelevel and conf.prestigedata and profile.prestige:
+        value += profile.prestige * conf.algorithm.get_xp(conf.prestigelevel)
+    return value
@@ -0,0 +1,417 @@
+import asyncio
+import logging
+import typing as t
+from bisect import bisect_right
+from collections import Counter, deque
+from dataclasses import dataclass
+from pathlib import Path
+from time import monotonic
+
+import discord
+
+from . import importer
+
+if t.TYPE_CHECKING:
+    from .models import GuildSettings, Profile
+
+log = logging.getLogger("red.vrt.levelup.rolesync")
+
+Bucket = t.Tuple[int, int, bool]  # (level roles earned, prestige, weekly winner)
+Target = t.Tuple[t.FrozenSet[int], t.FrozenSet[int]]  # (roles to have, roles not to have)
+
+
+class RolePlan:
+    """The level, prestige and weekly roles every member of a guild should have, worked out once per bucket
+
+    Members only differ by how many level roles they've earned, their prestige and whether they won the last
+    weekly, so the roles wanted for each (level roles earned, prestige, winner) bucket are cached and every
+    member after the first in a bucket costs two set operations.
+
+    Roles that no longer exist or sit above the bot's top role are left out of the plan and listed in `bad`.
+
+    Args:
+        conf (GuildSettings): The guild's settings
+        guild (discord.Guild): The guild
+    """
+
+    def __init__(self, conf: "GuildSettings", guild: discord.Guild):
+        self.signature = self.signature_of(conf, guild)
+        levels = sorted(conf.levelroles)
+        self.thresholds: t.List[int] = levels
+        self.level_roles: t.List[int] = [conf.levelroles[i] for i in levels]
+        self.autoremove = conf.autoremove
+        self.prestigelevel = conf.prestigelevel
+        self.keep_level_roles = conf.keep_level_roles
+        self.prestige_roles: t.Dict[int, int] = {k: v.role for k, v in conf.prestigedata.items()}
+        self.stackprestigeroles = conf.stackprestigeroles
+        self.weekly_role: int = conf.weeklysettings.role or 0
+        winners = conf.weeklysettings.last_winners
+        if not conf.weeklysettings.role_all and winners:
+            winners = [winners[0]]
+        self.winners: t.FrozenSet[int] = frozenset(winners)
+
+        top = guild.me.top_role.position
+        managed = set(self.level_roles) | set(self.prestige_roles.values())
+        if self.weekly_role:
+            managed.add(self.weekly_role)
+        self.bad: t.Set[int] = set()
+        for role_id in managed:
+            role = guild.get_role(role_id)
+            if not role or role.position >= top:
+                self.bad.add(role_id)
+        self.targets: t.Dict[Bucket, Target] = {}
+
+    @staticmethod
+    def signature_of(conf: "GuildSettings", guild: discord.Guild) -> int:
+        """Changes whenever anything the plan depends on does, so a stale plan is never used"""
+        return hash(
+            (
+                tuple(sorted(conf.levelroles.items())),
+                tuple(sorted((k, v.role) for k, v in conf.prestigedata.items())),
+                conf.autoremove,
+                conf.prestigelevel,
+                conf.keep_level_roles,
+                conf.stackprestigeroles,
+                conf.weeklysettings.role,
+                conf.weeklysettings.role_all,
+                tuple(conf.weeklysettings.last_winners),
+                guild.me.top_role.position,
+                len(guild.roles),
+            )
+        )
+
+    def bucket(self, member_id: int, profile: "Profile") -> Bucket:
+        using_prestige = all([profile.prestige, self.prestigelevel, self.prestige_roles, self.keep_level_roles])
+        if using_prestige:
+            # User has prestiges and thus must meet the requirements for any level role inherently
+            earned = len(self.thresholds)
+        else:
+            earned = bisect_right(self.thresholds, profile.level)
+        return earned, profile.prestige, member_id in self.winners
+
+    def target(self, bucket: Bucket) -> Target:
+        if cached := self.targets.get(bucket):
+            return cached
+        earned, prestige, winner = bucket
+        want: t.Set[int] = set()
+        unwanted: t.Set[int] = set()
+
+        valid = self.level_roles[:earned]
+        if self.autoremove:
+            # Only the highest level role earned
+            highest = valid[-1] if valid else 0
+            if highest:
+                want.add(highest)
+            unwanted.update(i for i in self.level_roles if i != highest)
+        else:
+            want.update(valid)
+            unwanted.update(self.level_roles[earned:])
+
+        if prestige and self.prestige_roles:
+            if self.stackprestigeroles:
+                want.update(role for level, role in self.prestige_roles.items() if level <= prestige)
+            else:
+                for level, role in self.prestige_roles.items():
+                    if level == prestige:
+                        want.add(role)
+                    else:
+                        unwanted.add(role)
+
+        if self.weekly_role:
+            if winner:
+                want.add(self.weekly_role)
+            else:
+                unwanted.add(self.weekly_role)
+
+        target = (frozenset(want - self.bad), frozenset(unwanted - want - self.bad))
+        self.targets[bucket] = target
+        return target
+
+    def diff(self, member: discord.Member, profile: "Profile") -> t.Tuple[t.Set[int], t.Set[int]]:
+        """Role IDs to add and remove to bring a member in line with the plan"""
+        want, unwanted = self.target(self.bucket(member.id, profile))
+        current = {role.id for role in member.roles}
+        return want - current, unwanted & current
+
+
+class RoleSync:
+    """Bring every member of a guild in line with a `RolePlan`
+
+    Members are walked in ID order and only the ones whose roles differ are queued. Each change is a single
+    `member.edit(roles=...)` call instead of a call per role, sent by `concurrency` workers through a shared
+    `RateLimiter` that holds all of them back if Discord rate limits one. The diff is worked out again right
+    before the edit so a member whose roles changed while queued isn't clobbered.
+
+    Progress is checkpointed as the ID of the last member up to which everything is done, so a sync that gets
+    interrupted (restart, cog reload) can resume instead of walking the whole guild again.
+
+    Args:
+        guild (discord.Guild): The guild to sync
+        conf (GuildSettings): The guild's settings
+        plan (RolePlan): Target roles for the guild
+        reason (str): Audit log reason for the edits
+        checkpoint_file (Path): Where progress is saved
+        dry_run (bool, optional): Only count what would change. Defaults to False.
+        concurrency (int, optional): Edits in flight at once. Defaults to 2.
+        checkpoint_every (int, optional): Queued edits between checkpoints. Defaults to 250.
+    """
+
+    def __init__(
+        self,
+        guild: discord.Guild,
+        conf: "GuildSettings",
+        plan: RolePlan,
+        reason: str,
+        checkpoint_file: Path,
+        dry_run: bool = False,
+        concurrency: int = 2,
+        checkpoint_every: int = 250,
+    ):
+        self.guild = guild
+        self.conf = conf
+        self.plan = plan
+        self.reason = reason
+        self.checkpoint_file = checkpoint_file
+        self.dry_run = dry_run
+        self.concurrency = concurrency
+        self.checkpoint_every = checkpoint_every
+        self.limiter = importer.RateLimiter(concurrency)
+
+        self.last_id = 0
+        self.scanned = 0
+        self.changed = 0
+        self.failed = 0
+        self.added: t.Counter[int] = Counter()
+        self.removed: t.Counter[int] = Counter()
+        # Member ID: (added, removed), only filled on dry runs
+        self.preview: t.Dict[int, t.Tuple[t.Set[int], t.Set[int]]] = {}
+
+    def resume(self, checkpoint: t.Dict[str, t.Any]) -> None:
+        progress = checkpoint["progress"]
+        self.last_id = progress["last_id"]
+        self.scanned = progress["scanned"]
+        self.changed = progress["changed"]
+        self.failed = progress["failed"]
+        self.added = Counter({int(k): v for k, v in progress["added"].items()})
+        self.removed = Counter({int(k): v for k, v in progress["removed"].items()})
+
+    def checkpoint(self) -> t.Dict[str, t.Any]:
+        return {
+            "signature": self.plan.signature,
+            "progress": {
+                "last_id": self.last_id,
+                "scanned": self.scanned,
+                "changed": self.changed,
+                "failed": self.failed,
+                "added": {str(k): v for k, v in self.added.items()},
+                "removed": {str(k): v for k, v in self.removed.items()},
+            },
+        }
+
+    async def save_checkpoint(self) -> None:
+        await asyncio.to_thread(importer.save_checkpoint, self.checkpoint_file, self.checkpoint())
+
+    async def apply(self, member: discord.Member) -> bool:
+        profile = self.conf.users.get(member.id)
+        if profile is None:
+            return True
+        to_add, to_remove = self.plan.diff(member, profile)
+        if not to_add and not to_remove:
+            return True
+        roles = [role for role in member.roles if not role.is_default() and role.id not in to_remove]
+        roles.extend(role for role_id in to_add if (role := self.guild.get_role(role_id)))
+        for attempt in range(2):
+            try:
+                async with self.limiter:
+                    await member.edit(roles=roles, reason=self.reason)
+                self.added.update(to_add)
+                self.removed.update(to_remove)
+                return True
+            except discord.NotFound:
+                # Left the guild while queued
+                return True
+            except discord.HTTPException as e:
+                if e.status == 429 and not attempt:
+                    # discord.py already retried, back everyone off before trying once more
+                    self.limiter.pause(10)
+                    continue
+                log.warning(f"Failed to sync roles for {member} in {self.guild}: {e}")
+                return False
+        return False
+
+    async def run(self, on_progress: t.Optional[t.Callable[["RoleSync"], t.Awaitable[None]]] = None) -> None:
+        members = sorted((i for i in self.guild.members if i.id > self.last_id), key=lambda x: x.id)
+        queue: asyncio.Queue[t.Optional[discord.Member]] = asyncio.Queue(maxsize=self.concurrency * 4)
+        # Queued member IDs in order, with whether they're done, so the checkpoint never skips an unfinished edit
+        pending: t.Deque[t.List[t.Any]] = deque()
+        done: t.Dict[int, t.List[t.Any]] = {}
+        since_checkpoint = 0
+
+        def _advance() -> None:
+            while pending and pending[0][1]:
+                self.last_id = pending.popleft()[0]
+
+        async def _worker() -> None:
+            while (member := await queue.get()) is not None:
+                try:
+                    if not await self.apply(member):
+                        self.failed += 1
+                finally:
+                    done.pop(member.id)[1] = True
+                    _advance()
+
+        workers = [asyncio.create_task(_worker()) for _ in range(self.concurrency)] if not self.dry_run else []
+        last_update = monotonic()
+        try:
+            for idx, member in enumerate(members):
+                if not idx % 1000:
+                    # Diffing is cheap but a big guild is still a lot of members, let other tasks run
+                    await asyncio.sleep(0)
+                if on_progress and monotonic() - last_update > 5:
+                    last_update = monotonic()
+                    await on_progress(self)
+                self.scanned += 1
+                profile = self.conf.users.get(member.id)
+                to_add, to_remove = self.plan.diff(member, profile) if profile else (set(), set())
+                if not to_add and not to_remove:
+                    if pending:
+                        pending.append([member.id, True])
+                    else:
+                        self.last_id = member.id
+                    continue
+                self.changed += 1
+                if self.dry_run:
+                    self.added.update(to_add)
+                    self.removed.update(to_remove)
+                    self.preview[member.id] = (to_add, to_remove)
+                    self.last_id = member.id
+                    continue
+                entry = [member.id, False]
+                pending.append(entry)
+                done[member.id] = entry
+                await queue.put(member)
+                since_checkpoint += 1
+                if since_checkpoint >= self.checkpoint_every:
+                    since_checkpoint = 0
+                    _advance()
+                    await self.save_checkpoint()
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            _advance()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            if not self.dry_run:
+                await self.save_checkpoint()
+
+    def report(self) -> str:
+        """Per role counts of what was (or would be) added and removed"""
+        lines = []
+        for role_id in sorted(set(self.added) | set(self.removed), key=lambda x: -(self.added[x] + self.removed[x])):
+            role = self.guild.get_role(role_id)
+            name = role.name if role else str(role_id)
+            lines.append(f"{name} ({role_id}): +{self.added[role_id]} -{self.removed[role_id]}")
+        if not self.preview:
+            return "\n".join(lines)
+        lines.append("")
+        for member_id, (to_add, to_remove) in self.preview.items():
+            member = self.guild.get_member(member_id)
+            adds = ", ".join(f"+{getattr(self.guild.get_role(i), 'name', i)}" for i in to_add)
+            removes = ", ".join(f"-{getattr(self.guild.get_role(i), 'name', i)}" for i in to_remove)
+            lines.append(f"{member or member_id} ({member_id}): {' '.join(filter(None, [adds, removes]))}")
+        return "\n".join(lines)
+
+
+@dataclass
+class RoleChange:
+    """Roles to add to and remove from a member
+
+    Args:
+        member (discord.Member): The member
+        add (t.List[discord.Role]): Roles to add
+        remove (t.List[discord.Role]): Roles to remove
+        reason (str): Audit log reason
+    """
+
+    member: discord.Member
+    add: t.List[discord.Role]
+    remove: t.List[discord.Role]
+    reason: str
+
+
+class RoleQueue:
+    """Role changes that don't need to happen right away, applied in the background
+
+    One task works through the queue in batches, with every edit going through a shared `RateLimiter`. A burst of
+    changes (weekly resets for many guilds on the same hour) is paced instead of each caller awaiting its own.
+
+    Args:
+        concurrency (int, optional): Edits in flight at once. Defaults to 2.
+        batch_size (int, optional): Changes taken off the queue at a time. Defaults to 20.
+    """
+
+    def __init__(self, concurrency: int = 2, batch_size: int = 20):
+        self.batch_size = batch_size
+        self.limiter = importer.RateLimiter(concurrency)
+        self.queue: t.Optional[asyncio.Queue[RoleChange]] = None
+        self.task: t.Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    def put(self, member: discord.Member, add: t.List[discord.Role], remove: t.List[discord.Role], reason: str):
+        if not add and not remove:
+            return
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        self.queue.put_nowait(RoleChange(member, add, remove, reason))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.worker())
+
+    async def worker(self) -> None:
+        while not self.queue.empty():
+            batch = [self.queue.get_nowait() for _ in range(min(self.batch_size, self.queue.qsize()))]
+            await asyncio.gather(*(self.apply(change) for change in batch))
+
+    async def apply(self, change: RoleChange) -> None:
+        member = change.member
+        for attempt in range(2):
+            try:
+                async with self.limiter:
+                    if change.add:
+                        await member.add_roles(*change.add, reason=change.reason)
+                    if change.remove:
+                        await member.remove_roles(*change.remove, reason=change.reason)
+                return
+            except discord.Forbidden:
+                log.warning(f"Missing permissions to update roles for {member} in {member.guild}")
+                return
+            except discord.NotFound:
+                return
+            except discord.HTTPException as e:
+                if e.status == 429 and not attempt:
+                    self.limiter.pause(10)
+                    continue
+                log.warning(f"Failed to update roles for {member} in {member.guild}: {e}")
+                return
+
+    async def drain(self, timeout: float) -> None:
+        """Wait up to `timeout` seconds for the queued changes to be applied, used before stopping"""
+        if self.task is None or self.task.done():
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self.task), timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Role queue did not finish within {timeout}s")
+        except Exception as e:
+            log.error("Role queue failed while draining", exc_info=e)
+
+    def stop(self) -> None:
+        if self.pending:
+            log.warning(f"Dropping {self.pending} queued role changes")
+        if self.task is not None:
+            self.task.cancel()
+        self.task = None
+        self.queue = None
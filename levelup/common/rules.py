@@ -0,0 +1,86 @@
+import typing as t
+from dataclasses import dataclass
+
+import discord
+
+if t.TYPE_CHECKING:
+    from .models import GuildSettings
+
+
+class MessageRules:
+    """Message XP eligibility rules of a guild, compiled into sets
+
+    The guild settings store channels, roles and users as lists, which would mean a linear scan of each list for
+    every message. These get compiled once and rebuilt whenever the guild's settings change.
+    """
+
+    __slots__ = (
+        "allowed_channels",
+        "ignored_channels",
+        "allowed_roles",
+        "ignored_roles",
+        "ignored_users",
+        "role_bonus",
+    )
+
+    def __init__(self, conf: "GuildSettings"):
+        self.allowed_channels: t.FrozenSet[int] = frozenset(conf.allowedchannels)
+        self.ignored_channels: t.FrozenSet[int] = frozenset(conf.ignoredchannels)
+        self.allowed_roles: t.FrozenSet[int] = frozenset(conf.allowedroles)
+        self.ignored_roles: t.FrozenSet[int] = frozenset(conf.ignoredroles)
+        self.ignored_users: t.FrozenSet[int] = frozenset(conf.ignoredusers)
+        self.role_bonus: t.Dict[int, t.Tuple[int, int]] = {k: tuple(v) for k, v in conf.rolebonus.msg.items()}
+
+    def channel_allowed(self, scope: t.Set[int]) -> bool:
+        """Check a channel against the allowed and ignored channels
+
+        Args:
+            scope (t.Set[int]): The channel ID along with its parent and category IDs, see `channel_scope`
+        """
+        if self.allowed_channels and self.allowed_channels.isdisjoint(scope):
+            return False
+        return self.ignored_channels.isdisjoint(scope)
+
+    def roles_allowed(self, role_ids: t.Set[int]) -> bool:
+        if self.allowed_roles and self.allowed_roles.isdisjoint(role_ids):
+            return False
+        return self.ignored_roles.isdisjoint(role_ids)
+
+    def bonus_roles(self, role_ids: t.Set[int]) -> t.List[t.Tuple[int, int]]:
+        """Get the message XP bonus ranges of the roles a member has"""
+        return [self.role_bonus[role_id] for role_id in self.role_bonus.keys() & role_ids]
+
+
+def channel_scope(channel: discord.abc.GuildChannel) -> t.Tuple[int, t.Set[int]]:
+    """Get the category ID of a channel along with the IDs that settings can match it by
+
+    Threads are matched by themselves, their parent channel and the parent's category.
+
+    Returns:
+        t.Tuple[int, t.Set[int]]: The category ID (0 if none) and the set of IDs
+    """
+    scope = {channel.id}
+    if isinstance(channel, discord.Thread):
+        scope.add(channel.parent_id)
+        parent = channel.parent
+        category_id = parent.category_id if parent else None
+    else:
+        category_id = channel.category_id
+    if category_id:
+        scope.add(category_id)
+    return category_id or 0, scope
+
+
+@dataclass
+class PendingXP:
+    """Message XP of a member waiting to be applied by the batch worker"""
+
+    member: discord.Member
+    message: discord.Message
+    xp: int = 0
+
+    def add(self, message: discord.Message, xp: int) -> None:
+        """Stack another grant, level up alerts go to the channel of the latest message"""
+        self.member = message.author
+        self.message = message
+        self.xp += xp
@@ -1,7 +1,5 @@
 import asyncio
-import json
 import logging
-import math
 import random
 import re
 import sys
@@ -16,14 +14,14 @@ from aiocache import cached
 from redbot.core import commands
 from redbot.core.i18n import Translator
 from redbot.core.utils.predicates import MessagePredicate
-from tenacity import (
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_random_exponential,
-)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from .const import COLORS
+from .levels import LevelTable
 
 _ = Translator("LevelUp", __file__)
 log = logging.getLogger("red.vrt.levelup.formatter")
@@ -225,69 +223,14 @@ async def confirm_msg(ctx: t.Union[commands.Context, discord.Interaction]) -> t.
         return pred.result
 
 
-@retry(
-    retry=retry_if_exception_type(json.JSONDecodeError),
-    wait=wait_random_exponential(min=120, max=600),
-    stop=stop_after_attempt(6),
-    reraise=True,
-)
-async def fetch_amari_payload(guild_id: int, page: int, key: str):
-    url = f"https://amaribot.com/api/v1/guild/leaderboard/{guild_id}?page={page}&limit=1000"
-    headers = {"Accept": "application/json", "Authorization": key, "User-Agent": "Mozilla/5.0"}
-    timeout = aiohttp.ClientTimeout(total=60)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        async with session.get(url, headers=headers) as res:
-            status = res.status
-            if status == 429:
-                log.warning("amari import is being rate limited!")
-            data = await res.json(content_type=None)
-            return data, status
-
-
-@retry(
-    retry=retry_if_exception_type(json.JSONDecodeError),
-    wait=wait_random_exponential(min=120, max=600),
-    stop=stop_after_attempt(6),
-    reraise=True,
-)
-async def fetch_polaris_payload(guild_id: int, page: int):
-    url = f"https://gdcolon.com/polaris/api/leaderboard/{guild_id}?page={page}"
-    timeout = aiohttp.ClientTimeout(total=60)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        async with session.get(url, headers={"Accept": "application/json", "User-Agent": "Mozilla/5.0"}) as res:
-            status = res.status
-            if status == 429:
-                log.warning("polaris import is being rate limited!")
-            data = await res.json(content_type=None)
-            return data, status
-
-
-@retry(
-    retry=retry_if_exception_type(json.JSONDecodeError),
-    wait=wait_random_exponential(min=120, max=600),
-    stop=stop_after_attempt(6),
-    reraise=True,
-)
-async def fetch_mee6_payload(guild_id: int, page: int):
-    url = f"https://mee6.xyz/api/plugins/levels/leaderboard/{guild_id}?page={page}&limit=1000"
-    timeout = aiohttp.ClientTimeout(total=60)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        async with session.get(url, headers={"Accept": "application/json", "User-Agent": "Mozilla/5.0"}) as res:
-            status = res.status
-            if status == 429:
-                log.warning("mee6 import is being rate limited!")
-            data = await res.json(content_type=None)
-            return data, status
-
-
 def get_level(xp: int, base: int, exp: int) -> int:
     """Get a level that would be achieved from the amount of XP"""
-    return int((xp / base) ** (1 / exp))
+    return LevelTable.get(base, exp).get_level(xp)
 
 
 def get_xp(level: int, base: int, exp: int) -> int:
     """Get how much XP is needed to reach a level"""
-    return math.ceil(base * (level**exp))
+    return LevelTable.get(base, exp).get_xp(level)
 
 
 # Estimate how much time it would take to reach a certain level based on current algorithm
@@ -306,18 +249,43 @@ def time_to_level(
     return time_to_reach_level
 
 
+def times_to_levels(
+    xp_needed: t.List[int],
+    xp_range: t.Tuple[int, int],
+    cooldown: int,
+) -> t.List[int]:
+    """Same estimate as `time_to_level` for several ascending XP amounts, from a single simulated user
+
+    Messages are simulated in vectorized chunks when NumPy is available.
+    """
+    if np is None or not xp_needed:
+        return [time_to_level(xp, xp_range, cooldown) for xp in xp_needed]
+    rng = np.random.default_rng()
+    target = xp_needed[-1]
+    # Enough messages to get there on average, topped up in case the dice were unkind
+    chunk = int(min(1_000_000, max(1000, target / max(1, sum(xp_range) / 2) * 1.2)))
+    xp_total = np.zeros(0, dtype=np.int64)
+    wait_total = np.zeros(0, dtype=np.int64)
+    while not len(xp_total) or xp_total[-1] < target:
+        gained = rng.integers(xp_range[0], xp_range[1] + 2, chunk)
+        waits = cooldown + np.where(rng.random(chunk) < 0.20, rng.integers(60, 7201, chunk), rng.integers(0, 61, chunk))
+        offset_xp = xp_total[-1] if len(xp_total) else 0
+        offset_wait = wait_total[-1] if len(wait_total) else 0
+        xp_total = np.concatenate([xp_total, np.cumsum(gained) + offset_xp])
+        wait_total = np.concatenate([wait_total, np.cumsum(waits) + offset_wait])
+    indexes = np.searchsorted(xp_total, xp_needed, side="left")
+    return [int(wait_total[i]) if i < len(wait_total) else 0 for i in indexes]
+
+
 def plot_levels(
     base: int, exponent: float, cooldown: int, xp_range: t.Tuple[int, int]
 ) -> t.Tuple[str, t.Optional[bytes]]:
     buffer = StringIO()
-    x, y = [], []
-    for level in range(1, 21):
-        xp_required = get_xp(level, base, exponent)
-        seconds_required = time_to_level(xp_required, xp_range, cooldown)
+    x = list(range(1, 21))
+    y = LevelTable.get(base, exponent).get_xps(x)
+    for level, xp_required, seconds_required in zip(x, y, times_to_levels(y, xp_range, cooldown)):
         time = humanize_delta(seconds_required)
         buffer.write(_("• lvl {}, {} xp, {}\n").format(level, xp_required, time))
-        x.append(level)
-        y.append(xp_required)
     try:
         fig = go.Figure()
         fig.add_trace(go.Scatter(x=x, y=y, mode="lines", name="Total"))
@@ -8,7 +8,6 @@ from redbot.core import commands
 from redbot.core.i18n import Translator
 
 from ..abc import MixinMeta
-from ..common import formatter
 
 _ = Translator("LevelUp", __file__)
 log = logging.getLogger("red.levelup.dashboard")
@@ -87,36 +86,31 @@ class DashboardIntegration(MixinMeta):
             + f"\n\n<script>\n{js_path.read_text()}\n</script>"
         )
 
-        """
-        {
-            "title": str,
-            "description": str,
-            "stat": str,
-            "stats": [{"position": int, "name": str, "id": int, "stat": str}]
-            "total": str,
-            "type": leaderboard type,  // lb or weekly
-            "user_position": int, // Index of the user in the leaderboard
-        }
-        """
-        res: dict = await asyncio.to_thread(
-            formatter.get_leaderboard,
-            bot=self.bot,
-            guild=guild,
-            db=self.db,
-            stat=stat,
-            lbtype=lbtype,
-            is_global=False,
-            member=guild.get_member(user.id),
-            use_displayname=True,
-            dashboard=True,
-        )
+        extra = kwargs.get("extra_kwargs") or {}
+        try:
+            page = int(extra.get("page", 1))
+            per_page = int(extra.get("perPage", 100))
+        except ValueError:
+            page, per_page = 1, 100
+        query = str(extra.get("query", "")).strip()[:100]
+
+        # Snapshots are shared between requests, so paging and searching don't rebuild the leaderboard
+        snapshot = await asyncio.to_thread(self.lb_cache.get, self.bot, guild, self.db, lbtype, stat)
+        res = await asyncio.to_thread(snapshot.page, self.db, page, per_page, query)
+        position = snapshot.positions.get(user.id)
         data = {
             "user_id": user.id,
             "users": res["stats"],
             "stat": stat,
-            "total": res["description"].replace("`", ""),
+            "total": snapshot.description.replace("`", ""),
             "type": lbtype,
-            "page": int(kwargs["extra_kwargs"].get("page", 1)),
+            "page": res["page"],
+            "pages": res["pages"],
+            "perPage": res["per_page"],
+            "count": res["count"],
+            "query": query,
+            # Page the user is on when nothing is searched
+            "userPage": position // res["per_page"] + 1 if position is not None else None,
         }
         content = {
             "status": 0,
@@ -124,7 +118,7 @@ class DashboardIntegration(MixinMeta):
                 "source": source,
                 "data": data,
                 "stat": stat,
-                "statname": res["stat"],
+                "statname": snapshot.statname,
                 "expanded": True,
             },
         }
@@ -192,7 +186,7 @@ class DashboardIntegration(MixinMeta):
             conf.enabled = form.enabled.data
             conf.algorithm.base = form.algo_base.data or 100
             conf.algorithm.exp = form.algo_multiplier.data or 2.0
-            self.save()
+            self.save(guild=guild)
             return {
                 "status": 0,
                 "notifications": [{"message": _("Settings saved"), "category": "success"}],
@@ -1,9 +1,13 @@
 document.addEventListener('alpine:init', () => {
     Alpine.data('leaderBoard', (data = {}) => ({
         // DATA INITIALIZATION
-        searchQuery: '',
+        // Pages are cut and searched server-side, `users` only holds the current page
+        searchQuery: data.query || '',
         page: data.page,
-        perPage: 100,
+        pages: data.pages,
+        perPage: data.perPage,
+        count: data.count,
+        userPage: data.userPage,
         users: data.users,
         sortStat: data.stat,  // Can be exp, messages, voice, stars
         sortOptions: ['exp', 'messages', 'voice', 'stars'],
@@ -14,67 +18,55 @@ document.addEventListener('alpine:init', () => {
         trippyMode: false,
         trippyEnabled: false,
         typingTimer: null,
+        searchTimer: null,
 
         // USER PAGINATION FUNCTIONS
         getPageUsers() {
-            console.log("Fetching users for page", this.page);
-            console.log(`There are ${this.users.length} users in total`);
-            if (this.searchQuery === "") {
-                return this.users.slice((this.page - 1) * this.perPage, this.page * this.perPage);
-            } else {
-                // Need to filter users based on search query
-                const filteredUsers = this.filterUsers();
-                return filteredUsers.slice((this.page - 1) * this.perPage, this.page * this.perPage);
-            }
+            return this.users;
         },
         nextPage() {
-            if (this.page * this.perPage < this.users.length) {
-                this.page++;
-                this.updateUrlParam('page', this.page);
+            if (this.page < this.pages) {
+                this.goTo({ page: this.page + 1 });
             }
         },
         prevPage() {
             if (this.page > 1) {
-                this.page--;
-                this.updateUrlParam('page', this.page);
+                this.goTo({ page: this.page - 1 });
+            }
+        },
+        goToMyPage() {
+            if (this.userPage) {
+                this.goTo({ page: this.userPage, query: '' });
             }
         },
         setPerPage(value) {
             if (this.perPage !== value) {
-                this.perPage = value;
-                this.page = 1; // Reset to first page when changing items per page
                 localStorage.setItem('leaderBoardPerPage', value);
-                this.updateUrlParam('perPage', value);
-                this.getPageUsers();
+                this.goTo({ perPage: value, page: 1 });
             }
         },
         getPageCount() {
-            if (this.searchQuery === "") {
-                return Math.ceil(this.users.length / this.perPage);
-            } else {
-                // Need to filter users based on search query
-                const filteredUsers = this.filterUsers();
-                return Math.ceil(filteredUsers.length / this.perPage);
-            }
+            return this.pages;
         },
 
         // URL AND BROWSER HISTORY MANAGEMENT
-        updateUrlParam(param, value) {
-            // Get current URL and parse its query parameters
+        goTo(params) {
+            // Load another page from the server with the given query parameters changed
             const url = new URL(window.location.href);
-            // Update or add the parameter
-            url.searchParams.set(param, value);
-            // Update browser history without refreshing
-            history.pushState({}, '', url.toString());
+            for (const [param, value] of Object.entries(params)) {
+                if (value === '' || value === null) {
+                    url.searchParams.delete(param);
+                } else {
+                    url.searchParams.set(param, value);
+                }
+            }
+            window.location.assign(url.toString());
         },
 
         // SEARCH AND FILTERING
         filterUsers() {
-            // Filter users based on search query
-            if (this.searchQuery === "") {
-                return this.users;
-            }
-            return this.users.filter(user => user.name.toLowerCase().includes(this.searchQuery.toLowerCase()));
+            // Kept for the template, the server already filtered the page
+            return this.users;
         },
 
         // TRIPPY MODE FUNCTIONALITY
@@ -108,29 +100,14 @@ document.addEventListener('alpine:init', () => {
 
         // INITIALIZATION AND LOCAL STORAGE
         init() {
-            console.log(`Leaderboard initialized starting on page ${this.page}`);
+            console.log(`Leaderboard initialized on page ${this.page} of ${this.pages}`);
 
-            // Store the URL-provided page (if any)
-            const urlProvidedPage = this.page;
-
-            // Only use localStorage page if no page was specified in the URL (or was specified as 1)
-            if (!urlProvidedPage || urlProvidedPage === 1) {
-                const storedPage = localStorage.getItem('leaderBoardPage');
-                if (storedPage !== null) {
-                    this.page = parseInt(storedPage) || 1;
-                }
-            }
-
-            // Retrieve stored values if available
-            const storedSearch = localStorage.getItem('leaderBoardSearch');
-            if (storedSearch !== null) {
-                this.searchQuery = storedSearch;
-            }
-
-            // Get stored perPage preference
-            const storedPerPage = localStorage.getItem('leaderBoardPerPage');
-            if (storedPerPage !== null) {
-                this.perPage = parseInt(storedPerPage) || 100;
+            // Apply the stored perPage preference if the URL didn't ask for one
+            const url = new URL(window.location.href);
+            const storedPerPage = parseInt(localStorage.getItem('leaderBoardPerPage'));
+            if (!url.searchParams.has('perPage') && storedPerPage && storedPerPage !== this.perPage) {
+                this.goTo({ perPage: storedPerPage });
+                return;
             }
 
             // Load trippy preference
@@ -157,20 +134,18 @@ document.addEventListener('alpine:init', () => {
             }
 
             // WATCHERS
-            // Watch for changes to store them
             this.$watch('searchQuery', (newquery, oldquery) => {
-                console.log(`Search query changed from ${oldquery} to ${newquery}`);
-                localStorage.setItem('leaderBoardSearch', newquery);
-                this.page = 1;
-                localStorage.setItem('leaderBoardPage', '1');
-                this.getPageUsers();
+                // Search on the server once typing stops
+                if (this.searchTimer) {
+                    clearTimeout(this.searchTimer);
+                }
+                this.searchTimer = setTimeout(() => {
+                    this.goTo({ query: newquery.trim(), page: 1 });
+                }, 400);
 
                 // Call typing handler when search query changes
                 this.handleTyping();
             });
-            this.$watch('page', (newpage, oldpage) => {
-                localStorage.setItem('leaderBoardPage', newpage);
-            });
         },
     }));
 });
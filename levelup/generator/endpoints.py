@@ -0,0 +1,248 @@
+import asyncio
+import base64
+import logging
+import random
+import typing as t
+from collections import deque
+from time import monotonic
+
+import aiohttp
+
+from .pool import percentile
+
+log = logging.getLogger("red.vrt.levelup.generator.endpoints")
+
+FAILURE_THRESHOLD = 3  # Consecutive failures before an endpoint's circuit opens
+OPEN_SECONDS = 30.0  # How long an open circuit stays open at first, doubles on each failed trial
+MAX_OPEN_SECONDS = 300.0
+HEALTH_INTERVAL = 30.0
+
+
+class Endpoint:
+    """An API running `generator/api.py`, with its latency and circuit breaker state"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.latency = 1.0  # Exponentially weighted average of successful render times
+        self.latencies: t.Deque[float] = deque(maxlen=100)
+        self.inflight = 0
+        self.failures = 0  # Consecutive
+        self.open_until = 0.0
+        self.open_seconds = OPEN_SECONDS
+        self.trial = False  # A half-open trial request is in flight
+        self.healthy = True
+        self.completed = 0
+        self.errors = 0
+
+    @property
+    def state(self) -> t.Literal["closed", "open", "half-open"]:
+        if self.failures < FAILURE_THRESHOLD:
+            return "closed"
+        return "open" if monotonic() < self.open_until else "half-open"
+
+    def available(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return self.healthy
+        return state == "half-open" and not self.trial
+
+    def weight(self) -> float:
+        return 1 / (self.latency * (1 + self.inflight))
+
+    def hedge_after(self) -> float:
+        """Seconds to wait on this endpoint before asking another, its p95 once there's enough to go on"""
+        if len(self.latencies) < 10:
+            return max(2.0, self.latency * 2)
+        return max(0.5, percentile(self.latencies, 95))
+
+    def success(self, elapsed: float) -> None:
+        self.latency = self.latency * 0.8 + elapsed * 0.2 if self.completed else elapsed
+        self.latencies.append(elapsed)
+        self.completed += 1
+        self.failures = 0
+        self.open_seconds = OPEN_SECONDS
+        self.healthy = True
+
+    def outrun(self, elapsed: float) -> None:
+        """Lost a race to a hedged request, it took at least this long so weigh it in without a failure"""
+        self.latency = max(self.latency, self.latency * 0.8 + elapsed * 0.2)
+
+    def failure(self) -> None:
+        self.errors += 1
+        self.failures += 1
+        if self.failures < FAILURE_THRESHOLD:
+            return
+        if self.failures > FAILURE_THRESHOLD:
+            # Failed its trial, back off further
+            self.open_seconds = min(MAX_OPEN_SECONDS, self.open_seconds * 2)
+        self.open_until = monotonic() + self.open_seconds
+        log.warning(f"Render endpoint {self.url} failed {self.failures} times, pausing it for {self.open_seconds}s")
+
+
+class EndpointPool:
+    """Spread image generation across every API running `generator/api.py`
+
+    Endpoints are picked at random weighted by their recent latency and how many requests they're handling.
+    If the chosen endpoint hasn't answered by its p95 latency the same request is sent to a second one and
+    whichever answers first wins. Endpoints that keep failing are skipped (circuit breaker) until a trial
+    request or a health check gets through, and all requests share one keep-alive session.
+
+    Args:
+        timeout (float, optional): Max seconds for a single render request. Defaults to 60.
+    """
+
+    def __init__(self, timeout: float = 60.0):
+        self.timeout = timeout
+        self.endpoints: t.Dict[str, Endpoint] = {}
+        self.session: t.Optional[aiohttp.ClientSession] = None
+        self.health_task: t.Optional[asyncio.Task] = None
+        self.hedged = 0
+
+    @property
+    def active(self) -> bool:
+        return bool(self.endpoints)
+
+    def set_urls(self, urls: t.List[str]) -> None:
+        """Replace the endpoints, keeping the stats of ones that are still listed"""
+        urls = [i.rstrip("/") for i in urls if i]
+        self.endpoints = {url: self.endpoints.get(url) or Endpoint(url) for url in dict.fromkeys(urls)}
+        if self.endpoints and self.health_task is None:
+            self.health_task = asyncio.create_task(self.health_loop())
+        elif not self.endpoints and self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=16, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, trust_env=True)
+        return self.session
+
+    async def close(self) -> None:
+        self.set_urls([])
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def health_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.gather(*(self.check(i) for i in list(self.endpoints.values())))
+            except Exception as e:
+                log.error("Render endpoint health check failed", exc_info=e)
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    async def check(self, endpoint: Endpoint) -> bool:
+        try:
+            timeout = aiohttp.ClientTimeout(total=5)
+            async with self.get_session().get(f"{endpoint.url}/health", timeout=timeout) as res:
+                healthy = res.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+        if healthy and not endpoint.healthy:
+            log.info(f"Render endpoint {endpoint.url} is healthy again")
+        elif not healthy and endpoint.healthy:
+            log.warning(f"Render endpoint {endpoint.url} failed its health check")
+        endpoint.healthy = healthy
+        if healthy and endpoint.state == "open":
+            # Let a trial request through now instead of waiting out the circuit
+            endpoint.open_until = 0
+        return healthy
+
+    def pick(self, exclude: t.Optional[Endpoint] = None) -> t.Optional[Endpoint]:
+        choices = [i for i in self.endpoints.values() if i is not exclude and i.available()]
+        if not choices:
+            return None
+        return random.choices(choices, weights=[i.weight() for i in choices])[0]
+
+    @staticmethod
+    def payload(fields: t.Dict[str, t.Any]) -> aiohttp.FormData:
+        # Form data can only be sent once, so every attempt gets its own
+        payload = aiohttp.FormData()
+        for key, value in fields.items():
+            if value is None:
+                continue
+            if isinstance(value, bytes):
+                payload.add_field(key, value, filename="data")
+            else:
+                payload.add_field(key, str(value))
+        return payload
+
+    async def request(self, endpoint: Endpoint, path: str, fields: t.Dict[str, t.Any]) -> t.Tuple[bytes, bool]:
+        if endpoint.state == "half-open":
+            endpoint.trial = True
+        endpoint.inflight += 1
+        start = monotonic()
+        try:
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            url = f"{endpoint.url}/{path}"
+            async with self.get_session().post(url, data=self.payload(fields), timeout=timeout) as res:
+                if res.status != 200:
+                    raise aiohttp.ClientResponseError(res.request_info, res.history, status=res.status)
+                data = await res.json()
+            img_bytes = base64.b64decode(data["b64"])
+        except asyncio.CancelledError:
+            # Lost the race to a hedged request, slow but not broken
+            endpoint.outrun(monotonic() - start)
+            raise
+        except Exception:
+            endpoint.failure()
+            raise
+        else:
+            endpoint.success(monotonic() - start)
+            return img_bytes, data["animated"]
+        finally:
+            endpoint.inflight -= 1
+            endpoint.trial = False
+
+    async def render(self, path: str, fields: t.Dict[str, t.Any]) -> t.Optional[t.Tuple[bytes, bool]]:
+        """Render an image on the best endpoint available
+
+        Args:
+            path (str): The API route, one of `fullprofile`, `runescape` or `levelup`
+            fields (t.Dict[str, t.Any]): Form fields, bytes are sent as files and None values are skipped
+
+        Returns:
+            t.Optional[t.Tuple[bytes, bool]]: The image bytes and whether it is animated, None if every endpoint
+                failed or none are available, in which case the image should be rendered locally
+        """
+        first = self.pick()
+        if first is None:
+            return None
+        tasks: t.Dict[asyncio.Task, Endpoint] = {asyncio.create_task(self.request(first, path, fields)): first}
+        hedge_at = monotonic() + first.hedge_after()
+        try:
+            while tasks:
+                wait = hedge_at - monotonic() if len(tasks) == 1 and hedge_at else None
+                done, _ = await asyncio.wait(tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    endpoint = tasks.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    log.warning(f"Render endpoint {endpoint.url} failed: {task.exception()!r}")
+                if not hedge_at:
+                    continue
+                # Too slow or failed, try another endpoint once
+                hedge_at = 0
+                if backup := self.pick(exclude=first):
+                    if not done:
+                        self.hedged += 1
+                    tasks[asyncio.create_task(self.request(backup, path, fields))] = backup
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def metrics(self) -> t.List[t.Dict[str, t.Any]]:
+        return [
+            {
+                "url": i.url,
+                "state": i.state if i.healthy else "unhealthy",
+                "latency": i.latency,
+                "p95": percentile(i.latencies, 95),
+                "inflight": i.inflight,
+                "completed": i.completed,
+                "errors": i.errors,
+            }
+            for i in self.endpoints.values()
+        ]
@@ -1,3 +1,4 @@
+import functools
 import logging
 import math
 import random
@@ -100,19 +101,23 @@ def make_circle_outline(thickness: int, color: tuple) -> Image.Image:
     return img
 
 
+@functools.lru_cache(maxsize=16)
+def get_circle_mask(size: t.Tuple[int, int], method: Image.Resampling = Image.Resampling.LANCZOS) -> Image.Image:
+    """Get a circle mask, cached since animated avatars need the same mask for every frame"""
+    # Create a mask at 4x size (So we can scale down to smooth the edges later)
+    mask = Image.new("L", (size[0] * 4, size[1] * 4), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse((0, 0, mask.width, mask.height), fill=255)
+    # Resize the mask to the image size
+    return mask.resize(size, method)
+
+
 def make_profile_circle(
     pfp: Image.Image,
     method: Image.Resampling = Image.Resampling.LANCZOS,
 ) -> Image.Image:
     """Crop an image into a circle"""
-    # Create a mask at 4x size (So we can scale down to smooth the edges later)
-    mask = Image.new("L", (pfp.width * 4, pfp.height * 4), 0)
-    draw = ImageDraw.Draw(mask)
-    draw.ellipse((0, 0, mask.width, mask.height), fill=255)
-    # Resize the mask to the image size
-    mask = mask.resize(pfp.size, method)
-    # Apply the mask
-    pfp.putalpha(mask)
+    pfp.putalpha(get_circle_mask(pfp.size, method))
     return pfp
 
 
@@ -388,5 +393,59 @@ def get_avg_duration(image: Image.Image) -> int:
         return 0
 
 
+def decimate(frame_count: int, duration: int, max_frames: int) -> t.Tuple[int, int]:
+    """Get the step to sample frames at to stay within a frame budget
+
+    Returns:
+        t.Tuple[int, int]: The step and the duration each sampled frame should be shown for
+    """
+    if not max_frames or frame_count <= max_frames:
+        return 1, duration
+    step = math.ceil(frame_count / max_frames)
+    return step, duration * step
+
+
+def get_gif_palette(frames: t.List[Image.Image], samples: int = 6) -> Image.Image:
+    """Build a single 128 color palette from a sample of frames
+
+    Quantizing every frame against the same palette is much cheaper than building one per frame,
+    and lets the encoder skip writing a local color table for each frame.
+    """
+    step = max(1, len(frames) // samples)
+    sampled = frames[::step][:samples]
+    thumb_size = (max(1, frames[0].width // 4), max(1, frames[0].height // 4))
+    montage = Image.new("RGB", (thumb_size[0] * len(sampled), thumb_size[1]))
+    for idx, frame in enumerate(sampled):
+        montage.paste(frame.convert("RGB").resize(thumb_size, Image.Resampling.NEAREST), (idx * thumb_size[0], 0))
+    return montage.quantize(colors=128, method=Image.Quantize.MEDIANCUT)
+
+
+def save_gif(frames: t.List[Image.Image], duration: int, max_bytes: int = 0) -> bytes:
+    """Encode frames as a looping GIF using a shared palette
+
+    If the result is larger than `max_bytes`, every other frame is dropped (doubling the frame duration)
+    until it fits or only one frame is left.
+    """
+    palette = get_gif_palette(frames)
+    paletted = [frame.convert("RGB").quantize(palette=palette, dither=Image.Dither.NONE) for frame in frames]
+    while True:
+        buffer = BytesIO()
+        paletted[0].save(
+            buffer,
+            format="GIF",
+            save_all=True,
+            append_images=paletted[1:],
+            duration=duration,
+            loop=0,
+            # The palette is already optimized, and Pillow's transparency optimization costs more than it saves
+            optimize=False,
+        )
+        if not max_bytes or buffer.tell() <= max_bytes or len(paletted) == 1:
+            return buffer.getvalue()
+        log.debug(f"GIF is {buffer.tell()} bytes with {len(paletted)} frames, dropping half the frames")
+        paletted = paletted[::2]
+        duration *= 2
+
+
 if __name__ == "__main__":
     print(calc_aspect_ratio(200, 70))
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import os
+import struct
+import sys
+import typing as t
+from collections import OrderedDict, deque
+from pathlib import Path
+from time import perf_counter
+
+import msgpack
+
+log = logging.getLogger("red.vrt.levelup.generator.pool")
+
+ROOT = Path(__file__).parent
+HEADER = struct.Struct(">I")
+DEFAULT_WORKERS: int = max(1, (os.cpu_count() or 1) - 1)
+
+
+class RenderPoolBusy(Exception):
+    """Raised when a job couldn't be queued before its timeout because the pool is full"""
+
+
+class RenderError(Exception):
+    """Raised when a worker failed to render an image"""
+
+
+class Job:
+    __slots__ = ("id", "fn", "kwargs", "guild_id", "future", "queued")
+
+    def __init__(self, job_id: int, fn: str, kwargs: dict, guild_id: int, future: asyncio.Future):
+        self.id = job_id
+        self.fn = fn
+        self.kwargs = kwargs
+        self.guild_id = guild_id
+        self.future = future
+        self.queued = perf_counter()
+
+
+class Worker:
+    """A render worker process and the task feeding it jobs"""
+
+    def __init__(self, pool: "RenderPool", index: int):
+        self.pool = pool
+        self.index = index
+        self.proc: t.Optional[asyncio.subprocess.Process] = None
+        self.task: t.Optional[asyncio.Task] = None
+
+    async def spawn(self) -> None:
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable,
+            str(ROOT / "worker.py"),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            cwd=str(ROOT),
+        )
+        log.debug(f"Render worker {self.index} started: {self.proc.pid}")
+
+    def kill(self) -> None:
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.kill()
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.proc is not None and self.proc.returncode is None:
+            # Closing stdin lets the worker exit on its own
+            self.proc.stdin.close()
+            try:
+                await asyncio.wait_for(self.proc.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                self.kill()
+        self.proc = None
+
+    async def run(self) -> None:
+        while True:
+            job = await self.pool.next_job()
+            if job.future.done():
+                # Caller gave up while it was queued
+                self.pool.finish(job)
+                continue
+            try:
+                if self.proc is None or self.proc.returncode is not None:
+                    await self.spawn()
+                result = await asyncio.wait_for(self.execute(job), timeout=self.pool.job_timeout)
+            except asyncio.CancelledError:
+                self.pool.finish(job)
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                # Timed out or the process died, either way it can't be trusted with the next job
+                self.kill()
+                self.proc = None
+                self.pool.failed += 1
+                self.pool.finish(job)
+                if not job.future.done():
+                    job.future.set_exception(RenderError(f"Render worker failed: {type(e).__name__}"))
+                continue
+            self.pool.finish(job, result.get("elapsed"))
+            if job.future.done():
+                continue
+            if result["ok"]:
+                job.future.set_result((result["data"], result["animated"]))
+            else:
+                self.pool.failed += 1
+                job.future.set_exception(RenderError(result["error"]))
+
+    async def execute(self, job: Job) -> dict:
+        raw = msgpack.packb({"id": job.id, "fn": job.fn, "kwargs": job.kwargs}, use_bin_type=True)
+        self.proc.stdin.write(HEADER.pack(len(raw)) + raw)
+        await self.proc.stdin.drain()
+        size = HEADER.unpack(await self.proc.stdout.readexactly(HEADER.size))[0]
+        return msgpack.unpackb(await self.proc.stdout.readexactly(size), raw=False)
+
+
+class RenderPool:
+    """Built-in pool of render processes, an alternative to the internal API that needs no web server
+
+    Jobs are queued per guild and handed to workers round-robin across guilds, so one busy guild can't starve
+    the others. The queue is bounded, once it is full callers wait for room until their timeout runs out.
+
+    Args:
+        workers (int): Number of render processes
+        max_queue (int): Max number of queued jobs across all guilds
+        max_guild_queue (int): Max number of queued jobs per guild
+        job_timeout (float): Seconds a single render may take before its worker gets restarted
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        max_queue: int = 200,
+        max_guild_queue: int = 25,
+        job_timeout: float = 60,
+    ):
+        self.max_queue = max_queue
+        self.max_guild_queue = max_guild_queue
+        self.job_timeout = job_timeout
+        self.workers: t.List[Worker] = [Worker(self, i) for i in range(max(1, workers))]
+
+        # Guild ID: pending jobs, ordered by which guild is served next
+        self.queues: t.OrderedDict[int, t.Deque[Job]] = OrderedDict()
+        self.queued = 0
+        self.cond = asyncio.Condition()
+        self.job_id = 0
+
+        # Metrics
+        self.inflight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.render_times: t.Deque[float] = deque(maxlen=500)
+        self.wait_times: t.Deque[float] = deque(maxlen=500)
+
+    @property
+    def running(self) -> bool:
+        return any(worker.task is not None for worker in self.workers)
+
+    async def start(self) -> None:
+        for worker in self.workers:
+            await worker.spawn()
+            worker.task = asyncio.create_task(worker.run())
+        log.info(f"Render pool started with {len(self.workers)} workers")
+
+    async def stop(self) -> None:
+        await asyncio.gather(*(worker.close() for worker in self.workers))
+        async with self.cond:
+            for queue in self.queues.values():
+                for job in queue:
+                    if not job.future.done():
+                        job.future.cancel()
+            self.queues.clear()
+            self.queued = 0
+            self.cond.notify_all()
+        log.info("Render pool stopped")
+
+    async def render(self, fn: str, kwargs: dict, guild_id: int = 0, timeout: float = 30) -> t.Tuple[bytes, bool]:
+        """Render an image in the pool
+
+        Args:
+            fn (str): The generator to use, one of `fullprofile`, `runescape` or `levelup`
+            kwargs (dict): Arguments for the generator
+            guild_id (int, optional): Jobs are balanced across guilds. Defaults to 0.
+            timeout (float, optional): Seconds to wait for room in the queue. Defaults to 30.
+
+        Raises:
+            RenderPoolBusy: If the queue stayed full for the whole timeout
+            RenderError: If the render failed
+
+        Returns:
+            t.Tuple[bytes, bool]: The image bytes and whether it is animated
+        """
+        future = asyncio.get_running_loop().create_future()
+
+        def _has_room() -> bool:
+            guild_queue = self.queues.get(guild_id)
+            return self.queued < self.max_queue and (guild_queue is None or len(guild_queue) < self.max_guild_queue)
+
+        async with self.cond:
+            try:
+                await asyncio.wait_for(self.cond.wait_for(_has_room), timeout=timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise RenderPoolBusy(f"Render queue is full ({self.queued} jobs queued)")
+            self.job_id += 1
+            job = Job(self.job_id, fn, {k: v for k, v in kwargs.items() if v is not None}, guild_id, future)
+            self.queues.setdefault(guild_id, deque()).append(job)
+            self.queued += 1
+            self.cond.notify_all()
+        return await future
+
+    async def next_job(self) -> Job:
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.queued > 0)
+            # Serve the guild at the front, then move it to the back if it has more jobs waiting
+            guild_id, queue = next(iter(self.queues.items()))
+            job = queue.popleft()
+            if queue:
+                self.queues.move_to_end(guild_id)
+            else:
+                del self.queues[guild_id]
+            self.queued -= 1
+            self.inflight += 1
+            self.wait_times.append(perf_counter() - job.queued)
+            # Let callers waiting for room know
+            self.cond.notify_all()
+            return job
+
+    def finish(self, job: Job, elapsed: t.Optional[float] = None) -> None:
+        self.inflight -= 1
+        if elapsed is not None:
+            self.completed += 1
+            self.render_times.append(elapsed)
+
+    def metrics(self) -> t.Dict[str, t.Union[int, float]]:
+        """Queue depth, counters and render/wait time percentiles (in seconds) of the last 500 jobs"""
+        return {
+            "workers": len(self.workers),
+            "queued": self.queued,
+            "inflight": self.inflight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "render_p50": percentile(self.render_times, 50),
+            "render_p95": percentile(self.render_times, 95),
+            "wait_p50": percentile(self.wait_times, 50),
+            "wait_p95": percentile(self.wait_times, 95),
+        }
+
+
+def percentile(values: t.Iterable[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
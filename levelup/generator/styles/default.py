@@ -6,7 +6,7 @@ import typing as t
 from io import BytesIO
 from pathlib import Path
 
-from PIL import Image, ImageDraw, ImageFont, ImageSequence, UnidentifiedImageError
+from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
 from redbot.core.i18n import Translator
 from redbot.core.utils.chat_formatting import humanize_number
 
@@ -103,6 +103,8 @@ def generate_default_profile(
     debug: bool = False,
     reraise: bool = False,
     square: bool = False,
+    max_frames: int = 100,
+    max_bytes: int = 8 * 1024 * 1024,
     **kwargs,
 ) -> t.Tuple[bytes, bool]:
     """
@@ -141,6 +143,8 @@ def generate_default_profile(
         debug (t.Optional[bool], optional): Whether to raise any errors rather than suppressing. Defaults to False.
         reraise (t.Optional[bool], optional): Whether to raise any errors rather than suppressing. Defaults to False.
         square (t.Optional[bool], optional): Whether to render the profile as a square. Defaults to False.
+        max_frames (t.Optional[int], optional): Frames are skipped evenly to stay under this count, 0 for no limit. Defaults to 100.
+        max_bytes (t.Optional[int], optional): Frame rate is halved until the GIF fits this size, 0 for no limit. Defaults to 8MB.
         **kwargs: Additional keyword arguments.
 
     Returns:
@@ -490,15 +494,14 @@ def generate_default_profile(
         card.paste(stats, (0, 0), stats)
 
         avg_duration = imgtools.get_avg_duration(pfp)
-        log.debug(f"Rendering pfp as gif with avg duration of {avg_duration}ms")
+        step, duration = imgtools.decimate(pfp.n_frames, avg_duration, max_frames)
+        log.debug(f"Rendering pfp as gif with avg duration of {avg_duration}ms (every {step} frame(s))")
         frames: t.List[Image.Image] = []
-        for frame in range(pfp.n_frames):
+        for frame in range(0, pfp.n_frames, step):
             pfp.seek(frame)
-            # Prepare copies of the card, stats, and pfp
+            # Only the avatar changes between frames, the card already has the stats on it
             card_frame = card.copy()
-            pfp_frame = pfp.copy()
-            if pfp_frame.mode != "RGBA":
-                pfp_frame = pfp_frame.convert("RGBA")
+            pfp_frame = pfp.convert("RGBA")
             # Resize the profile image for each frame
             pfp_frame = pfp_frame.resize(desired_pfp_size, Image.Resampling.NEAREST)
             # Crop the profile image into a circle
@@ -507,24 +510,14 @@ def generate_default_profile(
             card_frame.paste(pfp_frame, (circle_x, circle_y), pfp_frame)
             frames.append(card_frame)
 
-        buffer = BytesIO()
-        frames[0].save(
-            buffer,
-            format="GIF",
-            save_all=True,
-            append_images=frames[1:],
-            duration=avg_duration,
-            loop=0,
-            quality=75,
-            optimize=True,
-        )
-        buffer.seek(0)
+        result = imgtools.save_gif(frames, duration, max_bytes)
         if debug:
-            Image.open(buffer).show()
-        return buffer.getvalue(), True
+            Image.open(BytesIO(result)).show()
+        return result, True
     elif bg_animated and not pfp_animated:
         avg_duration = imgtools.get_avg_duration(card)
-        log.debug(f"Rendering card as gif with avg duration of {avg_duration}ms")
+        step, duration = imgtools.decimate(card.n_frames, avg_duration, max_frames)
+        log.debug(f"Rendering card as gif with avg duration of {avg_duration}ms (every {step} frame(s))")
         frames: t.List[Image.Image] = []
 
         if pfp.mode != "RGBA":
@@ -533,39 +526,27 @@ def generate_default_profile(
         pfp = pfp.resize(desired_pfp_size, Image.Resampling.LANCZOS)
         # Crop the profile image into a circle
         pfp = imgtools.make_profile_circle(pfp)
-        for frame in range(card.n_frames):
+        # The avatar and stats are the same on every frame, so flatten them into a single overlay
+        overlay = Image.new("RGBA", desired_card_size, (0, 0, 0, 0))
+        overlay.paste(pfp, (circle_x, circle_y), pfp)
+        overlay.alpha_composite(stats)
+        for frame in range(0, card.n_frames, step):
             card.seek(frame)
-            # Prepare copies of the card and stats
-            card_frame = card.copy()
+            card_frame = card.convert("RGBA")
             card_frame = imgtools.fit_aspect_ratio(card_frame, desired_card_size)
-            if card_frame.mode != "RGBA":
-                card_frame = card_frame.convert("RGBA")
 
-            # Paste items onto the card
+            # The background moves behind the blurred area, so it has to be blurred per frame
             if blur:
                 blur_section = imgtools.blur_section(card_frame, (blur_edge, 0, card_frame.width, card_frame.height))
                 card_frame.paste(blur_section, (blur_edge, 0), blur_section)
 
-            card_frame.paste(pfp, (circle_x, circle_y), pfp)
-            card_frame.paste(stats, (0, 0), stats)
-
+            card_frame.alpha_composite(overlay)
             frames.append(card_frame)
 
-        buffer = BytesIO()
-        frames[0].save(
-            buffer,
-            format="GIF",
-            save_all=True,
-            append_images=frames[1:],
-            duration=avg_duration,
-            loop=0,
-            quality=75,
-            optimize=True,
-        )
-        buffer.seek(0)
+        result = imgtools.save_gif(frames, duration, max_bytes)
         if debug:
-            Image.open(buffer).show()
-        return buffer.getvalue(), True
+            Image.open(BytesIO(result)).show()
+        return result, True
 
     # If we're here, both the avatar and background are gifs
     # Figure out how to merge the two frame counts and durations together
@@ -597,56 +578,50 @@ def generate_default_profile(
     # The maximum frame count should be no more than 20% offset from the image with the highest frame count to avoid filesize bloat
     max_frame_count = max(pfp.n_frames, card.n_frames) * 1.2
     max_frame_count = min(round(max_frame_count), num_combined_frames)
-    log.debug(f"Max frame count: {max_frame_count}")
-    # Create a list to store the combined frames
-    combined_frames = []
-    for frame_num in range(max_frame_count):
-        time = frame_num * combined_duration
+    step, duration = imgtools.decimate(max_frame_count, combined_duration, max_frames)
+    log.debug(f"Max frame count: {max_frame_count} (every {step} frame(s))")
 
-        # Calculate the frame index for both the card and pfp
-        card_frame_index = (time // card_duration) % card.n_frames
-        pfp_frame_index = (time // pfp_duration) % pfp.n_frames
+    # Source frames get reused across combined frames, so only prepare each of them once
+    card_frames: t.Dict[int, Image.Image] = {}
+    pfp_frames: t.Dict[int, Image.Image] = {}
 
-        # Get the frames for the card and pfp
-        card_frame = ImageSequence.Iterator(card)[card_frame_index]
-        pfp_frame = ImageSequence.Iterator(pfp)[pfp_frame_index]
+    def _card_frame(index: int) -> Image.Image:
+        if index not in card_frames:
+            card.seek(index)
+            card_frame = imgtools.fit_aspect_ratio(card.convert("RGBA"), desired_card_size)
+            if blur:
+                blur_section = imgtools.blur_section(card_frame, (blur_edge, 0, card_frame.width, card_frame.height))
+                # Paste onto the stats
+                card_frame.paste(blur_section, (blur_edge, 0), blur_section)
+            card_frames[index] = card_frame
+        return card_frames[index]
 
-        card_frame = imgtools.fit_aspect_ratio(card_frame, desired_card_size)
-        if card_frame.mode != "RGBA":
-            card_frame = card_frame.convert("RGBA")
+    def _pfp_frame(index: int) -> Image.Image:
+        if index not in pfp_frames:
+            pfp.seek(index)
+            pfp_frame = pfp.convert("RGBA").resize(desired_pfp_size, Image.Resampling.NEAREST)
+            pfp_frames[index] = imgtools.make_profile_circle(pfp_frame, method=Image.Resampling.NEAREST)
+        return pfp_frames[index]
 
-        if blur:
-            blur_section = imgtools.blur_section(card_frame, (blur_edge, 0, card_frame.width, card_frame.height))
-            # Paste onto the stats
-            card_frame.paste(blur_section, (blur_edge, 0), blur_section)
-        if pfp_frame.mode != "RGBA":
-            pfp_frame = pfp_frame.convert("RGBA")
+    # Create a list to store the combined frames
+    combined_frames = []
+    for frame_num in range(0, max_frame_count, step):
+        time = frame_num * combined_duration
 
-        pfp_frame = pfp_frame.resize(desired_pfp_size, Image.Resampling.NEAREST)
-        pfp_frame = imgtools.make_profile_circle(pfp_frame, method=Image.Resampling.NEAREST)
+        # Calculate the frame index for both the card and pfp
+        card_frame = _card_frame((time // card_duration) % card.n_frames).copy()
+        pfp_frame = _pfp_frame((time // pfp_duration) % pfp.n_frames)
 
         card_frame.paste(pfp_frame, (circle_x, circle_y), pfp_frame)
-        card_frame.paste(stats, (0, 0), stats)
+        card_frame.alpha_composite(stats)
 
         combined_frames.append(card_frame)
 
-    buffer = BytesIO()
-    combined_frames[0].save(
-        buffer,
-        format="GIF",
-        save_all=True,
-        append_images=combined_frames[1:],
-        loop=0,
-        duration=combined_duration,
-        quality=75,
-        optimize=True,
-    )
-    buffer.seek(0)
-
+    result = imgtools.save_gif(combined_frames, duration, max_bytes)
     if debug:
-        Image.open(buffer).show()
+        Image.open(BytesIO(result)).show()
 
-    return buffer.getvalue(), True
+    return result, True
 
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+"""
+Render worker for LevelUp's built-in render pool
+
+Runs as a standalone process spawned by the cog, reading jobs from stdin and writing results to stdout.
+Each message is a 4 byte big-endian length followed by a msgpack payload.
+
+Job: {"id": int, "fn": str, "kwargs": dict}
+Result: {"id": int, "ok": bool, "data": bytes, "animated": bool, "error": str, "elapsed": float}
+"""
+
+import logging
+import os
+import struct
+import sys
+from time import perf_counter
+
+import msgpack
+
+# Stdout is reserved for results, anything the generators print goes to stderr instead
+OUT = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+sys.stdout = sys.stderr
+
+from levelalert import generate_level_img  # noqa: E402
+from styles.default import generate_default_profile  # noqa: E402
+from styles.runescape import generate_runescape_profile  # noqa: E402
+
+log = logging.getLogger("red.vrt.levelup.generator.worker")
+HEADER = struct.Struct(">I")
+FUNCS = {
+    "fullprofile": generate_default_profile,
+    "runescape": generate_runescape_profile,
+    "levelup": generate_level_img,
+}
+
+
+def read_exactly(stream, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def send(payload: dict) -> None:
+    raw = msgpack.packb(payload, use_bin_type=True)
+    OUT.write(HEADER.pack(len(raw)) + raw)
+    OUT.flush()
+
+
+def main() -> None:
+    stdin = sys.stdin.buffer
+    while True:
+        try:
+            size = HEADER.unpack(read_exactly(stdin, HEADER.size))[0]
+            # Arrays come back as tuples since the generators expect colors as tuples
+            job: dict = msgpack.unpackb(read_exactly(stdin, size), raw=False, use_list=False)
+        except EOFError:
+            # Parent closed the pipe, time to go
+            return
+        start = perf_counter()
+        try:
+            img_bytes, animated = FUNCS[job["fn"]](**job["kwargs"])
+            result = {"id": job["id"], "ok": True, "data": img_bytes, "animated": animated}
+        except Exception as e:
+            log.error(f"Failed to render {job['fn']}", exc_info=e)
+            result = {"id": job["id"], "ok": False, "error": f"{type(e).__name__}: {e}"}
+        result["elapsed"] = perf_counter() - start
+        send(result)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
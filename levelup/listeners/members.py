@@ -16,8 +16,16 @@ class MemberListener(MixinMeta):
         conf = self.db.get_conf(member.guild)
         if not conf.enabled:
             return
+        conf.refresh_rank(member.id)
         added, removed = await self.ensure_roles(member, conf, "Member rejoined")
         if added:
             log.info(f"Added {len(added)} roles to {member} in {member.guild}")
         if removed:
             log.info(f"Removed {len(removed)} roles from {member} in {member.guild}")
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        if member.guild.id not in self.db.configs:
+            return
+        # Drop them from the leaderboards
+        self.db.get_conf(member.guild).refresh_rank(member.id)
@@ -6,6 +6,7 @@ import discord
 from redbot.core import commands
 
 from ..abc import MixinMeta
+from ..common.rules import PendingXP, channel_scope
 
 log = logging.getLogger("red.vrt.levelup.listeners.messages")
 
@@ -32,8 +33,7 @@ class MessageListener(MixinMeta):
         if await self.bot.cog_disabled_in_guild(self, message.guild):
             return
         try:
-            roles = list(message.author.roles)
-            role_ids = [role.id for role in roles]
+            role_ids = {role.id for role in message.author.roles}
         except AttributeError:
             # User sent messange and left immediately?
             return
@@ -41,8 +41,9 @@ class MessageListener(MixinMeta):
         if not conf.enabled:
             return
 
+        rules = conf.get_rules()
         user_id = message.author.id
-        if user_id in conf.ignoredusers:
+        if user_id in rules.ignored_users:
             # If we're specifically ignoring a user we don't want to see them anywhere
             return
 
@@ -53,87 +54,39 @@ class MessageListener(MixinMeta):
 
         if perf_counter() - self.last_save > 300:
             # Save at least every 5 minutes
-            self.save()
+            self.save(full=False)
 
-        prefixes = await self.bot.get_valid_prefixes(guild=message.guild)
-        if not conf.command_xp and message.content.startswith(tuple(prefixes)):
-            # Don't give XP for commands
+        # Cheap checks first so the prefix lookup only happens for messages that could earn XP
+        category_id, scope = channel_scope(message.channel)
+        if not rules.channel_allowed(scope):
             return
-
-        if conf.allowedchannels:
-            # Make sure the channel is allowed
-            if message.channel.id not in conf.allowedchannels:
-                # See if its category or parent channel is allowed then
-                if isinstance(message.channel, (discord.Thread, discord.ForumChannel)):
-                    channel_id = message.channel.parent_id
-                    if channel_id not in conf.allowedchannels:
-                        # Mabe the parent channel's category is allowed?
-                        category_id = message.channel.parent.category_id
-                        if category_id not in conf.allowedchannels:
-                            # Nope, not allowed
-                            return
-                else:
-                    channel_id = message.channel.category_id
-                    if channel_id and channel_id not in conf.allowedchannels:
-                        return
-
-        if message.channel.id in conf.ignoredchannels:
-            return
-        if (
-            isinstance(
-                message.channel,
-                (
-                    discord.Thread,
-                    discord.ForumChannel,
-                ),
-            )
-            and message.channel.parent_id in conf.ignoredchannels
-        ):
-            return
-        elif message.channel.category_id and message.channel.category_id in conf.ignoredchannels:
+        if not rules.roles_allowed(role_ids):
             return
-
-        if conf.allowedroles:
-            # Make sure the user has at least one allowed role
-            if not any(role in conf.allowedroles for role in role_ids):
-                return
-
-        if any(role in conf.ignoredroles for role in role_ids):
+        if len(message.content) <= conf.min_length:
             return
         now = perf_counter()
         last_messages = self.lastmsg.setdefault(message.guild.id, {})
-        addxp = False
-        if len(message.content) > conf.min_length:
-            if user_id not in last_messages:
-                addxp = True
-            elif now - last_messages[user_id] > conf.cooldown:
-                addxp = True
-
-        if not addxp:
+        if user_id in last_messages and now - last_messages[user_id] <= conf.cooldown:
             return
 
-        self.lastmsg[message.guild.id][user_id] = now
+        if not conf.command_xp:
+            prefixes = await self.bot.get_valid_prefixes(guild=message.guild)
+            if message.content.startswith(tuple(prefixes)):
+                # Don't give XP for commands
+                return
+
+        last_messages[user_id] = now
 
         xp_to_add = random.randint(conf.xp[0], conf.xp[1])
         # Add channel bonus if it exists
         channel_bonuses = conf.channelbonus.msg
-        category = None
-        if isinstance(message.channel, discord.Thread):
-            parent = message.channel.parent
-            if parent:
-                category = parent.category
-        else:
-            category = message.channel.category
-        cat_id = category.id if category else 0
-
         if message.channel.id in channel_bonuses:
             xp_to_add += random.randint(*channel_bonuses[message.channel.id])
-        elif cat_id in channel_bonuses:
-            xp_to_add += random.randint(*channel_bonuses[cat_id])
+        elif category_id in channel_bonuses:
+            xp_to_add += random.randint(*channel_bonuses[category_id])
         # Stack all role bonuses
-        for role_id, (bonus_min, bonus_max) in conf.rolebonus.msg.items():
-            if role_id in role_ids:
-                xp_to_add += random.randint(bonus_min, bonus_max)
+        for bonus_min, bonus_max in rules.bonus_roles(role_ids):
+            xp_to_add += random.randint(bonus_min, bonus_max)
 
         # Add presence bonus if applicable
         presence_status = str(message.author.status).lower()  # 'online', 'idle', 'dnd', 'offline'
@@ -152,9 +105,18 @@ class MessageListener(MixinMeta):
                 log.debug(f"Adding {app_bonus} application bonus XP to {message.author.name} for using {activity_name}")
 
         # Add the xp to the role groups
-        for role_id in role_ids:
-            if role_id in conf.role_groups:
-                conf.role_groups[role_id] += xp_to_add
+        for role_id in conf.role_groups.keys() & role_ids:
+            conf.role_groups[role_id] += xp_to_add
+
+        if self.db.batch_xp:
+            # Level ups get checked once per user by the batch worker
+            key = (message.guild.id, user_id)
+            if pending := self.pending_xp.get(key):
+                pending.add(message, xp_to_add)
+            else:
+                self.pending_xp[key] = PendingXP(member=message.author, message=message, xp=xp_to_add)
+            return
+
         # Add the xp to the user's profile
         log.debug(f"Adding {xp_to_add} xp to {message.author.name} in {message.guild.name}")
         profile.xp += xp_to_add
@@ -9,6 +9,7 @@ from redbot.core import commands
 
 from ..abc import MixinMeta
 from ..common.models import GuildSettings, VoiceTracking
+from ..common.rules import channel_scope
 
 log = logging.getLogger("red.vrt.levelup.listeners.voice")
 
@@ -16,6 +17,7 @@ log = logging.getLogger("red.vrt.levelup.listeners.voice")
 class VoiceListener(MixinMeta):
     async def initialize_voice_states(self) -> int:
         self.voice_tracking.clear()
+        self.voice_channels.clear()
 
         def _init() -> int:
             initialized = 0
@@ -26,10 +28,16 @@ class VoiceListener(MixinMeta):
                 conf = self.db.get_conf(guild)
                 if not conf.enabled:
                     continue
-                for member in guild.members:
-                    if member.voice and member.voice.channel:
-                        self.get_init_state(conf, member, perf)
-                        initialized += 1
+                in_voice = [m for m in guild.members if m.voice and m.voice.channel]
+                # Fill in the channels first so the solo check sees everyone
+                for member in in_voice:
+                    if not member.bot:
+                        self.voice_channels.setdefault(member.voice.channel.id, set()).add(member.id)
+                for member in in_voice:
+                    if member.bot and self.db.ignore_bots:
+                        continue
+                    self.get_init_state(conf, member, perf)
+                    initialized += 1
             return initialized
 
         return await asyncio.to_thread(_init)
@@ -52,6 +60,51 @@ class VoiceListener(MixinMeta):
             ),
         )
 
+    def refresh_voice_state(
+        self,
+        conf: GuildSettings,
+        member: discord.Member,
+        perf: float,
+        state: discord.VoiceState = None,
+    ) -> VoiceTracking:
+        """Re-evaluate whether a tracked member is earning XP and start or stop their idle timer"""
+        state = state or member.voice
+        earning_xp = self.can_gain_exp(conf, member, state)
+        user_data = self.get_init_state(conf, member, perf, state)
+        if user_data.not_gaining_xp and earning_xp:
+            log.debug(f"{member.name} now earning xp in {state.channel.name} in {member.guild}")
+            # User's state change means they can now earn exp again
+            user_data.not_gaining_xp = False
+            user_data.not_gaining_xp_time += perf - user_data.stopped_gaining_xp_at
+            user_data.stopped_gaining_xp_at = None
+        elif not user_data.not_gaining_xp and not earning_xp:
+            log.debug(f"{member.name} no longer earning xp in {state.channel.name} in {member.guild}")
+            # User's state change means they shouldnt earn exp
+            user_data.not_gaining_xp = True
+            user_data.stopped_gaining_xp_at = perf
+        return user_data
+
+    def refresh_solo_member(
+        self,
+        conf: GuildSettings,
+        channel: discord.abc.GuildChannel,
+        perf: float,
+        exclude: int = 0,
+    ) -> None:
+        """When a channel goes from one human to two (or back), the solo status of the other human flips
+
+        Args:
+            exclude (int, optional): The member that just joined, if any. Defaults to 0.
+        """
+        if not conf.ignore_solo:
+            return
+        humans = self.voice_channels.get(channel.id, set())
+        if len(humans) - (exclude in humans) != 1:
+            return
+        member = channel.guild.get_member(next(i for i in humans if i != exclude))
+        if member and member.voice and member.voice.channel:
+            self.refresh_voice_state(conf, member, perf)
+
     @commands.Cog.listener()
     async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
         # If roles changed and user is in VC, we need to check if they can gain exp
@@ -91,44 +144,18 @@ class VoiceListener(MixinMeta):
 
         if before.channel == after.channel:
             log.debug(f"Voice state changed for {member.name} in {member.guild}")
-            earning_xp = self.can_gain_exp(conf, member, after)
-            user_data = self.get_init_state(conf, member, perf, after)
-            if user_data.not_gaining_xp and earning_xp:
-                log.debug(f"{member.name} now earning xp in {after.channel.name} in {member.guild}")
-                # User's state change means they can now earn exp again
-                user_data.not_gaining_xp = False
-                user_data.not_gaining_xp_time += perf - user_data.stopped_gaining_xp_at
-                user_data.stopped_gaining_xp_at = None
-            elif not user_data.not_gaining_xp and not earning_xp:
-                log.debug(f"{member.name} no longer earning xp in {after.channel.name} in {member.guild}")
-                # User's state change means they shouldnt earn exp
-                user_data.not_gaining_xp = True
-                user_data.stopped_gaining_xp_at = perf
-            else:
-                # No meaningful state change, just return
-                pass
+            self.refresh_voice_state(conf, member, perf, after)
             return
 
         # Case 1: User joins VC
         if not before.channel and after.channel:
             log.debug(f"{member.name} joined VC {after.channel.name} in {member.guild}")
+            if not member.bot:
+                self.voice_channels.setdefault(after.channel.id, set()).add(member.id)
             self.get_init_state(conf, member, perf, after)
-            # Go ahead and update other users in the channel
-            for m in after.channel.members:
-                if m.id == member.id:
-                    # We just initialized them
-                    continue
-                user_data = self.get_init_state(conf, m, perf)
-                earning_xp = self.can_gain_exp(conf, m, m.voice)
-                if user_data.not_gaining_xp and earning_xp:
-                    log.debug(f"{m.name} now earning xp in {after.channel.name} in {member.guild}")
-                    user_data.not_gaining_xp = False
-                    user_data.not_gaining_xp_time += perf - user_data.stopped_gaining_xp_at
-                    user_data.stopped_gaining_xp_at = None
-                elif not user_data.not_gaining_xp and not earning_xp:
-                    log.debug(f"{m.name} no longer earning xp in {after.channel.name} in {member.guild}")
-                    user_data.not_gaining_xp = True
-                    user_data.stopped_gaining_xp_at = perf
+            if not member.bot:
+                # Whoever was alone in the channel isn't anymore
+                self.refresh_solo_member(conf, after.channel, perf, exclude=member.id)
             # No exp needs to be added here so just return
             return
 
@@ -153,6 +180,11 @@ class VoiceListener(MixinMeta):
 
         # Case 3: If we're here, the user left the VC
         log.debug(f"{member.name} left VC {before.channel.name} in {member.guild}")
+        humans = self.voice_channels.get(before.channel.id)
+        if humans is not None:
+            humans.discard(member.id)
+            if not humans:
+                del self.voice_channels[before.channel.id]
         # First lets add the time to the user, and exp if they were earning it
         data = voice.pop(member.id, None)
         if not data:
@@ -161,43 +193,84 @@ class VoiceListener(MixinMeta):
                 f"User {member.name} left VC but wasnt in voice cache in {member.guild}\nBefore: {before}\nAfter: {after}"
             )
             return
-        # Add whatever time is left that the user wasnt gaining exp to their total time not gaining exp
+        xp_added = self.credit_voice(conf, member, data, before.channel, perf)
+
+        # Whoever is left might be alone now
+        channel: discord.VoiceChannel = member.guild.get_channel(before.channel.id)
+        if not channel:
+            # User left channel because it was deleted?
+            log.warning(f"User {member.name} left VC {before.channel.name} but channel wasnt found in {member.guild}")
+        elif not member.bot:
+            self.refresh_solo_member(conf, channel, perf)
+
+        # Save the changes
+        self.save(full=False)
+        if xp_added:
+            # Check for levelups
+            await self.check_levelups(member.guild, member, conf.get_profile(member), conf, channel=channel)
+
+    def credit_voice(
+        self,
+        conf: GuildSettings,
+        member: discord.Member,
+        data: VoiceTracking,
+        channel: discord.abc.GuildChannel,
+        perf: float,
+    ) -> float:
+        """Credit the voice time and XP a member accrued since they joined or were last credited
+
+        The tracking data is reset to start counting from `perf`, so this can be called on every voice tick as well
+        as when the member leaves.
+
+        Returns:
+            float: The XP that was added
+        """
+        # Add whatever time the user wasnt gaining exp to their total time not gaining exp
         if data.not_gaining_xp and data.stopped_gaining_xp_at:
             data.not_gaining_xp_time += perf - data.stopped_gaining_xp_at
+            data.stopped_gaining_xp_at = perf
         # Calculate the total time the user spent in the VC
         total_time_in_voice = perf - data.joined
         # Effective time is the total time minus the time they weren't earning exp
-        effective_time = total_time_in_voice - data.not_gaining_xp_time
+        effective_time = max(0.0, total_time_in_voice - data.not_gaining_xp_time)
+        data.joined = perf
+        data.not_gaining_xp_time = 0.0
+        if total_time_in_voice <= 0:
+            return 0.0
+
         profile = conf.get_profile(member)
         weekly = conf.get_weekly_profile(member) if conf.weeklysettings.on else None
 
-        log.debug(f"{member.name} spent {round(total_time_in_voice, 2)}s in VC {before.channel.name} in {member.guild}")
+        log.debug(f"{member.name} spent {round(total_time_in_voice, 2)}s in VC {channel.name} in {member.guild}")
         if effective_time > 0:
             log.debug(f"{round(effective_time, 2)}s of that was effective time")
         profile.voice += total_time_in_voice
         if weekly:
             weekly.voice += total_time_in_voice
+        if not effective_time:
+            return 0.0
 
         # Calculate the exp to add
-        xp_to_add = conf.voicexp * (effective_time / 60)
-        cat_id = getattr(before.channel.category, "id", 0)
-        if before.channel.id in conf.channelbonus.voice:
-            xp_to_add += random.randint(*conf.channelbonus.voice[before.channel.id]) * (effective_time / 60)
+        minutes = effective_time / 60
+        xp_to_add = conf.voicexp * minutes
+        cat_id = getattr(channel, "category_id", None) or 0
+        if channel.id in conf.channelbonus.voice:
+            xp_to_add += random.randint(*conf.channelbonus.voice[channel.id]) * minutes
         elif cat_id in conf.channelbonus.voice:
-            xp_to_add += random.randint(*conf.channelbonus.voice[cat_id]) * (effective_time / 60)
+            xp_to_add += random.randint(*conf.channelbonus.voice[cat_id]) * minutes
 
         # Stack all role bonuses
-        role_ids = [role.id for role in member.roles]
-        for role_id, (bonus_min, bonus_max) in conf.rolebonus.voice.items():
-            if role_id in role_ids:
-                xp_to_add += random.randint(bonus_min, bonus_max) * (effective_time / 60)
+        role_ids = {role.id for role in member.roles}
+        for role_id in conf.rolebonus.voice.keys() & role_ids:
+            bonus_min, bonus_max = conf.rolebonus.voice[role_id]
+            xp_to_add += random.randint(bonus_min, bonus_max) * minutes
 
         # Add application bonus if the user was using a specific application
         if hasattr(member, "activity") and member.activity:
             activity_name = getattr(member.activity, "name", "").upper()
             if activity_name and activity_name in conf.appbonus.voice:
                 app_bonus_min, app_bonus_max = conf.appbonus.voice[activity_name]
-                app_bonus = random.randint(app_bonus_min, app_bonus_max) * (effective_time / 60)
+                app_bonus = random.randint(app_bonus_min, app_bonus_max) * minutes
                 xp_to_add += app_bonus
                 log.debug(
                     f"Adding {round(app_bonus, 2)} application bonus XP to {member.name} for using {activity_name}"
@@ -207,7 +280,7 @@ class VoiceListener(MixinMeta):
         presence_status = str(member.status).lower()  # 'online', 'idle', 'dnd', 'offline'
         if presence_status in conf.presencebonus.voice:
             bonus_min, bonus_max = conf.presencebonus.voice[presence_status]
-            presence_bonus = random.randint(bonus_min, bonus_max) * (effective_time / 60)
+            presence_bonus = random.randint(bonus_min, bonus_max) * minutes
             xp_to_add += presence_bonus
             log.debug(
                 f"Adding {round(presence_bonus, 2)} presence bonus XP to {member.name} for {presence_status} status"
@@ -219,34 +292,7 @@ class VoiceListener(MixinMeta):
             profile.xp += xp_to_add
             if weekly:
                 weekly.xp += xp_to_add
-
-        # Now we need to update everyone else in the channel in case the exp gaining states have changed
-        # Get the channel now that the user has left
-        channel: discord.VoiceChannel = member.guild.get_channel(before.channel.id)
-        if not channel:
-            # User left channel because it was deleted?
-            log.warning(f"User {member.name} left VC {before.channel.name} but channel wasnt found in {member.guild}")
-        else:
-            # Update everyone else in the channel
-            for m in channel.members:
-                if m.id == member.id:
-                    continue
-                earning_xp = self.can_gain_exp(conf, m, m.voice)
-                user_data = self.get_init_state(conf, m, perf)
-                if user_data.not_gaining_xp and earning_xp:
-                    log.debug(f"{m.name} now earning xp in {channel.name} in {member.guild}")
-                    user_data.not_gaining_xp = False
-                    user_data.not_gaining_xp_time += perf - user_data.stopped_gaining_xp_at
-                    user_data.stopped_gaining_xp_at = None
-                elif not user_data.not_gaining_xp and not earning_xp:
-                    log.debug(f"{m.name} no longer earning xp in {channel.name} in {member.guild}")
-                    user_data.not_gaining_xp = True
-                    user_data.stopped_gaining_xp_at = perf
-
-        # Save the changes
-        self.save()
-        # Check for levelups
-        await self.check_levelups(member.guild, member, profile, conf, channel=channel)
+        return xp_to_add
 
     def can_gain_exp(
         self,
@@ -266,33 +312,24 @@ class VoiceListener(MixinMeta):
         Returns:
             bool: Whether the user can gain exp
         """
-        addxp = True
+        rules = conf.get_rules()
         if conf.ignore_deafened and voice_state.self_deaf:
-            addxp = False
-        elif conf.ignore_muted and voice_state.self_mute:
-            addxp = False
-        elif conf.ignore_invisible and member.status.name == "offline":
-            addxp = False
-        elif any(role.id in conf.ignoredroles for role in member.roles):
-            addxp = False
-        elif member.id in conf.ignoredusers:
-            addxp = False
-        elif voice_state.channel.id in conf.ignoredchannels:
-            addxp = False
-        elif voice_state.channel.category_id and voice_state.channel.category_id in conf.ignoredchannels:
-            addxp = False
-        elif (
-            conf.ignore_solo and len([i for i in voice_state.channel.members if (not i.bot and i.id != member.id)]) < 1
-        ):
-            addxp = False
-        elif self.db.ignore_bots and member.bot:
-            addxp = False
-        elif conf.allowedchannels:
-            if voice_state.channel.id not in conf.allowedchannels:
-                if voice_state.channel.category_id:
-                    if voice_state.channel.category_id not in conf.allowedchannels:
-                        addxp = False
-                else:
-                    addxp = False
-
-        return addxp
+            return False
+        if conf.ignore_muted and voice_state.self_mute:
+            return False
+        if conf.ignore_invisible and member.status.name == "offline":
+            return False
+        if not rules.ignored_roles.isdisjoint(role.id for role in member.roles):
+            return False
+        if member.id in rules.ignored_users:
+            return False
+        if not rules.channel_allowed(channel_scope(voice_state.channel)[1]):
+            return False
+        if conf.ignore_solo:
+            # Humans in the channel are tracked as they come and go, so this doesn't scan the member list
+            humans = self.voice_channels.get(voice_state.channel.id, ())
+            if not any(user_id != member.id for user_id in humans):
+                return False
+        if self.db.ignore_bots and member.bot:
+            return False
+        return True
@@ -43,9 +43,17 @@ from redbot.core.utils.chat_formatting import box, humanize_list
 from .abc import CompositeMetaClass
 from .commands import Commands
 from .commands.user import view_profile_context
+from .common.cache import ContentCache, RenderCache
+from .common.journal import Journal
+from .common.lbcache import LeaderboardCache
 from .common.models import DB, VoiceTracking, run_migrations
+from .common.rolesync import RolePlan, RoleQueue
+from .common.rules import PendingXP
 from .dashboard.integration import DashboardIntegration
-from .generator import api
+from .generator import api, levelalert
+from .generator.endpoints import EndpointPool
+from .generator.pool import RenderError, RenderPool, RenderPoolBusy
+from .generator.styles import default, runescape
 from .generator.tenor.converter import TenorAPI
 from .listeners import Listeners
 from .shared import SharedFunctions
@@ -53,6 +61,13 @@ from .tasks import Tasks
 
 log = logging.getLogger("red.vrt.levelup")
 _ = Translator("LevelUp", __file__)
+
+# Same names as the API endpoints
+RENDERERS = {
+    "fullprofile": default.generate_default_profile,
+    "runescape": runescape.generate_runescape_profile,
+    "levelup": levelalert.generate_level_img,
+}
 RequestType = t.Literal["discord_deleted_user", "owner", "user", "user_strict"]
 IS_WINDOWS: bool = sys.platform.startswith("win")
 
@@ -77,7 +92,7 @@ class LevelUp(
     """
 
     __author__ = "[vertyco](https://github.com/vertyco/vrt-cogs)"
-    __version__ = "4.6.2"
+    __version__ = "4.20.0"
     __contributors__ = [
         "[aikaterna](https://github.com/aikaterna/aikaterna-cogs)",
         "[AAA3A](https://github.com/AAA3A-AAA3A/AAA3A-cogs)",
@@ -90,11 +105,17 @@ class LevelUp(
         # Cache
         self.db: DB = DB()
         self.lastmsg: t.Dict[int, t.Dict[int, float]] = {}  # GuildID: {UserID: LastMessageTime}
-        self.profile_cache: t.Dict[int, t.Dict[int, t.Tuple[str, bytes]]] = {}  # GuildID: {UserID: (last_used, bytes)}
+        self.profile_cache: t.Dict[int, t.Dict[int, t.Tuple[float, str]]] = {}  # GuildID: {UserID: (rendered, key)}
         self.stars: t.Dict[int, t.Dict[int, datetime]] = {}  # Guild_ID: {User_ID: {User_ID: datetime}}
+        self.pending_xp: t.Dict[t.Tuple[int, int], PendingXP] = {}  # (GuildID, UserID): PendingXP
+        self.role_plans: t.Dict[int, RolePlan] = {}  # GuildID: RolePlan
+        self.role_queue: RoleQueue = RoleQueue()  # Role changes applied in the background
+        self.lb_cache: LeaderboardCache = LeaderboardCache()  # Dashboard leaderboard snapshots
 
         # {guild_id: {member_id: tracking_data}}
         self.voice_tracking: t.Dict[int, t.Dict[int, VoiceTracking]] = defaultdict(dict)
+        # {channel_id: {member_id}} of the humans in each voice channel, for the solo check
+        self.voice_channels: t.Dict[int, t.Set[int]] = {}
 
         # Root Paths
         self.cog_path = cog_data_path(self)
@@ -102,15 +123,20 @@ class LevelUp(
         # Settings Files
         self.settings_file = self.cog_path / "LevelUp.json"
         self.old_settings_file = self.cog_path / "settings.json"
+        self.journal_file = self.cog_path / "LevelUp.journal"
         # Custom Paths
         self.custom_fonts = self.cog_path / "fonts"
         self.custom_backgrounds = self.cog_path / "backgrounds"
+        # Cache Paths
+        self.render_cache = RenderCache(self.cog_path / "cache" / "renders")
+        self.content_cache = ContentCache(self.cog_path / "cache" / "downloads")
         # Bundled Paths
         self.stock = self.bundled_path / "stock"
         self.fonts = self.bundled_path / "fonts"
         self.backgrounds = self.bundled_path / "backgrounds"
 
         # Save State
+        self.journal = Journal(self.journal_file, self.settings_file)
         self.io_lock = asyncio.Lock()
         self.last_save: float = perf_counter()
         self.initialized: bool = False
@@ -120,6 +146,10 @@ class LevelUp(
 
         # Internal Profile Generator API
         self.api_proc: t.Union[asyncio.subprocess.Process, mp.Process, None] = None
+        # Built-in render process pool
+        self.render_pool: t.Optional[RenderPool] = None
+        # External/internal API endpoints
+        self.endpoints: EndpointPool = EndpointPool()
 
     async def cog_load(self) -> None:
         if hasattr(self.bot, "_levelup_internal_api"):
@@ -132,6 +162,22 @@ class LevelUp(
     async def cog_unload(self) -> None:
         self.bot.tree.remove_command(view_profile_context)
         self.stop_levelup_tasks()
+        if self.initialized:
+            # Flush whatever changed since the last save
+            await self.flush_xp(check_levelups=False)
+            await self.flush_voice(check_levelups=False)
+            async with self.io_lock:
+                if self.journal.should_compact:
+                    # A full save may still be waiting out the save throttle
+                    await self.journal.compact(self.db)
+                else:
+                    await self.journal.commit(self.db)
+        await self.content_cache.close()
+        await self.endpoints.close()
+        # Weekly winner roles are only queued, so give them a chance to go through before the queue is dropped
+        await self.role_queue.drain(timeout=15)
+        self.role_queue.stop()
+        await self.stop_render_pool()
 
     async def start_api(self) -> bool:
         if not self.db.internal_api_port:
@@ -144,6 +190,7 @@ class LevelUp(
             proc = await api.run(port=self.db.internal_api_port, log_dir=log_dir)
             self.api_proc = proc
             self.bot._levelup_internal_api = proc
+            self.refresh_endpoints()
             log.debug(f"API Process started: {proc.pid}")
             return True
         except Exception as e:
@@ -159,6 +206,7 @@ class LevelUp(
         proc: t.Union[asyncio.subprocess.Process, mp.Process, None] = self.api_proc
         self.api_proc = None
         self.bot._levelup_internal_api = None
+        self.refresh_endpoints()
         if proc is None:
             return False
         try:
@@ -172,23 +220,89 @@ class LevelUp(
         log.info(f"Terminated process: {proc.pid}, API is now stopped")
         return True
 
-    def save(self) -> None:
+    def refresh_endpoints(self) -> None:
+        """Point the endpoint pool at the external APIs, or the internal one if no external APIs are set"""
+        urls = [self.db.external_api_url, *self.db.external_api_urls]
+        if not any(urls) and self.db.internal_api_port and self.api_proc:
+            urls = [f"http://127.0.0.1:{self.db.internal_api_port}"]
+        self.endpoints.set_urls(urls)
+
+    async def start_render_pool(self) -> bool:
+        if not self.db.render_workers:
+            return False
+        if self.render_pool is not None:
+            return False
+        pool = RenderPool(workers=self.db.render_workers)
+        try:
+            await pool.start()
+        except Exception as e:
+            log.error("Failed to start render pool", exc_info=e)
+            await pool.stop()
+            return False
+        self.render_pool = pool
+        return True
+
+    async def stop_render_pool(self) -> bool:
+        pool, self.render_pool = self.render_pool, None
+        if pool is None:
+            return False
+        await pool.stop()
+        return True
+
+    async def render(self, fn: str, kwargs: t.Dict[str, t.Any], guild_id: int = 0) -> t.Tuple[bytes, bool]:
+        """Render an image locally, in the render pool if it is running, otherwise in a thread
+
+        Args:
+            fn (str): The generator to use, one of `fullprofile`, `runescape` or `levelup`
+            kwargs (t.Dict[str, t.Any]): Arguments for the generator
+            guild_id (int, optional): Pool jobs are balanced across guilds. Defaults to 0.
+
+        Returns:
+            t.Tuple[bytes, bool]: The image bytes and whether it is animated
+        """
+        if self.render_pool is not None:
+            try:
+                return await self.render_pool.render(fn, kwargs, guild_id=guild_id)
+            except RenderPoolBusy as e:
+                log.warning(f"{e}, rendering in a thread instead")
+            except RenderError as e:
+                log.error(f"Render pool failed to render {fn}, rendering in a thread instead: {e}")
+        return await asyncio.to_thread(RENDERERS[fn], **kwargs)
+
+    def save(self, full: bool = True, guild: t.Optional[t.Union[discord.Guild, int]] = None) -> None:
+        """Save the config
+
+        Args:
+            full (bool, optional): Write a full snapshot of the config. If False, only profiles that changed since
+                the last save are written, use this for frequent saves from listeners. Defaults to True.
+            guild (t.Optional[t.Union[discord.Guild, int]], optional): The guild whose settings changed or whose
+                profiles were edited in bulk, its leaderboard indexes and message rules are rebuilt. Defaults to None.
+        """
+        if guild is not None:
+            self.db.get_conf(guild).invalidate_caches()
+
         async def _save():
+            if not self.initialized:
+                # Do not save if not initialized, we don't want to overwrite the config with default data
+                return
+            if full:
+                # If this save gets skipped, the next one will pick it up
+                self.journal.compact_pending = True
             if self.io_lock.locked():
                 # Already saving, skip this
                 return
             if perf_counter() - self.last_save < 2:
                 # Do not save more than once every 2 seconds
                 return
-            if not self.initialized:
-                # Do not save if not initialized, we don't want to overwrite the config with default data
-                return
             try:
-                log.debug("Saving config")
                 async with self.io_lock:
-                    self.db.to_file(self.settings_file)
-                    await asyncio.to_thread(self.db.to_file, self.settings_file)
-                log.debug("Config saved")
+                    if self.journal.should_compact:
+                        log.debug("Saving config")
+                        await self.journal.compact(self.db)
+                        log.debug("Config saved")
+                    else:
+                        written = await self.journal.commit(self.db)
+                        log.debug(f"Journaled {written} changes")
             except Exception as e:
                 log.error("Failed to save config", exc_info=e)
             finally:
@@ -236,14 +350,27 @@ class LevelUp(
                     log.error("Failed to migrate old settings.json", exc_info=e)
                     return
 
+        replayed = 0
+        if self.journal_file.exists():
+            try:
+                replayed = await asyncio.to_thread(self.journal.replay, self.db)
+            except Exception as e:
+                log.error("Failed to replay config journal!", exc_info=e)
+                return
+            if replayed:
+                log.info(f"Replayed {replayed} journaled changes")
+
         log.info("Config initialized")
         self.initialized = True
 
-        if migrated:
+        if migrated or replayed:
+            # Fold everything into a fresh snapshot
             self.save()
 
         if voice_initialized := await self.initialize_voice_states():
             log.info(f"Initialized {voice_initialized} voice states")
+        if role_changes := await self.sync_weekly_roles():
+            log.info(f"Queued {role_changes} weekly winner role changes")
 
         self.start_levelup_tasks()
         self.custom_fonts.mkdir(exist_ok=True)
@@ -252,6 +379,8 @@ class LevelUp(
         await self.load_tenor()
         if self.db.internal_api_port and not self.db.external_api_url:
             await self.start_api()
+        self.refresh_endpoints()
+        await self.start_render_pool()
 
     async def load_tenor(self) -> None:
         tokens = await self.bot.get_shared_api_tokens("tenor")
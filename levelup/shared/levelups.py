@@ -1,19 +1,16 @@
-import asyncio
-import base64
 import logging
 import random
 import typing as t
 from contextlib import suppress
 from io import BytesIO
 
-import aiohttp
 import discord
 from redbot.core.i18n import Translator
 
 from ..abc import MixinMeta
 from ..common import utils
 from ..common.models import GuildSettings, Profile
-from ..generator import levelalert
+from ..common.rolesync import RolePlan
 
 log = logging.getLogger("red.vrt.levelup.shared.levelups")
 _ = Translator("LevelUp", __file__)
@@ -44,6 +41,8 @@ class LevelUps(MixinMeta):
         Returns:
             bool: True if the user leveled up, False otherwise.
         """
+        # XP is applied after the profile is fetched, so a leaderboard query in between would keep the old value
+        conf.refresh_rank(member.id)
         calculated_level = conf.algorithm.get_level(profile.xp)
         if calculated_level == profile.level:
             # No action needed, user hasn't leveled up
@@ -141,60 +140,36 @@ class LevelUps(MixinMeta):
             if color == (0, 0, 0):
                 color = utils.string_to_rgb(profile.namecolor) if profile.namecolor else None
 
-            payload = aiohttp.FormData()
-            if self.db.external_api_url or (self.db.internal_api_port and self.api_proc):
+            img_bytes, animated = None, None
+            if self.endpoints.active:
                 banner = await self.get_profile_background(member.id, profile, try_return_url=True)
                 avatar = member.display_avatar.url
-                payload.add_field(
-                    "background_bytes", BytesIO(banner) if isinstance(banner, bytes) else banner, filename="data"
-                )
-                payload.add_field("avatar_bytes", avatar)
-                payload.add_field("level", str(profile.level))
-                payload.add_field("color", str(color))
-                payload.add_field("font_path", font)
-                payload.add_field("render_gif", str(self.db.render_gifs))
-
+                fields = {
+                    "background_bytes": banner,
+                    "avatar_bytes": avatar,
+                    "level": profile.level,
+                    "color": color,
+                    "font_path": font,
+                    "render_gif": self.db.render_gifs,
+                }
+                if rendered := await self.endpoints.render("levelup", fields):
+                    img_bytes, animated = rendered
+                else:
+                    log.error("Failed to fetch levelup image from the API, rendering it locally")
             else:
-                avatar = await member.display_avatar.read()
+                avatar = await self.content_cache.fetch(member.display_avatar.url)
                 banner = await self.get_profile_background(member.id, profile)
 
-            img_bytes, animated = None, None
-            if external_url := self.db.external_api_url:
-                try:
-                    url = f"{external_url}/levelup"
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(url, data=payload) as response:
-                            if response.status == 200:
-                                data = await response.json()
-                                img_b64, animated = data["b64"], data["animated"]
-                                img_bytes = base64.b64decode(img_b64)
-                except Exception as e:
-                    log.error("Failed to fetch levelup image from external API", exc_info=e)
-            elif self.db.internal_api_port and self.api_proc:
-                try:
-                    url = f"http://127.0.0.1:{self.db.internal_api_port}/levelup"
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(url, data=payload) as response:
-                            if response.status == 200:
-                                data = await response.json()
-                                img_b64, animated = data["b64"], data["animated"]
-                                img_bytes = base64.b64decode(img_b64)
-                except Exception as e:
-                    log.error("Failed to fetch levelup image from internal API", exc_info=e)
-
-            def _run() -> t.Tuple[bytes, bool]:
-                img_bytes, animated = levelalert.generate_level_img(
-                    background_bytes=banner,
-                    avatar_bytes=avatar,
-                    level=profile.level,
-                    color=color,
-                    font_path=font,
-                    render_gif=self.db.render_gifs,
-                )
-                return img_bytes, animated
-
             if not img_bytes:
-                img_bytes, animated = await asyncio.to_thread(_run)
+                kwargs = {
+                    "background_bytes": banner,
+                    "avatar_bytes": avatar,
+                    "level": profile.level,
+                    "color": color,
+                    "font_path": font,
+                    "render_gif": self.db.render_gifs,
+                }
+                img_bytes, animated = await self.render("levelup", kwargs, guild_id=guild.id)
 
             ext = "gif" if animated else "webp"
             if conf.notifydm:
@@ -243,91 +218,16 @@ class LevelUps(MixinMeta):
             return [], []
         if reason is None:
             reason = _("Level Up")
-        conf.levelroles = dict(sorted(conf.levelroles.items(), key=lambda x: x[0], reverse=True))
-        to_add = set()
-        to_remove = set()
-        user_roles = member.roles
-        user_role_ids = [role.id for role in user_roles]
-        profile = conf.get_profile(member)
-
-        using_prestige = all([profile.prestige, conf.prestigelevel, conf.prestigedata, conf.keep_level_roles])
-
-        if using_prestige:
-            # User has prestiges and thus must meet the requirements for any level role inherently
-            valid_levels = conf.levelroles
-        else:
-            valid_levels = {k: v for k, v in conf.levelroles.items() if k <= profile.level}
-
-        valid_levels = dict(sorted(valid_levels.items(), key=lambda x: x[0]))
-
-        if conf.autoremove:
-            # Add highest level role and remove the rest
-            highest_role_id = 0
-            if valid_levels:
-                highest_role_id = valid_levels[max(list(valid_levels.keys()))]
-                if highest_role_id not in user_role_ids:
-                    to_add.add(highest_role_id)
-
-            for role_id in conf.levelroles.values():
-                if role_id != highest_role_id and role_id in user_role_ids:
-                    to_remove.add(role_id)
-        else:
-            # Ensure user has all roles up to their level
-            for level, role_id in conf.levelroles.items():
-                if level <= profile.level or using_prestige:
-                    if role_id not in user_role_ids:
-                        to_add.add(role_id)
-                elif role_id in user_role_ids:
-                    to_remove.add(role_id)
-
-        if profile.prestige and conf.prestigedata:
-            # Assign prestige roles
-            if conf.stackprestigeroles:
-                for prestige_level, pdata in conf.prestigedata.items():
-                    if profile.prestige < prestige_level:
-                        continue
-                    if pdata.role in user_role_ids:
-                        continue
-                    to_add.add(pdata.role)
-            else:
-                # Remove all prestige roles except the highest
-                for prestige_level, pdata in conf.prestigedata.items():
-                    if prestige_level == profile.prestige:
-                        if pdata.role not in user_role_ids:
-                            to_add.add(pdata.role)
-                        continue
-                    if pdata.role in user_role_ids:
-                        to_remove.add(pdata.role)
-
-        if weekly_role_id := conf.weeklysettings.role:
-            role_winners = conf.weeklysettings.last_winners
-            if not conf.weeklysettings.role_all and role_winners:
-                role_winners = [role_winners[0]]
-
-            if member.id in role_winners and weekly_role_id not in user_role_ids:
-                to_add.add(weekly_role_id)
-            elif member.id not in role_winners and weekly_role_id in user_role_ids:
-                to_remove.add(weekly_role_id)
-
-        add_roles: t.List[discord.Role] = []
-        remove_roles: t.List[discord.Role] = []
-        bad_roles = set()  # Roles that the bot can't manage or cant find
-        for role_id in to_add:
-            role = member.guild.get_role(role_id)
-            if role and role.position < member.guild.me.top_role.position:
-                add_roles.append(role)
-            else:
-                bad_roles.add(role_id)
-        for role_id in to_remove:
-            role = member.guild.get_role(role_id)
-            if role and role.position < member.guild.me.top_role.position:
-                remove_roles.append(role)
-            else:
-                bad_roles.add(role_id)
-
-        if bad_roles:
+        plan = self.get_role_plan(conf, member.guild)
+        if bad_roles := plan.bad & set(conf.levelroles.values()):
+            # Roles that the bot can't manage or cant find
             conf.levelroles = {k: v for k, v in conf.levelroles.items() if v not in bad_roles}
             self.save()
+            plan = self.get_role_plan(conf, member.guild)
+
+        to_add, to_remove = plan.diff(member, conf.users[member.id])
+        add_roles: t.List[discord.Role] = [role for i in to_add if (role := member.guild.get_role(i))]
+        remove_roles: t.List[discord.Role] = [role for i in to_remove if (role := member.guild.get_role(i))]
 
         try:
             if add_roles:
@@ -339,3 +239,11 @@ class LevelUps(MixinMeta):
             add_roles = []
             remove_roles = []
         return add_roles, remove_roles
+
+    def get_role_plan(self, conf: GuildSettings, guild: discord.Guild) -> RolePlan:
+        """The guild's role plan, rebuilt only when the role settings (or the guild's roles) changed"""
+        plan = self.role_plans.get(guild.id)
+        if plan is None or plan.signature != RolePlan.signature_of(conf, guild):
+            plan = RolePlan(conf, guild)
+            self.role_plans[guild.id] = plan
+        return plan
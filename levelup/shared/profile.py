@@ -1,12 +1,10 @@
 import asyncio
-import base64
 import logging
 import random
 import typing as t
 from io import BytesIO
 from time import perf_counter
 
-import aiohttp
 import discord
 from redbot.core import bank
 from redbot.core.i18n import Translator
@@ -14,8 +12,8 @@ from redbot.core.utils.chat_formatting import box, humanize_number
 
 from ..abc import MixinMeta
 from ..common import formatter, utils
+from ..common.cache import render_key
 from ..common.models import Profile
-from ..generator.styles import default, runescape
 
 log = logging.getLogger("red.vrt.levelup.shared.profile")
 _ = Translator("LevelUp", __file__)
@@ -29,7 +27,7 @@ class ProfileFormatting(MixinMeta):
         conf = self.db.get_conf(member.guild)
         profile = conf.get_profile(member)
         profile.xp += xp
-        self.save()
+        self.save(full=False)
         return int(profile.xp)
 
     async def set_xp(self, member: discord.Member, xp: int) -> int:
@@ -39,7 +37,7 @@ class ProfileFormatting(MixinMeta):
         conf = self.db.get_conf(member.guild)
         profile = conf.get_profile(member)
         profile.xp = xp
-        self.save()
+        self.save(full=False)
         return int(profile.xp)
 
     async def remove_xp(self, member: discord.Member, xp: int) -> int:
@@ -49,7 +47,7 @@ class ProfileFormatting(MixinMeta):
         conf = self.db.get_conf(member.guild)
         profile = conf.get_profile(member)
         profile.xp -= xp
-        self.save()
+        self.save(full=False)
         return int(profile.xp)
 
     async def get_profile_background(
@@ -70,13 +68,13 @@ class ProfileFormatting(MixinMeta):
             if banner_url := await self.get_banner(user_id):
                 if try_return_url:
                     return banner_url
-                if banner_bytes := await utils.get_content_from_url(banner_url):
+                if banner_bytes := await self.content_cache.fetch(banner_url):
                     return banner_bytes
 
         if profile.background.lower().startswith("http"):
             if try_return_url:
                 return profile.background
-            if content := await utils.get_content_from_url(profile.background):
+            if content := await self.content_cache.fetch(profile.background):
                 return content
 
         valid = list(self.backgrounds.glob("*.webp")) + list(self.custom_backgrounds.iterdir())
@@ -94,7 +92,7 @@ class ProfileFormatting(MixinMeta):
             if banner_url := await self.get_banner(user_id):
                 if try_return_url:
                     return banner_url
-                if banner_bytes := await utils.get_content_from_url(banner_url):
+                if banner_bytes := await self.content_cache.fetch(banner_url):
                     return banner_bytes
 
         # Check guild default background if available
@@ -102,7 +100,7 @@ class ProfileFormatting(MixinMeta):
             if guild_conf.default_background.lower().startswith("http"):
                 if try_return_url:
                     return guild_conf.default_background
-                if content := await utils.get_content_from_url(guild_conf.default_background):
+                if content := await self.content_cache.fetch(guild_conf.default_background):
                     return content
 
             # Check if guild default is a filename
@@ -237,11 +235,13 @@ class ProfileFormatting(MixinMeta):
             "stat_color": utils.string_to_rgb(profile.statcolor) if profile.statcolor else None,
             "level_bar_color": utils.string_to_rgb(profile.barcolor) if profile.barcolor else None,
             "render_gif": self.db.render_gifs,
+            "max_frames": self.db.gif_max_frames,
+            "max_bytes": self.db.gif_max_mb * 1024 * 1024,
             "reraise": reraise,
         }
 
         profile_style = conf.style_override or profile.style
-        if self.db.external_api_url or (self.db.internal_api_port and self.api_proc):
+        if self.endpoints.active:
             # We'll use the external/internal API, try to get URLs instead for faster http requests
             kwargs["avatar_bytes"] = member.display_avatar.url
             if profile_style != "runescape":
@@ -253,14 +253,14 @@ class ProfileFormatting(MixinMeta):
                 if member.top_role.icon:
                     kwargs["role_icon"] = member.top_role.icon.url
         else:
-            kwargs["avatar_bytes"] = await member.display_avatar.read()
+            kwargs["avatar_bytes"] = await self.content_cache.fetch(member.display_avatar.url)
             if profile_style != "runescape":
                 kwargs["background_bytes"] = await self.get_profile_background(member.id, profile, guild_id=guild.id)
                 if pdata and pdata.emoji_url:
-                    emoji_bytes = await utils.get_content_from_url(pdata.emoji_url)
+                    emoji_bytes = await self.content_cache.fetch(pdata.emoji_url)
                     kwargs["prestige_emoji"] = emoji_bytes
                 if member.top_role.icon:
-                    kwargs["role_icon"] = await member.top_role.icon.read()
+                    kwargs["role_icon"] = await self.content_cache.fetch(member.top_role.icon.url)
 
         if profile.font:
             if (self.fonts / profile.font).exists():
@@ -277,90 +277,51 @@ class ProfileFormatting(MixinMeta):
             # If this occurs we'll reset the background to default
             if "This content is no longer available." in str(background_bytes):
                 profile.background = "default"
-                self.save()
+                self.save(full=False)
                 log.warning(
                     f"User {member.name} ({member.id}) has a background that no longer exists! Resetting to default"
                 )
                 kwargs["background_bytes"] = await self.get_profile_background(member.id, profile)
 
+        # Same inputs means the same image, so never render it twice
+        cache_key = render_key(profile_style, kwargs, salt=self.__version__)
+        self.profile_cache.setdefault(guild.id, {})[member.id] = (perf_counter(), cache_key)
+        if cached := await self.render_cache.get(cache_key):
+            img_bytes, ext = cached
+            return discord.File(BytesIO(img_bytes), filename=f"profile.{ext}")
+
         endpoints = {
             "default": "fullprofile",
             "runescape": "runescape",
         }
-        payload = aiohttp.FormData()
-        if self.db.external_api_url or (self.db.internal_api_port and self.api_proc):
-            for key, value in kwargs.items():
-                if value is None:
-                    continue
-                if isinstance(value, bytes):
-                    payload.add_field(key, value, filename="data")
-                else:
-                    payload.add_field(key, str(value))
-
-        if external_url := self.db.external_api_url:
-            try:
-                url = f"{external_url}/{endpoints[profile_style]}"
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, data=payload) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            img_b64, animated = data["b64"], data["animated"]
-                            img_bytes = base64.b64decode(img_b64)
-                            ext = "gif" if animated else "webp"
-                            return discord.File(BytesIO(img_bytes), filename=f"profile.{ext}")
-                        log.error(f"Failed to fetch profile from external API: {response.status}")
-            except Exception as e:
-                log.error("Failed to fetch profile from external API", exc_info=e)
-        elif self.db.internal_api_port and self.api_proc:
-            try:
-                url = f"http://127.0.0.1:{self.db.internal_api_port}/{endpoints[profile_style]}"
-                async with aiohttp.ClientSession(trust_env=True) as session:
-                    async with session.post(url, data=payload, ssl=False) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            img_b64, animated = data["b64"], data["animated"]
-                            img_bytes = base64.b64decode(img_b64)
-                            ext = "gif" if animated else "webp"
-                            return discord.File(BytesIO(img_bytes), filename=f"profile.{ext}")
-                        log.error(f"Failed to fetch profile from internal API: {response.status}")
-            except Exception as e:
-                log.error("Failed to fetch profile from internal API", exc_info=e)
-
-        # By default we'll use the bundled generator
-        funcs = {
-            "default": default.generate_default_profile,
-            "runescape": runescape.generate_runescape_profile,
-        }
+        img_bytes, animated = None, False
+        if self.endpoints.active:
+            if rendered := await self.endpoints.render(endpoints[profile_style], kwargs):
+                img_bytes, animated = rendered
+            else:
+                log.error("Failed to fetch profile from the API, rendering it locally")
 
-        def _run() -> discord.File:
-            img_bytes, animated = funcs[profile_style](**kwargs)
-            ext = "gif" if animated else "webp"
-            return discord.File(BytesIO(img_bytes), filename=f"profile.{ext}")
+        if img_bytes is None:
+            # By default we'll use the bundled generator
+            img_bytes, animated = await self.render(endpoints[profile_style], kwargs, guild_id=guild.id)
 
-        file = await asyncio.to_thread(_run)
-        return file
+        ext = "gif" if animated else "webp"
+        await self.render_cache.put(cache_key, img_bytes, ext)
+        return discord.File(BytesIO(img_bytes), filename=f"profile.{ext}")
 
     async def get_user_profile_cached(self, member: discord.Member) -> t.Union[discord.File, discord.Embed]:
-        """Cached version of get_user_profile"""
+        """Cached version of get_user_profile
+
+        Returns the last render of the member's profile if it was made less than `cache_seconds` ago,
+        skipping the stat lookups and downloads needed to tell whether anything changed.
+        """
         if not self.db.cache_seconds:
             return await self.get_user_profile(member)
-        now = perf_counter()
-        cachedata = self.profile_cache.setdefault(member.guild.id, {}).get(member.id)
-        if cachedata is None:
-            file = await self.get_user_profile(member)
-            if not isinstance(file, discord.File):
-                return file
-            filebytes = file.fp.read()
-            self.profile_cache[member.guild.id][member.id] = (now, filebytes)
-            return discord.File(BytesIO(filebytes), filename="profile.webp")
-
-        last_used, imgbytes = cachedata
-        if last_used and now - last_used < self.db.cache_seconds:
-            return discord.File(BytesIO(imgbytes), filename="profile.webp")
-
-        file = await self.get_user_profile(member)
-        if not isinstance(file, discord.File):
-            return file
-        filebytes = file.fp.read()
-        self.profile_cache[member.guild.id][member.id] = (now, filebytes)
-        return discord.File(BytesIO(filebytes), filename="profile.webp")
+        cachedata = self.profile_cache.get(member.guild.id, {}).get(member.id)
+        if cachedata is not None:
+            last_used, cache_key = cachedata
+            if perf_counter() - last_used < self.db.cache_seconds:
+                if cached := await self.render_cache.get(cache_key):
+                    img_bytes, ext = cached
+                    return discord.File(BytesIO(img_bytes), filename=f"profile.{ext}")
+        return await self.get_user_profile(member)
@@ -1,7 +1,9 @@
+import asyncio
+import heapq
 import logging
 import typing as t
 from contextlib import suppress
-from datetime import timedelta
+from datetime import datetime, timedelta
 from io import StringIO
 
 import discord
@@ -10,7 +12,7 @@ from redbot.core.i18n import Translator
 from redbot.core.utils.chat_formatting import humanize_number
 
 from ..abc import MixinMeta
-from ..common import utils
+from ..common import archive, utils
 from ..common.models import ProfileWeekly
 
 log = logging.getLogger("red.vrt.levelup.shared.weeklyreset")
@@ -38,13 +40,35 @@ class WeeklyReset(MixinMeta):
             self.save()
             return False
 
-        valid_users: t.Dict[discord.Member, ProfileWeekly] = {}
-        for user_id, stats in conf.users_weekly.items():
-            user = guild.get_member(user_id)
-            if user and stats.xp > 0:
-                valid_users[user] = stats
-
-        if not valid_users:
+        # One pass over the weekly stats: archive every profile, total up the ones still in the server with XP,
+        # and keep only the top `count` of those in a heap instead of sorting everyone
+        snapshot = archive.WeeklySnapshot(int(datetime.now().timestamp()))
+        heap: t.List[t.Tuple[float, int, int, ProfileWeekly]] = []
+        count = max(1, conf.weeklysettings.count)
+        valid = 0
+        total_xp = 0
+        total_messages = 0
+        total_voicetime = 0
+        total_stars = 0
+        for idx, (user_id, stats) in enumerate(list(conf.users_weekly.items())):
+            if idx and not idx % 5000:
+                await asyncio.sleep(0)
+            snapshot.add(user_id, stats)
+            if stats.xp <= 0 or not guild.get_member(user_id):
+                continue
+            valid += 1
+            total_xp += stats.xp
+            total_messages += stats.messages
+            total_voicetime += stats.voice
+            total_stars += stats.stars
+            # Ties go to whoever was in the weekly data first
+            entry = (stats.xp, -idx, user_id, stats)
+            if len(heap) < count:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+
+        if not valid:
             log.info("No users with XP in the weekly data")
             if ctx:
                 await ctx.send(_("There are no users with XP in the weekly data yet"))
@@ -52,17 +76,14 @@ class WeeklyReset(MixinMeta):
             self.save()
             return False
 
+        try:
+            folder = archive.archive_dir(self.cog_path, guild.id)
+            await asyncio.to_thread(archive.write_snapshot, folder, snapshot)
+        except OSError as e:
+            log.error(f"Failed to archive weekly stats for {guild.name}", exc_info=e)
+
         channel = guild.get_channel(conf.weeklysettings.channel) if conf.weeklysettings.channel else None
 
-        total_xp = 0
-        total_messages = 0
-        total_voicetime = 0
-        total_stars = 0
-        for stats in valid_users.values():
-            total_xp += stats.xp
-            total_messages += stats.messages
-            total_voicetime += stats.voice
-            total_stars += stats.stars
         total_xp = humanize_number(int(total_xp))
         total_messages = humanize_number(total_messages)
         total_voicetime = utils.humanize_delta(total_voicetime)
@@ -92,12 +113,12 @@ class WeeklyReset(MixinMeta):
         )
         embed.set_thumbnail(url=guild.icon)
         place_emojis = ["🥇", "🥈", "🥉"]
-        sorted_users = sorted(valid_users.items(), key=lambda x: x[1].xp, reverse=True)
+        top: t.List[t.Tuple[discord.Member, ProfileWeekly]] = [
+            (member, entry[3]) for entry in sorted(heap, reverse=True) if (member := guild.get_member(entry[2]))
+        ]
         top_user_ids = []
-        for idx, (user, stats) in enumerate(sorted_users):
+        for idx, (user, stats) in enumerate(top):
             place = idx + 1
-            if place > conf.weeklysettings.count:
-                break
             top_user_ids.append(user.id)
             position = place_emojis[idx] if idx < 3 else f"#{place}."
             tmp = StringIO()
@@ -122,8 +143,6 @@ class WeeklyReset(MixinMeta):
                 else:
                     await channel.send(embed=embed)
 
-        top: t.List[t.Tuple[discord.Member, ProfileWeekly]] = sorted_users[: conf.weeklysettings.count]
-
         if conf.weeklysettings.role_all:
             winners: t.List[discord.Member] = [user[0] for user in top]
         else:
@@ -139,31 +158,15 @@ class WeeklyReset(MixinMeta):
 
         role = guild.get_role(conf.weeklysettings.role) if conf.weeklysettings.role else None
         if role and perms:
+            # Role changes are queued so the reset doesn't wait on Discord
             if conf.weeklysettings.remove:
                 for user_id in conf.weeklysettings.last_winners:
                     user = guild.get_member(user_id)
-                    if not user:
-                        continue
-                    user_roles = [role.id for role in user.roles]
-                    if role.id in user_roles and user.id not in winner_ids:
-                        try:
-                            await user.remove_roles(role, reason=_("Weekly winner role removal"))
-                        except discord.Forbidden:
-                            log.warning(f"Missing permissions to apply role {role} to {user.name}")
-                        except discord.HTTPException:
-                            pass
-
+                    if user and user.id not in winner_ids and user.get_role(role.id):
+                        self.role_queue.put(user, [], [role], _("Weekly winner role removal"))
             for winner in winners:
-                role_ids = [role.id for role in winner.roles]
-                if role.id in role_ids:
-                    # User already has the role
-                    continue
-                try:
-                    await winner.add_roles(role, reason=_("Weekly winner role addition"))
-                except discord.Forbidden:
-                    log.warning(f"Missing permissions to apply role {role} to {winner}")
-                except discord.HTTPException:
-                    pass
+                if not winner.get_role(role.id):
+                    self.role_queue.put(winner, [role], [], _("Weekly winner role addition"))
 
         conf.weeklysettings.last_winners = [user[0].id for user in top]
 
@@ -175,8 +178,42 @@ class WeeklyReset(MixinMeta):
         conf.weeklysettings.refresh()
         conf.users_weekly.clear()
         conf.weeklysettings.last_embed = embed.to_dict()
-        self.save()
+        self.save(guild=guild)
         if ctx:
             await ctx.send(_("Weekly stats have been reset."))
         log.info(f"Reset weekly stats for {guild.name}")
         return True
+
+    async def sync_weekly_roles(self) -> int:
+        """Queue any weekly winner role changes that were lost, such as by a restart right after a reset
+
+        The winners are re-derived from `last_winners`. With `remove` on, anyone else holding the role loses it.
+
+        Returns:
+            int: The number of role changes queued.
+        """
+        queued = 0
+        for guild_id, conf in self.db.configs.items():
+            if not conf.weeklysettings.on or not conf.weeklysettings.role or not conf.weeklysettings.last_winners:
+                continue
+            guild = self.bot.get_guild(guild_id)
+            if not guild or not guild.me.guild_permissions.manage_roles:
+                continue
+            role = guild.get_role(conf.weeklysettings.role)
+            if not role:
+                continue
+            if conf.weeklysettings.role_all:
+                winner_ids = set(conf.weeklysettings.last_winners)
+            else:
+                winner_ids = {conf.weeklysettings.last_winners[0]}
+            if conf.weeklysettings.remove:
+                for member in role.members:
+                    if member.id not in winner_ids:
+                        self.role_queue.put(member, [], [role], _("Weekly winner role removal"))
+                        queued += 1
+            for user_id in winner_ids:
+                member = guild.get_member(user_id)
+                if member and not member.get_role(role.id):
+                    self.role_queue.put(member, [role], [], _("Weekly winner role addition"))
+                    queued += 1
+        return queued
@@ -1,8 +1,10 @@
 from ..abc import CompositeMetaClass
+from .voice import VoiceTask
 from .weekly import WeeklyTask
+from .xpbatch import XPBatchTask
 
 
-class Tasks(WeeklyTask, metaclass=CompositeMetaClass):
+class Tasks(VoiceTask, WeeklyTask, XPBatchTask, metaclass=CompositeMetaClass):
     """
     Subclass all shared metaclassed parts of the cog
 
@@ -11,6 +13,10 @@ class Tasks(WeeklyTask, metaclass=CompositeMetaClass):
 
     def start_levelup_tasks(self):
         self.weekly_reset_check.start()
+        self.xp_batch_worker.start()
+        self.voice_xp_worker.start()
 
     def stop_levelup_tasks(self):
         self.weekly_reset_check.cancel()
+        self.xp_batch_worker.cancel()
+        self.voice_xp_worker.cancel()
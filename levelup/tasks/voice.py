@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from time import perf_counter
+
+import discord
+from discord.ext import tasks
+
+from ..abc import MixinMeta
+
+log = logging.getLogger("red.vrt.levelup.tasks.voice")
+
+loop_kwargs = {"seconds": 60}
+if discord.version_info >= (2, 4, 0):
+    loop_kwargs["name"] = "LevelUp.voice_xp_worker"
+
+
+class VoiceTask(MixinMeta):
+    @tasks.loop(**loop_kwargs)
+    async def voice_xp_worker(self):
+        await self.flush_voice()
+
+    @voice_xp_worker.before_loop
+    async def before_voice_xp_worker(self):
+        await self.bot.wait_until_red_ready()
+
+    async def flush_voice(self, check_levelups: bool = True) -> int:
+        """Credit the voice time and XP everyone in voice has accrued since the last tick
+
+        Members are credited as they go instead of only when they leave, so a restart or crash only loses the time
+        since the last tick. Earning states are re-evaluated as well in case settings changed since they joined.
+
+        Args:
+            check_levelups (bool, optional): If False, XP is only added to profiles. Defaults to True.
+
+        Returns:
+            int: The number of members that were credited
+        """
+        perf = perf_counter()
+        credited = 0
+        levelups = []
+        for guild_id, tracked in list(self.voice_tracking.items()):
+            guild = self.bot.get_guild(guild_id)
+            if not guild or not tracked:
+                continue
+            conf = self.db.get_conf(guild)
+            if not conf.enabled:
+                continue
+            for user_id, data in list(tracked.items()):
+                credited += 1
+                if not credited % 500:
+                    await asyncio.sleep(0)
+                member = guild.get_member(user_id)
+                if not member or not member.voice or not member.voice.channel:
+                    # Missed their leave event, they'll be credited if it shows up
+                    continue
+                try:
+                    xp = self.credit_voice(conf, member, data, member.voice.channel, perf)
+                    self.refresh_voice_state(conf, member, perf)
+                except Exception as e:
+                    log.error(f"Failed to credit voice time to {member} in {guild}", exc_info=e)
+                    continue
+                if xp and check_levelups:
+                    levelups.append((conf, member))
+
+        if not credited:
+            return 0
+        self.save(full=False)
+        for conf, member in levelups:
+            try:
+                await self.check_levelups(
+                    member.guild,
+                    member,
+                    conf.get_profile(member),
+                    conf,
+                    channel=member.voice.channel if member.voice else None,
+                )
+            except Exception as e:
+                log.error(f"Failed to check level ups for {member} in {member.guild}", exc_info=e)
+        log.debug(f"Credited voice time to {credited} members")
+        return credited
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+
+import discord
+from discord.ext import tasks
+
+from ..abc import MixinMeta
+
+log = logging.getLogger("red.vrt.levelup.tasks.xpbatch")
+
+loop_kwargs = {"seconds": 2}
+if discord.version_info >= (2, 4, 0):
+    loop_kwargs["name"] = "LevelUp.xp_batch_worker"
+
+
+class XPBatchTask(MixinMeta):
+    @tasks.loop(**loop_kwargs)
+    async def xp_batch_worker(self):
+        await self.flush_xp()
+
+    @xp_batch_worker.before_loop
+    async def before_xp_batch_worker(self):
+        await self.bot.wait_until_red_ready()
+
+    async def flush_xp(self, check_levelups: bool = True) -> int:
+        """Apply queued message XP, checking level ups once per member
+
+        Args:
+            check_levelups (bool, optional): If False, XP is only added to profiles, the level up will then be picked
+                up by the member's next message. Defaults to True.
+
+        Returns:
+            int: The number of members that were granted XP
+        """
+        if not self.pending_xp:
+            return 0
+        batch, self.pending_xp = self.pending_xp, {}
+        for idx, ((guild_id, user_id), pending) in enumerate(batch.items()):
+            if idx and not idx % 500:
+                await asyncio.sleep(0)
+            conf = self.db.get_conf(guild_id)
+            if not conf.enabled:
+                continue
+            profile = conf.get_profile(user_id)
+            profile.xp += pending.xp
+            if conf.weeklysettings.on:
+                conf.get_weekly_profile(user_id).xp += pending.xp
+            if not check_levelups:
+                continue
+            try:
+                await self.check_levelups(
+                    guild=pending.member.guild,
+                    member=pending.member,
+                    profile=profile,
+                    conf=conf,
+                    message=pending.message,
+                    channel=pending.message.channel,
+                )
+            except Exception as e:
+                log.error(f"Failed to check level ups for {pending.member} in {pending.member.guild}", exc_info=e)
+        log.debug(f"Granted queued XP to {len(batch)} members")
+        return len(batch)